@@ -12,9 +12,19 @@ RequestFailed, PreconditionFailed, CouchdbResource
 
     from couchdbkit.exceptions import InvalidAttachment, DuplicatePropertyError,\
 BadValueError, MultipleResultsFound, NoResultFound, ReservedWordError,\
-DocsPathNotFound, BulkSaveError
+DocsPathNotFound, BulkSaveError, DocsNotFound
 
     from couchdbkit.client import Server, Database, ViewResults, View, TempView
+    from couchdbkit.batching import DocLoader, BufferedWriter
+    from couchdbkit.bulk import BulkResult
+    from couchdbkit.cache import LRUCache, DocCache, DiskBackend, ViewCache, \
+RevCache
+    from couchdbkit.singleflight import SingleFlight
+    from couchdbkit.pool import ConnectionPool, PoolTimeout
+    from couchdbkit.retry import RetryPolicy, CircuitOpen
+    from couchdbkit.spool import WriteSpool
+    from couchdbkit.tracing import Tracer, LatencyHistogram, SlowRequestLogger
+    from couchdbkit.profiler import ViewProfiler
     from couchdbkit.consumer import Consumer
     from couchdbkit.external import External
     from couchdbkit.loaders import BaseDocsLoader, FileSystemDocsLoader
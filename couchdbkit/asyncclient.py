@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Asynchronous client. It mirrors `couchdbkit.client` but methods doing
+requests return a `couchdbkit.executor.Future` instead of waiting for the
+response. Requests are run by a pool of workers with their own keep-alive
+connection pool, so many operations can be in flight at the same time:
+
+    >>> from couchdbkit.asyncclient import AsyncServer
+    >>> server = AsyncServer(max_workers=20)
+    >>> db = server['mydb']
+    >>> futures = [db.open_doc(docid) for docid in docids]
+    >>> docs = [f.result() for f in futures]
+
+Rows of a view can be handled while they are read:
+
+    >>> def print_row(row):
+    ...     print row['id']
+    >>> db.view('_all_docs').each(print_row).result()
+
+And changes of a database followed in background:
+
+    >>> feed = db.changes(print_change, since=0)
+    >>> feed.stop()
+
+Params, errors (`ResourceNotFound`, `ResourceConflict`, ...) and results
+are the ones of `couchdbkit.client`.
+
+This is not non-blocking I/O: each request in flight holds an OS thread
+of the executor blocked on its socket, so `max_workers` bounds both the
+concurrency and the number of threads. For many concurrent requests
+without one thread each, use green threads instead: monkey patch the
+standard library and give a `couchdbkit.green.GreenPool` to the server
+(see `couchdbkit.green`), the workers are then greenlets.
+"""
+
+import threading
+
+from couchdbkit.client import Server
+from couchdbkit.consumer import Consumer
+from couchdbkit.executor import ThreadPoolExecutor, DEFAULT_MAX_WORKERS
+from couchdbkit.pool import ConnectionPool
+
+DEFAULT_CHANGES_TIMEOUT = 60000
+
+class AsyncServer(object):
+    """ asynchronous `couchdbkit.client.Server`
+
+    @param uri: uri of CouchDb host
+    @param max_workers: int, max number of requests in flight
+    @param executor: `couchdbkit.executor.ThreadPoolExecutor` used to run
+    requests. By default a new one with `max_workers` workers.
+    @param params: params of `couchdbkit.client.Server`. By default a
+    keep-alive pool of `max_workers` connections is created.
+    """
+
+    def __init__(self, uri='http://127.0.0.1:5984',
+            max_workers=DEFAULT_MAX_WORKERS, executor=None, **params):
+        if params.get('pool_instance') is None and \
+                params.get('resource_instance') is None:
+            params['pool_instance'] = ConnectionPool(keepalive=max_workers)
+        self.server = Server(uri, **params)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers)
+        self.executor = executor
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.server.uri)
+
+    def _submit(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+
+    def close(self):
+        """ stop the workers once pending requests are done """
+        self.executor.shutdown(wait=True)
+
+    def info(self, _raw_json=False):
+        return self._submit(self.server.info, _raw_json=_raw_json)
+
+    def all_dbs(self, _raw_json=False):
+        return self._submit(self.server.all_dbs, _raw_json=_raw_json)
+
+    def create_db(self, dbname):
+        """ future of the `AsyncDatabase` created """
+        return self._submit(self._wrap_db, self.server.create_db, dbname)
+
+    def get_or_create_db(self, dbname):
+        return self._submit(self._wrap_db, self.server.get_or_create_db,
+                dbname)
+
+    def delete_db(self, dbname):
+        return self._submit(self.server.delete_db, dbname)
+
+    def get_db(self, dbname):
+        """ return an `AsyncDatabase`, without request """
+        return AsyncDatabase(self.server[dbname], self.executor)
+    __getitem__ = get_db
+
+    def _wrap_db(self, func, dbname):
+        return AsyncDatabase(func(dbname), self.executor)
+
+class AsyncDatabase(object):
+    """ asynchronous `couchdbkit.client.Database`
+
+    @param db: `couchdbkit.client.Database` instance
+    @param executor: `couchdbkit.executor.ThreadPoolExecutor` instance
+    """
+
+    def __init__(self, db, executor):
+        self.db = db
+        self.executor = executor
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.db.dbname)
+
+    def _submit(self, func, *args, **kwargs):
+        return self.executor.submit(func, *args, **kwargs)
+
+    def info(self, _raw_json=False):
+        return self._submit(self.db.info, _raw_json=_raw_json)
+
+    def doc_exist(self, docid):
+        return self._submit(self.db.doc_exist, docid)
+
+    def open_doc(self, docid, **params):
+        return self._submit(self.db.open_doc, docid, **params)
+    get = open_doc
+
+    def open_docs(self, docids, **params):
+        return self._submit(self.db.open_docs, docids, **params)
+
+    def save_doc(self, doc, **params):
+        return self._submit(self.db.save_doc, doc, **params)
+
+    def bulk_save(self, docs, **params):
+        return self._submit(self.db.bulk_save, docs, **params)
+
+    def update_docs(self, docids, mutator, **params):
+        return self._submit(self.db.update_docs, docids, mutator, **params)
+
+    def bulk_delete(self, docs, **params):
+        return self._submit(self.db.bulk_delete, docs, **params)
+
+    def delete_doc(self, doc, **params):
+        return self._submit(self.db.delete_doc, doc, **params)
+
+    def copy_doc(self, doc, dest=None, **params):
+        return self._submit(self.db.copy_doc, doc, dest=dest, **params)
+
+    def put_attachment(self, doc, content, **params):
+        return self._submit(self.db.put_attachment, doc, content, **params)
+
+    def delete_attachment(self, doc, name):
+        return self._submit(self.db.delete_attachment, doc, name)
+
+    def fetch_attachment(self, id_or_doc, name, **params):
+        return self._submit(self.db.fetch_attachment, id_or_doc, name,
+                **params)
+
+    def view(self, view_name, **params):
+        """ return an `AsyncViewResults`, nothing is fetched yet """
+        return AsyncViewResults(self.db.view(view_name, **params),
+                self.executor)
+
+    def all_docs(self, **params):
+        return self.view('_all_docs', **params)
+
+    def changes(self, callback, **params):
+        """ follow changes in background and call `callback` with each
+        change. Return the `ChangesFeed`. See `ChangesFeed` for params.
+        """
+        feed = ChangesFeed(self.db, callback, **params)
+        feed.start()
+        return feed
+
+class ParallelDatabase(AsyncDatabase):
+    """ run calls on a database concurrently. Returned by
+    `couchdbkit.client.Database.parallel`. Methods are the ones of
+    `AsyncDatabase` and return futures. Results of all calls can be
+    collected in order with `results`:
+
+        >>> with db.parallel(max_workers=8) as p:
+        ...     for doc in docs:
+        ...         p.save_doc(doc)
+        >>> results = p.results()
+
+    `map` runs a method on each item of an iterable and return results in
+    order:
+
+        >>> docs = db.parallel(8).map('open_doc', docids)
+
+    @param db: `couchdbkit.client.Database` instance
+    @param max_workers: int, max number of calls running at the same time
+    """
+
+    def __init__(self, db, max_workers=DEFAULT_MAX_WORKERS):
+        AsyncDatabase.__init__(self, db, ThreadPoolExecutor(max_workers))
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _submit(self, func, *args, **kwargs):
+        future = AsyncDatabase._submit(self, func, *args, **kwargs)
+        self.futures.append(future)
+        return future
+
+    def map(self, method, *iterables):
+        """ call a method of the database with each item of iterables
+        and return the list of results. The first error is raised.
+
+        @param method: name of a `couchdbkit.client.Database` method or
+        callable
+        """
+        if isinstance(method, basestring):
+            method = getattr(self.db, method)
+        return list(self.executor.map(method, *iterables))
+
+    def results(self, return_exceptions=False):
+        """ wait for all calls and return their results in order
+
+        @param return_exceptions: bool, if True exceptions are returned
+        in the results instead of raising the first one.
+        """
+        results = []
+        for future in self.futures:
+            if return_exceptions and future.exception() is not None:
+                results.append(future.exception())
+            else:
+                results.append(future.result())
+        return results
+
+    def close(self):
+        """ wait for pending calls and stop the workers """
+        self.executor.shutdown(wait=True)
+
+class AsyncViewResults(object):
+    """ asynchronous `couchdbkit.client.ViewResults`
+
+    @param results: `couchdbkit.client.ViewResults` instance
+    @param executor: `couchdbkit.executor.ThreadPoolExecutor` instance
+    """
+
+    def __init__(self, results, executor):
+        self.results = results
+        self.executor = executor
+
+    def all(self):
+        """ future of the list of all results """
+        return self.executor.submit(self.results.all)
+
+    def first(self):
+        return self.executor.submit(self.results.first)
+
+    def one(self, except_all=False):
+        return self.executor.submit(self.results.one, except_all=except_all)
+
+    def count(self):
+        return self.executor.submit(self.results.count)
+
+    def each(self, callback, page_size=None):
+        """ call `callback` with each result while the response is read.
+        Return the future of the number of results.
+
+        @param callback: callable taking a result
+        @param page_size: int, if set results are fetched page by page,
+        see `couchdbkit.client.ViewResults.paged`.
+        """
+        def run():
+            if page_size is not None:
+                rows = self.results.paged(page_size)
+            else:
+                rows = self.results.iterator(stream=True)
+            count = 0
+            for row in rows:
+                callback(row)
+                count += 1
+            return count
+        return self.executor.submit(run)
+
+    def __getitem__(self, key):
+        return AsyncViewResults(self.results[key], self.executor)
+
+class ChangesFeed(object):
+    """ follow changes of a database in a background thread with longpoll
+    requests. Each change is passed to `callback`.
+
+    @param db: `couchdbkit.client.Database` instance
+    @param callback: callable taking a change
+    @param since: update sequence to start from
+    @param timeout: int, timeout in ms of longpoll requests. `stop` takes
+    effect at most after this delay.
+    @param params: other params of the changes API, like `filter` or
+    `include_docs`.
+    """
+
+    def __init__(self, db, callback, since=0,
+            timeout=DEFAULT_CHANGES_TIMEOUT, **params):
+        self.consumer = Consumer(db)
+        self.callback = callback
+        self.last_seq = since
+        self.timeout = timeout
+        self.params = params
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(1)
+        self.future = None
+
+    def start(self):
+        """ start to follow changes. `future` is the future of the last
+        update sequence read when the feed stops. """
+        self.future = self._executor.submit(self._run)
+        self._executor.shutdown(wait=False)
+        return self.future
+
+    def stop(self, wait=True):
+        """ stop to follow changes """
+        self._stop.set()
+        if wait and self.future is not None:
+            self.future.exception()
+
+    def _run(self):
+        while not self._stop.isSet():
+            result = self.consumer.fetch(feed="longpoll",
+                    since=self.last_seq, timeout=self.timeout, **self.params)
+            for change in result.get('results', []):
+                if self._stop.isSet():
+                    break
+                self.callback(change)
+                self.last_seq = change.get('seq', self.last_seq)
+            else:
+                self.last_seq = result.get('last_seq', self.last_seq)
+        return self.last_seq
@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Batching of document gets and saves. Gets of documents issued by several
+threads within a short time window, or deferred in a block of code, are
+deduplicated and sent in one `_all_docs?include_docs=true` request:
+
+    >>> loader = db.batching()
+    >>> with loader: # in each thread
+    ...     doc = Document.get(docid)
+
+In the block, `Database.open_doc` calls without options (and so
+`Document.get`) of the thread go through the loader. Blocks are bound to
+the thread entering them, other threads using the database aren't
+affected. Deferred gets coalesce gets done by one thread:
+
+    >>> loader = db.batching()
+    >>> deferred = [loader.defer(docid) for docid in docids]
+    >>> docs = [d.result() for d in deferred] # only one request
+
+Saves are buffered by a `BufferedWriter` and sent in `_bulk_docs`
+requests by a background thread, when enough documents are waiting or
+after a delay:
+
+    >>> with db.buffered(max_docs=500, interval=1.0) as writer:
+    ...     for event in events:
+    ...         Event(**event).save() # _id is set, not _rev yet
+    ...     future = writer.save({"type": "last"})
+    >>> future.result() # the buffer is flushed at the end of the block
+    {'id': '...', 'rev': '1-...'}
+"""
+
+from __future__ import with_statement
+
+import copy
+import sys
+import threading
+import time
+
+from couchdbkit.exceptions import DocsNotFound, BulkSaveError
+from couchdbkit.executor import Future
+from couchdbkit.resource import ResourceNotFound, ResourceConflict
+
+DEFAULT_BATCH_WAIT = 0.005
+DEFAULT_MAX_BATCH_SIZE = 1000
+DEFAULT_WRITE_INTERVAL = 1.0
+DEFAULT_WRITE_MAX_BYTES = 1024 * 1024
+DEFAULT_WRITE_MAX_PENDING = 10000
+
+class WriterFull(Exception):
+    """ raised when a document can't be buffered in time because too
+    many documents are waiting to be written """
+
+class _Batch(object):
+
+    def __init__(self):
+        self.ids = []
+        self.counts = {}
+        self.has_leader = False
+        self.started = False
+        self.done = threading.Event()
+        self.docs = {}
+        self.deleted = {}
+        self.error = None
+
+class DeferredDoc(object):
+    """ a document get waiting to be sent. `result` returns the
+    document, sending the pending gets if needed. """
+
+    def __init__(self, loader, batch, docid):
+        self.loader = loader
+        self.batch = batch
+        self.docid = docid
+
+    def result(self):
+        self.loader._dispatch(self.batch)
+        return self.loader._result(self.batch, self.docid)
+
+class DocLoader(object):
+    """ coalesce gets of documents in one request
+
+    @param db: `couchdbkit.client.Database` instance
+    @param wait: float, time in seconds the first get of a batch waits
+    for other gets before sending the request.
+    @param max_batch_size: int, number of ids sending a batch without
+    waiting.
+    """
+
+    def __init__(self, db, wait=DEFAULT_BATCH_WAIT,
+            max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+        self.db = db
+        self.wait = wait
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._batch = None
+
+    def __enter__(self):
+        self.db._enter_context('loaders', self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.db._exit_context('loaders', self)
+
+    def load(self, docid):
+        """ return the document with this id. Raise `ResourceNotFound`
+        if it doesn't exist. """
+        batch, leader = self._enqueue(docid, lead=True)
+        if leader:
+            if self.wait:
+                time.sleep(self.wait)
+            self._dispatch(batch)
+        return self._result(batch, docid)
+
+    def load_many(self, docids):
+        """ return the documents with these ids, in one request """
+        deferred = [self.defer(docid) for docid in docids]
+        return [d.result() for d in deferred]
+
+    def defer(self, docid):
+        """ add a get to the pending batch and return a `DeferredDoc` """
+        batch, leader = self._enqueue(docid)
+        return DeferredDoc(self, batch, docid)
+
+    def flush(self):
+        """ send pending gets now """
+        with self._lock:
+            batch = self._batch
+        if batch is not None:
+            self._dispatch(batch)
+
+    def _enqueue(self, docid, lead=False):
+        with self._lock:
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _Batch()
+            if docid in batch.counts:
+                batch.counts[docid] += 1
+            else:
+                batch.counts[docid] = 1
+                batch.ids.append(docid)
+
+            leader = lead and not batch.has_leader
+            if leader:
+                batch.has_leader = True
+            if len(batch.ids) >= self.max_batch_size:
+                # full, next gets go in a new batch
+                self._batch = None
+                leader = False
+        if len(batch.ids) >= self.max_batch_size:
+            self._dispatch(batch)
+        return batch, leader
+
+    def _dispatch(self, batch):
+        with self._lock:
+            if batch.started:
+                return
+            batch.started = True
+            if self._batch is batch:
+                self._batch = None
+
+        try:
+            try:
+                docs = self.db.open_docs(batch.ids,
+                        chunk_size=self.max_batch_size)
+            except DocsNotFound, e:
+                docs = e.docs
+                batch.deleted = e.deleted
+            batch.docs = dict(zip(batch.ids, docs))
+        except:
+            batch.error = sys.exc_info()
+        batch.done.set()
+
+    def _result(self, batch, docid):
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error[0], batch.error[1], batch.error[2]
+
+        doc = batch.docs.get(docid)
+        if doc is None:
+            if docid in batch.deleted:
+                raise ResourceNotFound("deleted", http_code=404)
+            raise ResourceNotFound("missing", http_code=404)
+
+        if batch.counts[docid] > 1:
+            # the doc is shared by several gets
+            doc = copy.deepcopy(doc)
+        return doc
+
+class _Write(object):
+
+    def __init__(self, doc, encoded):
+        self.doc = doc
+        self.encoded = encoded
+        self.future = Future()
+        self.queued = time.time()
+
+class BufferedWriter(object):
+    """ buffer saves of documents and send them in `_bulk_docs` requests.
+    Used as a context manager, `Database.save_doc` calls without options
+    (and so `Document.save`) in the block go through the writer and the
+    buffer is flushed at the end of the block. A block only affects the
+    thread entering it. Several threads can enter the same writer, it's
+    closed when the last one exits.
+
+    Ids of documents are set when they are saved, revisions when they are
+    written. Documents are encoded when they are saved, changes done after
+    aren't written. A document saved again before it is sent replaces the
+    pending save, saved again while it's being written it will be in
+    conflict. Set an `uuid_algorithm` on the server so ids don't need
+    requests.
+
+    @param db: `couchdbkit.client.Database` instance
+    @param max_docs: int, number of documents waiting sending them
+    @param max_bytes: int, size of the encoded documents waiting sending
+    them
+    @param interval: float, max seconds a document waits before it is
+    sent. If None documents are only sent when `max_docs` or `max_bytes`
+    is reached, or by `flush`.
+    @param max_pending: int, max number of documents waiting or being
+    written. Saves wait for a free place when it's reached.
+    @param timeout: float, max seconds a save waits for a free place,
+    `WriterFull` is raised after. Wait forever if None.
+    @param all_or_nothing: bool, send batches with `all_or_nothing`
+    """
+
+    def __init__(self, db, max_docs=DEFAULT_MAX_BATCH_SIZE,
+            max_bytes=DEFAULT_WRITE_MAX_BYTES,
+            interval=DEFAULT_WRITE_INTERVAL,
+            max_pending=DEFAULT_WRITE_MAX_PENDING, timeout=None,
+            all_or_nothing=False):
+        if max_pending < max_docs:
+            raise ValueError("max_pending should be >= max_docs")
+        self.db = db
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.all_or_nothing = all_or_nothing
+        self._cond = threading.Condition(threading.Lock())
+        # only one batch is written at a time, so saves of a document are
+        # written in order
+        self._write_lock = threading.Lock()
+        self._queue = []
+        self._by_id = {}
+        self._bytes = 0
+        self._in_flight = 0
+        self._thread = None
+        self._closed = False
+        self._entered = 0
+        self.saves = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.written = 0
+        self.errors = 0
+        self.waits = 0
+
+    def __enter__(self):
+        with self._cond:
+            if self._closed:
+                raise ValueError("the writer is closed")
+            self._entered += 1
+        self.db._enter_context('writers', self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.db._exit_context('writers', self)
+        with self._cond:
+            self._entered -= 1
+            last = not self._entered
+        if last:
+            self.close()
+        else:
+            self.flush()
+
+    def save(self, doc):
+        """ buffer a document and return a `couchdbkit.executor.Future`.
+        Its result is the dict `{"id": ..., "rev": ...}` once the document
+        is written. If the document isn't saved the future raises
+        `ResourceConflict` on a conflict, `BulkSaveError` with the error of
+        the document otherwise, or the error of the request. """
+        if '_id' not in doc:
+            doc['_id'] = self.db.server.next_uuid()
+        encoded = self.db.res.codec.encode(doc)
+
+        with self._cond:
+            if self._closed:
+                raise ValueError("the writer is closed")
+            self.saves += 1
+            write = self._by_id.get(doc['_id'])
+            if write is not None:
+                # not sent yet, replace it
+                self.coalesced += 1
+                self._bytes += len(encoded) - len(write.encoded)
+                write.doc = doc
+                write.encoded = encoded
+                return write.future
+
+            self._wait_place()
+            write = _Write(doc, encoded)
+            self._queue.append(write)
+            self._by_id[doc['_id']] = write
+            self._bytes += len(encoded)
+            if self._full() or len(self._queue) == 1:
+                # wake up the background thread
+                self._cond.notifyAll()
+        self._start()
+        return write.future
+
+    def flush(self):
+        """ write waiting documents now and wait for the end of the
+        writes """
+        while self._write_next():
+            pass
+
+    def close(self):
+        """ flush the buffer and stop the background thread """
+        with self._cond:
+            self._closed = True
+            self._cond.notifyAll()
+        thread = self._thread
+        if thread is not None and thread is not threading.currentThread():
+            thread.join()
+        self.flush()
+
+    def stats(self):
+        """ return a dict with the number of saves, saves replacing a
+        pending save, batches and documents written, documents not saved,
+        saves which waited for a free place and documents pending """
+        with self._cond:
+            return {
+                'saves': self.saves,
+                'coalesced': self.coalesced,
+                'batches': self.batches,
+                'written': self.written,
+                'errors': self.errors,
+                'waits': self.waits,
+                'pending': len(self._queue) + self._in_flight
+            }
+
+    def _wait_place(self):
+        if len(self._queue) + self._in_flight < self.max_pending:
+            return
+        self.waits += 1
+        self._cond.notifyAll()
+        start = time.time()
+        while len(self._queue) + self._in_flight >= self.max_pending:
+            remaining = None
+            if self.timeout is not None:
+                remaining = start + self.timeout - time.time()
+                if remaining <= 0:
+                    raise WriterFull("%s documents waiting to be written" %
+                            self.max_pending)
+            self._cond.wait(remaining)
+
+    def _full(self):
+        return len(self._queue) >= self.max_docs or \
+                self._bytes >= self.max_bytes
+
+    def _take(self):
+        """ remove the next batch from the queue, called with the lock """
+        if not self._queue:
+            return []
+        batch = [self._queue.pop(0)]
+        size = len(batch[0].encoded)
+        while self._queue and len(batch) < self.max_docs and \
+                size + len(self._queue[0].encoded) <= self.max_bytes:
+            write = self._queue.pop(0)
+            batch.append(write)
+            size += len(write.encoded)
+        for write in batch:
+            del self._by_id[write.doc['_id']]
+        self._bytes -= size
+        self._in_flight += len(batch)
+        return batch
+
+    def _start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run)
+            self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._full():
+                    if not self._queue or self.interval is None:
+                        self._cond.wait()
+                        continue
+                    remaining = self._queue[0].queued + self.interval - \
+                            time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            self._write_next()
+
+    def _write_next(self):
+        """ write the next batch. Return False if the queue is empty. """
+        with self._write_lock:
+            with self._cond:
+                batch = self._take()
+            if not batch:
+                return False
+            self._write(batch)
+            return True
+
+    def _write(self, batch):
+        docs = [write.doc for write in batch]
+        try:
+            results = self.db._post_bulk_docs(docs,
+                    [write.encoded for write in batch],
+                    all_or_nothing=self.all_or_nothing)
+        except:
+            error = sys.exc_info()
+            for write in batch:
+                write.future.set_exc_info(error)
+            self._done(batch, len(batch))
+            return
+
+        errors = 0
+        for write, res in zip(batch, results):
+            if 'error' in res:
+                errors += 1
+                if res['error'] == 'conflict':
+                    error = ResourceConflict(res.get('reason'),
+                            http_code=409)
+                else:
+                    error = BulkSaveError([res])
+                write.future.set_exc_info((error.__class__, error, None))
+            else:
+                self.db._update_bulk_doc(write.doc, res)
+                write.future.set_result({'id': res['id'],
+                    'rev': res['rev']})
+        self._done(batch, errors)
+
+    def _done(self, batch, errors):
+        with self._cond:
+            self._in_flight -= len(batch)
+            self.batches += 1
+            self.written += len(batch) - errors
+            self.errors += errors
+            self._cond.notifyAll()
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Results of `Database.bulk_save`. A `BulkResult` has the status of each
+document saved, documents which failed can be saved again without sending
+the whole list:
+
+    >>> result = db.bulk_save(docs, batch_size=1000, retries=3,
+    ...         raise_errors=False)
+    >>> result.saved, len(result.failed)
+    (99998, 2)
+    >>> result.failed[0].error
+    u'forbidden'
+
+With `retries`, documents which failed for a transient reason, an error
+which isn't a conflict or a refusal of the server, or a request of their
+batch which failed, are sent again in follow-up `_bulk_docs` requests.
+With `force_update` documents in conflict are sent again with their
+current revision. With a `couchdbkit.spool.WriteSpool` on the database,
+documents of requests which failed are spooled instead and counted in
+`spooled`.
+"""
+
+from restkit.errors import RequestFailed
+
+# errors of documents which won't change if they are sent again
+PERMANENT_ERRORS = ('conflict', 'forbidden', 'unauthorized', 'bad_request',
+        'doc_validation')
+REQUEST_FAILED = 'request_failed'
+
+class BulkItem(object):
+    """ status of a document of a bulk save. `error` and `reason` are
+    None if the document was saved or spooled. """
+
+    __slots__ = ('doc', 'id', 'rev', 'error', 'reason', 'attempts',
+            'spooled')
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.id = doc.get('_id')
+        self.rev = None
+        self.error = None
+        self.reason = None
+        self.attempts = 0
+        self.spooled = False
+
+    def __repr__(self):
+        return "<%s %s %s>" % (self.__class__.__name__, self.id,
+                self.error or self.rev)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def update(self, result):
+        """ set the status with a row of the result of `_bulk_docs` """
+        self.attempts += 1
+        if 'error' in result:
+            self.error = result['error']
+            self.reason = result.get('reason')
+        else:
+            self.id = result['id']
+            self.rev = result['rev']
+            self.error = self.reason = None
+
+    def set_spooled(self):
+        """ mark the document as journaled by a `WriteSpool` """
+        self.id = self.doc.get('_id')
+        self.error = self.reason = None
+        self.spooled = True
+
+    def to_dict(self):
+        """ return the row of `_bulk_docs` of the last try """
+        if self.spooled:
+            return {'id': self.id, 'spooled': True}
+        if self.ok:
+            return {'id': self.id, 'rev': self.rev}
+        return {'id': self.id, 'error': self.error, 'reason': self.reason}
+
+    def can_retry(self, force_update=False):
+        """ return True if the document may be saved if it's sent again """
+        if self.error == 'conflict':
+            return force_update
+        return self.error not in PERMANENT_ERRORS
+
+class BulkResult(object):
+    """ result of `Database.bulk_save`
+
+    @param keep_items: bool, if True the status of each document is kept
+    in `items`. Otherwise only documents which failed are kept, so saving
+    an iterable by batches keeps a bounded memory.
+    """
+
+    def __init__(self, keep_items=True):
+        self.keep_items = keep_items
+        self.items = []
+        self.failed = []
+        self.saved = 0
+        self.retried = 0
+        self.spooled = 0
+
+    def __repr__(self):
+        return "<%s saved=%s failed=%s spooled=%s>" % (
+                self.__class__.__name__, self.saved, len(self.failed),
+                self.spooled)
+
+    def __nonzero__(self):
+        # True if all documents were saved
+        return not self.failed
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        if self.keep_items:
+            self.items.append(item)
+        if item.spooled:
+            self.spooled += 1
+        elif item.ok:
+            self.saved += 1
+        else:
+            self.failed.append(item)
+
+    @property
+    def errors(self):
+        """ rows of documents which failed, like `BulkSaveError.errors` """
+        return [item.to_dict() for item in self.failed]
+
+    @property
+    def failed_docs(self):
+        """ documents which failed """
+        return [item.doc for item in self.failed]
+
+    def pop_retries(self, force_update=False):
+        """ remove and return items which failed and can be retried """
+        retries = []
+        failed = []
+        for item in self.failed:
+            if item.can_retry(force_update):
+                retries.append(item)
+            else:
+                failed.append(item)
+        self.failed = failed
+        self.retried += len(retries)
+        return retries
+
+    def pop_request_failed(self):
+        """ remove and return items which failed because their request
+        failed """
+        items = [item for item in self.failed
+                if item.error == REQUEST_FAILED]
+        if items:
+            self.failed = [item for item in self.failed
+                    if item.error != REQUEST_FAILED]
+        return items
+
+def request_failed(error):
+    """ return a `_bulk_docs` row for documents of a request which failed,
+    or None if the error isn't transient """
+    if not isinstance(error, RequestFailed):
+        return None
+    status = getattr(error, 'status_int', None)
+    if status is not None and status < 500:
+        return None
+    return {'error': REQUEST_FAILED, 'reason': str(error)}
@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Client side caches.
+
+`DocCache` keeps documents read with `Database.open_doc` with their
+ETag. Next reads of a document are revalidated with `If-None-Match` and
+the cached body is reused if the server answer `304 Not Modified`:
+
+    >>> from couchdbkit import Database, DocCache
+    >>> db = Database("http://127.0.0.1:5984/mydb",
+    ...         doc_cache=DocCache(max_size=10*1024*1024))
+    >>> doc = db.get("config")
+    >>> doc = db.get("config") # not downloaded again
+    >>> db.doc_cache.stats()
+    {'hits': 1, 'misses': 1, 'bytes_saved': 81, 'evictions': 0, ...}
+
+Documents saved or deleted with the `Database` instance are removed from
+the cache.
+
+`ViewCache` keeps results of views fetched with `ViewResults`, keyed by
+the view and its params. Entries are validated with the ETag of the view
+(default), with the `update_seq` of the database, or invalidated by the
+changes feed when a `Consumer` is attached:
+
+    >>> db = Database("http://127.0.0.1:5984/mydb", view_cache=ViewCache())
+    >>> results = db.view("design/name", group_level=2).all()
+
+`RevCache` keeps the last revision seen of documents, from saves, reads,
+bulk results and the changes feed. Deletes, copies and forced updates use
+it instead of asking the revision with a HEAD:
+
+    >>> db = Database("http://127.0.0.1:5984/mydb", rev_cache=RevCache())
+    >>> db.save_doc({"_id": "counter", "n": 1})
+    >>> db.delete_doc("counter") # no HEAD
+"""
+
+from __future__ import with_statement
+
+from hashlib import md5
+import os
+import tempfile
+import threading
+import urllib
+
+from couchdbkit.codec import get_codec
+from couchdbkit.resource import encode_params
+from couchdbkit.uuids import random_hex
+
+DEFAULT_DOC_CACHE_SIZE = 10 * 1024 * 1024
+DEFAULT_VIEW_CACHE_SIZE = 10 * 1024 * 1024
+DEFAULT_DISK_CACHE_SIZE = 100 * 1024 * 1024
+DEFAULT_REV_CACHE_ITEMS = 100000
+
+class LRUCache(object):
+    """ thread-safe mapping evicting least recently used items when the
+    total size of items is over `max_size`.
+
+    @param max_size: int, max total size of items
+    @param max_items: int, max number of items. Unlimited if None.
+    """
+
+    def __init__(self, max_size, max_items=None):
+        self.max_size = max_size
+        self.max_items = max_items
+        self.size = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._map = {}
+        # circular doubly linked list of [prev, next, key, value, size],
+        # most recently used first
+        self._root = root = []
+        root[:] = [root, root, None, None, 0]
+
+    def __len__(self):
+        return len(self._map)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def get(self, key, default=None):
+        """ return the value of key and mark it as recently used """
+        with self._lock:
+            link = self._map.get(key)
+            if link is None:
+                return default
+            self._unlink(link)
+            self._link(link)
+            return link[3]
+
+    def set(self, key, value, size=1):
+        """ add an item of `size`. Items are evicted if needed. An item
+        larger than `max_size` isn't kept. """
+        with self._lock:
+            self.pop(key)
+            if size > self.max_size:
+                return
+            link = [None, None, key, value, size]
+            self._link(link)
+            self._map[key] = link
+            self.size += size
+            while self.size > self.max_size or \
+                    (self.max_items is not None and
+                    len(self._map) > self.max_items):
+                self._evict()
+
+    def pop(self, key, default=None):
+        """ remove key and return its value """
+        with self._lock:
+            link = self._map.pop(key, None)
+            if link is None:
+                return default
+            self._unlink(link)
+            self.size -= link[4]
+            return link[3]
+
+    def clear(self):
+        with self._lock:
+            self._map.clear()
+            self._root[:] = [self._root, self._root, None, None, 0]
+            self.size = 0
+
+    def keys(self):
+        """ return keys, most recently used first """
+        with self._lock:
+            keys = []
+            link = self._root[1]
+            while link is not self._root:
+                keys.append(link[2])
+                link = link[1]
+            return keys
+
+    def _link(self, link):
+        root = self._root
+        first = root[1]
+        link[0] = root
+        link[1] = first
+        first[0] = root[1] = link
+
+    def _unlink(self, link):
+        prev, next = link[0], link[1]
+        prev[1] = next
+        next[0] = prev
+
+    def _evict(self):
+        link = self._root[0]
+        self._unlink(link)
+        del self._map[link[2]]
+        self.size -= link[4]
+        self.evictions += 1
+
+class DocCache(LRUCache):
+    """ cache of documents bodies and their ETag used by
+    `Database.open_doc`. Its size is the size of JSON bodies.
+
+    @param max_size: int, max size in bytes of cached bodies
+    @param max_items: int, max number of cached documents
+    """
+
+    def __init__(self, max_size=DEFAULT_DOC_CACHE_SIZE, max_items=None):
+        LRUCache.__init__(self, max_size, max_items=max_items)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def get_entry(self, docid):
+        """ return the tuple (etag, body) cached for this doc or None """
+        return self.get(docid)
+
+    def set_entry(self, docid, etag, body):
+        """ cache the JSON body of a doc with its etag """
+        if not etag:
+            return
+        self.set(docid, (etag, body), size=len(body))
+
+    def hit(self, body):
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += len(body)
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def stats(self):
+        """ return a dict with counters of the cache """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes_saved': self.bytes_saved,
+                'evictions': self.evictions,
+                'items': len(self),
+                'size': self.size
+            }
+
+class DiskBackend(object):
+    """ view cache backend storing entries in files of a directory. Can
+    be shared by processes. Entries are stored in JSON, least recently
+    used files are removed when the directory is over `max_size` bytes or
+    `max_items` entries. Sizes written by other processes are counted at
+    the next eviction.
+
+    @param path: str, path of the directory, created if needed
+    @param max_size: int, max total size in bytes of the entries
+    @param max_items: int, max number of entries. Unlimited if None.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_DISK_CACHE_SIZE,
+            max_items=None):
+        self.path = path
+        self.max_size = max_size
+        self.max_items = max_items
+        self.evictions = 0
+        self._codec = get_codec()
+        self._lock = threading.Lock()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        files = self._files()
+        self.size = sum([size for mtime, size, fname in files])
+        self.items = len(files)
+
+    def _fname(self, key):
+        return os.path.join(self.path, md5(key).hexdigest())
+
+    def get(self, key, default=None):
+        fname = self._fname(key)
+        try:
+            f = open(fname, 'rb')
+        except IOError:
+            return default
+        try:
+            try:
+                stored_key, value = self._codec.decode(f.read())
+            except Exception:
+                return default
+        finally:
+            f.close()
+        if _utf8(stored_key) != key:
+            return default
+        try:
+            # recently used
+            os.utime(fname, None)
+        except OSError:
+            pass
+        return _from_json(value)
+
+    def set(self, key, value, size=1):
+        data = self._codec.encode([key, value])
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if len(data) > self.max_size:
+            self.pop(key)
+            return
+        fname = self._fname(key)
+        try:
+            replaced = os.path.getsize(fname)
+        except OSError:
+            replaced = None
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(tmp, fname)
+        with self._lock:
+            self.size += len(data) - (replaced or 0)
+            if replaced is None:
+                self.items += 1
+            full = self.size > self.max_size or \
+                    (self.max_items is not None and
+                    self.items > self.max_items)
+        if full:
+            self._evict()
+
+    def pop(self, key, default=None):
+        fname = self._fname(key)
+        value = self.get(key, default)
+        try:
+            size = os.path.getsize(fname)
+            os.unlink(fname)
+        except OSError:
+            return value
+        with self._lock:
+            self.size -= size
+            self.items -= 1
+        return value
+
+    def clear(self):
+        for fname in os.listdir(self.path):
+            try:
+                os.unlink(os.path.join(self.path, fname))
+            except OSError:
+                pass
+        with self._lock:
+            self.size = 0
+            self.items = 0
+
+    def _files(self):
+        """ return (mtime, size, path) of the entries """
+        files = []
+        for fname in os.listdir(self.path):
+            fname = os.path.join(self.path, fname)
+            try:
+                st = os.stat(fname)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, fname))
+        return files
+
+    def _evict(self):
+        """ remove least recently used entries until the directory is
+        under its limits """
+        files = self._files()
+        files.sort()
+        size = sum([f[1] for f in files])
+        items = len(files)
+        evictions = 0
+        for mtime, fsize, fname in files:
+            if size <= self.max_size and \
+                    (self.max_items is None or items <= self.max_items):
+                break
+            try:
+                os.unlink(fname)
+            except OSError:
+                continue
+            size -= fsize
+            items -= 1
+            evictions += 1
+        with self._lock:
+            self.size = size
+            self.items = items
+            self.evictions += evictions
+
+def _from_json(value):
+    """ return a value of an entry decoded from JSON with its strings
+    encoded in utf-8 and its lists as tuples """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return tuple([_from_json(v) for v in value])
+    return value
+
+class ViewCache(object):
+    """ cache of view results used by `ViewResults`
+
+    @param backend: object with the `get`, `set`, `pop` and `clear`
+    methods of `LRUCache`, like `DiskBackend`. By default an `LRUCache`
+    of `max_size` bytes.
+    @param max_size: int, max size in bytes of the default backend
+    @param validate: str, how entries are validated when no consumer is
+    attached. "etag": the view is requested with `If-None-Match`, the
+    cached result is used on a 304 so neither the result is sent nor
+    decoded again by the server. "update_seq": the update sequence of the
+    database is checked and the view isn't requested if it didn't change.
+    """
+
+    def __init__(self, backend=None, max_size=DEFAULT_VIEW_CACHE_SIZE,
+            validate="etag"):
+        if validate not in ("etag", "update_seq"):
+            raise ValueError("unknown validation %r" % validate)
+        if backend is None:
+            backend = LRUCache(max_size)
+        self.backend = backend
+        self.validate = validate
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self._consumer = None
+        # changes of the generation invalidate entries when a consumer is
+        # attached. It's unique to this instance since entries may be
+        # shared by processes with a disk backend.
+        self._token = random_hex(16)
+        self._generation = 0
+
+    def attach(self, consumer):
+        """ invalidate entries with the changes of a
+        `couchdbkit.consumer.Consumer`. Entries are then used without
+        validating them on the server, the consumer should be listening
+        (`wait` or `wait_once` in a loop) in another thread. """
+        consumer.register_callback(self.on_change)
+        with self._lock:
+            self._consumer = consumer
+            self._generation += 1
+
+    def on_change(self, change):
+        """ callback of the changes feed, any change invalidates the
+        entries """
+        with self._lock:
+            self._generation += 1
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        """ return a dict with counters of the cache """
+        with self._lock:
+            total = self.hits + self.misses
+            hit_rate = 0.0
+            if total:
+                hit_rate = float(self.hits) / total
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': hit_rate,
+                'bytes_saved': self.bytes_saved
+            }
+
+    def cache_key(self, view, params):
+        """ return the key of a view query """
+        params = dict([(k, v) for k, v in params.items()
+                if not k.startswith('_')])
+        params = encode_params(params, codec=view._db.res.codec)
+        # urlencode only accepts ascii unicode, like ids of rows set by
+        # `paged` in `startkey_docid`
+        items = [(k, _utf8(v)) for k, v in sorted(params.items())]
+        return "%s/%s?%s" % (_utf8(view._db.uri), _utf8(view.view_path),
+                urllib.urlencode(items))
+
+    def fetch(self, view, params):
+        """ return the decoded results of a `View` with `params`, from
+        the cache if they are still valid """
+        key = self.cache_key(view, params)
+        entry = self.backend.get(key)
+        codec = view._db.res.codec
+
+        with self._lock:
+            generation = "%s-%s" % (self._token, self._generation)
+            attached = self._consumer is not None
+
+        if attached:
+            if entry is not None and entry[0] == generation:
+                return self._hit(entry[1], codec)
+            resp = view._exec(**params)
+            return self._store(key, (generation, resp.body_string()), codec)
+
+        if self.validate == "update_seq":
+            update_seq = view._db.info()['update_seq']
+            if entry is not None and entry[0] == update_seq:
+                return self._hit(entry[1], codec)
+            resp = view._exec(**params)
+            return self._store(key, (update_seq, resp.body_string()), codec)
+
+        if entry is not None:
+            params = params.copy()
+            params['_headers'] = {'If-None-Match': entry[0]}
+        resp = view._exec(**params)
+        body = resp.body_string()
+        if resp.status_int == 304 and entry is not None:
+            return self._hit(entry[1], codec)
+        etag = resp.headers.get('etag')
+        if etag is None:
+            self._miss()
+            return codec.decode(body)
+        return self._store(key, (etag, body), codec)
+
+    def _hit(self, body, codec):
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += len(body)
+        return codec.decode(body)
+
+    def _miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def _store(self, key, entry, codec):
+        self._miss()
+        body = entry[1]
+        self.backend.set(key, entry, size=len(body))
+        return codec.decode(body)
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+class RevCache(LRUCache):
+    """ cache of the last known revisions of documents used by `Database`
+    to delete, copy and force updates of documents without asking their
+    revision first. A revision can be outdated if the document was changed
+    by another client, the database then asks the current one on a
+    conflict.
+
+    @param max_items: int, max number of documents
+    """
+
+    def __init__(self, max_items=DEFAULT_REV_CACHE_ITEMS):
+        LRUCache.__init__(self, max_items, max_items=max_items)
+        self.hits = 0
+        self.misses = 0
+
+    def get_rev(self, docid):
+        """ return the last known revision of a doc or None """
+        rev = self.get(docid)
+        with self._lock:
+            if rev is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return rev
+
+    def set_rev(self, docid, rev):
+        """ remember the revision of a doc. None forgets it. """
+        if not docid:
+            return
+        if rev is None:
+            self.pop(docid)
+        else:
+            self.set(docid, rev)
+
+    def update_docs(self, docs):
+        """ remember revisions of docs, deleted docs are forgotten """
+        for doc in docs:
+            if not isinstance(doc, dict):
+                continue
+            if doc.get('_deleted'):
+                self.pop(doc.get('_id'))
+            else:
+                self.set_rev(doc.get('_id'), doc.get('_rev'))
+
+    def attach(self, consumer):
+        """ follow revisions with the changes of a
+        `couchdbkit.consumer.Consumer` """
+        consumer.register_callback(self.on_change)
+
+    def on_change(self, change):
+        """ callback of the changes feed """
+        if 'results' in change:
+            # a longpoll or normal feed
+            for line in change['results']:
+                self.on_change(line)
+            return
+        docid = change.get('id')
+        changes = change.get('changes')
+        if change.get('deleted') or not changes:
+            self.pop(docid)
+        else:
+            self.set_rev(docid, changes[0].get('rev'))
+
+    def stats(self):
+        """ return a dict with counters of the cache """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'items': len(self)
+            }
@@ -32,22 +32,41 @@ UNKOWN_INFO = {}
 
 import base64
 import cgi
-from itertools import groupby
 from mimetypes import guess_type
 import re
+import threading
 import time
 import urlparse
 import warnings
 
-import anyjson
 from restkit.util import url_quote
 from restkit.util.misc import deprecated_property
 
+from couchdbkit.batching import DocLoader, BufferedWriter
+from couchdbkit.bulk import BulkItem, BulkResult, request_failed
+from couchdbkit.cache import RevCache
 from couchdbkit.exceptions import *
+from couchdbkit.executor import DEFAULT_MAX_WORKERS
+from couchdbkit.profiler import ViewProfiler
 import couchdbkit.resource as resource
-from couchdbkit.utils import validate_dbname
+from couchdbkit.spool import WriteSpool, is_transient
+from couchdbkit.utils import validate_dbname, read_ahead, imap_ordered
+from couchdbkit.uuids import get_uuid_generator, random_hex
 
 DEFAULT_UUID_BATCH_COUNT = 1000
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_OPEN_DOCS_CHUNK_SIZE = 1000
+DEFAULT_UPDATE_RETRIES = 3
+
+def rev_generation(rev):
+    """ return the generation of a revision, the number before the dash.
+    0 if rev is None. """
+    if not rev:
+        return 0
+    try:
+        return int(rev.split('-', 1)[0])
+    except ValueError:
+        return 0
 
 def maybe_raw(response, raw=False):
     if raw:
@@ -62,13 +81,38 @@ class Server(object):
     def __init__(self, uri='http://127.0.0.1:5984',
             uuid_batch_count=DEFAULT_UUID_BATCH_COUNT, resource_instance=None,
             pool_instance=None,
-            filters=None):
+            filters=None, codec=None, uuid_algorithm=None,
+            single_flight=None, tracer=None, retry_policy=None,
+            accept_encoding=None, compress_threshold=None):
         """ constructor for Server object
 
         @param uri: uri of CouchDb host
         @param uuid_batch_count: max of uuids to get in one time
         @param resource_instance: `restkit.resource.CouchdbDBResource` instance.
             It alows you to set a resource class with custom parameters.
+        @param codec: name or `couchdbkit.codec.Codec` instance, JSON codec
+            used by this server and its databases. See `couchdbkit.codec`.
+        @param uuid_algorithm: name or `couchdbkit.uuids.UUIDGenerator`
+            instance. If set, uuids are generated locally with this
+            algorithm instead of being fetched from the server. See
+            `couchdbkit.uuids`.
+        @param single_flight: True or `couchdbkit.singleflight.SingleFlight`
+            instance. If set, identical GET and HEAD requests sent at the
+            same time by the server and its databases share one response.
+            See `couchdbkit.singleflight`.
+        @param tracer: True or `couchdbkit.tracing.Tracer` instance. If
+            set, timings of requests of the server and its databases are
+            sent to the observers of the tracer. See `couchdbkit.tracing`.
+        @param retry_policy: True or `couchdbkit.retry.RetryPolicy`
+            instance. If set, requests of the server and its databases
+            failed because of the server are retried. True creates a
+            policy with default settings. See `couchdbkit.retry`.
+        @param accept_encoding: bool, if True the server and its
+            databases ask gzip or deflate responses. See
+            `couchdbkit.compression`.
+        @param compress_threshold: int, request bodies of at least this
+            size are sent gzipped. Only useful if a proxy in front of
+            CouchDB decodes them. See `couchdbkit.compression`.
         """
 
         if not uri or uri is None:
@@ -80,6 +124,9 @@ class Server(object):
         self.uri = uri
         self.uuid_batch_count = uuid_batch_count
         self._uuid_batch_count = uuid_batch_count
+        self.uuid_generator = None
+        if uuid_algorithm is not None:
+            self.uuid_generator = get_uuid_generator(uuid_algorithm)
 
         if resource_instance and isinstance(resource_instance, 
                                 resource.CouchdbResource):
@@ -87,11 +134,28 @@ class Server(object):
             self.res = resource_instance.clone()
             if pool_instance is not None:
                 self.res.client_opts['pool_instance'] = pool_instance
+            if codec is not None:
+                self.res.set_codec(codec)
+            if single_flight is not None:
+                self.res.set_single_flight(single_flight)
+            if tracer is not None:
+                self.res.set_tracer(tracer)
+            if retry_policy is not None:
+                self.res.set_retry_policy(retry_policy)
+            if accept_encoding is not None:
+                self.res.set_accept_encoding(accept_encoding)
+            if compress_threshold is not None:
+                self.res.set_compress_threshold(compress_threshold)
                 
         else:
             self.res = resource.CouchdbResource(uri, 
                                 pool_instance=pool_instance,
-                                filters=filters)
+                                filters=filters, codec=codec,
+                                single_flight=single_flight,
+                                tracer=tracer,
+                                retry_policy=retry_policy,
+                                accept_encoding=accept_encoding,
+                                compress_threshold=compress_threshold)
         self._uuids = []
         
     def close(self):
@@ -177,8 +241,13 @@ class Server(object):
 
     def next_uuid(self, count=None):
         """
-        return an available uuid from couchdbkit
+        return an available uuid from couchdbkit. It's generated locally
+        if an uuid algorithm is set, else uuids are fetched from the
+        server by batch of `count`.
         """
+        if self.uuid_generator is not None:
+            return self.uuid_generator.next()
+
         if count is not None:
             self._uuid_batch_count = count
         else:
@@ -225,13 +294,47 @@ class Database(object):
     """
 
     def __init__(self, uri, create=False, server=None, pool_instance=None,
-            filters=None):
+            filters=None, codec=None, doc_cache=None, view_cache=None,
+            single_flight=None, tracer=None, view_profiler=None,
+            retry_policy=None, accept_encoding=None, compress_threshold=None,
+            rev_cache=None, spool=None):
         """Constructor for Database
 
         @param uri: str, Database uri
         @param create: boolean, False by default,
         if True try to create the database.
         @param server: Server instance
+        @param codec: name or `couchdbkit.codec.Codec` instance, JSON codec
+        used by this database. By default the codec of the server.
+        @param doc_cache: `couchdbkit.cache.DocCache` instance. If set,
+        documents read with `open_doc` are cached and revalidated with
+        their ETag.
+        @param view_cache: `couchdbkit.cache.ViewCache` instance. If set,
+        results of views fetched with `ViewResults` are cached.
+        @param single_flight: True or `couchdbkit.singleflight.SingleFlight`
+        instance, single-flight group of this database. By default the
+        group of the server.
+        @param tracer: True or `couchdbkit.tracing.Tracer` instance, tracer
+        of the requests of this database. By default the tracer of the
+        server.
+        @param view_profiler: True or `couchdbkit.profiler.ViewProfiler`
+        instance. If set, requests of views are recorded. True creates a
+        new profiler. See `couchdbkit.profiler`.
+        @param retry_policy: True or `couchdbkit.retry.RetryPolicy`
+        instance, retry policy of the requests of this database. By
+        default the policy of the server.
+        @param accept_encoding: bool, if True gzip or deflate responses
+        are asked. By default the setting of the server.
+        @param compress_threshold: int, request bodies of at least this
+        size are sent gzipped. By default the setting of the server.
+        @param rev_cache: True or `couchdbkit.cache.RevCache` instance. If
+        set, revisions of documents saved or read are kept and used to
+        delete, copy and force updates of documents without asking their
+        revision first. True creates a new cache.
+        @param spool: path of a directory or `couchdbkit.spool.WriteSpool`
+        instance. If set, docs which `save_doc` and `bulk_save` can't save
+        because the server is unreachable are journaled in the spool and
+        replayed later. See `couchdbkit.spool`.
 
         """
         self.uri = uri
@@ -245,20 +348,87 @@ class Database(object):
         else:
             self.server = server = Server(self.server_uri, 
                                     pool_instance=pool_instance,
-                                    filters=filters)
+                                    filters=filters, codec=codec)
 
         if create:
             try:
                 self.server.res.head('/%s/' % self.dbname)
             except resource.ResourceNotFound:
-                self.server.res.put('/%s/' % self.dbname)
+                self.server.res.put('/%s/' % self.dbname).body_string()
 
 
         self.res = server.res(self.dbname)
+        if codec is not None:
+            self.res.set_codec(codec)
+        if single_flight is not None:
+            self.res.set_single_flight(single_flight)
+        if tracer is not None:
+            self.res.set_tracer(tracer)
+        if retry_policy is not None:
+            self.res.set_retry_policy(retry_policy)
+        if accept_encoding is not None:
+            self.res.set_accept_encoding(accept_encoding)
+        if compress_threshold is not None:
+            self.res.set_compress_threshold(compress_threshold)
+
+        # blocks entered by each thread, like the `DocLoader` of a
+        # `batching` block or the `BufferedWriter` of a `buffered` block
+        self._local = threading.local()
+        self.doc_cache = doc_cache
+        self.view_cache = view_cache
+        if rev_cache is True:
+            rev_cache = RevCache()
+        self.rev_cache = rev_cache
+        if view_profiler is True:
+            view_profiler = ViewProfiler()
+        self.view_profiler = view_profiler
+        if isinstance(spool, basestring):
+            spool = WriteSpool(spool)
+        self.spool = spool
+        if spool is not None:
+            spool.start(self)
 
     def __repr__(self):
         return "<%s %s>" % (self.__class__.__name__, self.dbname)
 
+    def _context_stack(self, name):
+        """ return the stack of `name` blocks entered by the current
+        thread """
+        stack = getattr(self._local, name, None)
+        if stack is None:
+            stack = []
+            setattr(self._local, name, stack)
+        return stack
+
+    def _enter_context(self, name, obj):
+        self._context_stack(name).append(obj)
+
+    def _exit_context(self, name, obj):
+        stack = self._context_stack(name)
+        # blocks may be exited out of order
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i] is obj:
+                del stack[i]
+                return
+
+    def _current_context(self, name):
+        stack = self._context_stack(name)
+        if not stack:
+            return None
+        return stack[-1]
+
+    @property
+    def doc_loader(self):
+        """ `DocLoader` of the `batching` block of the current thread,
+        or None """
+        return self._current_context('loaders')
+
+    @property
+    def doc_writer(self):
+        """ `BufferedWriter` of the `buffered` block of the current
+        thread, or None """
+        return self._current_context('writers')
+
     @classmethod
     def from_uri(cls, uri, *args, **kwargs):
         """ Create a database from its url. """
@@ -266,6 +436,8 @@ class Database(object):
         return cls(uri)
         
     def close(self):
+        if self.spool is not None:
+            self.spool.close()
         self.res.close()
 
     def info(self, _raw_json=False):
@@ -344,6 +516,10 @@ class Database(object):
 
         @return: dict, representation of CouchDB document as
          a dict.
+
+        In a `batching` block, gets without params are sent with other
+        gets in one request. Otherwise they use the `doc_cache` of the
+        database if it's set.
         """
         wrapper = None
         raw_json = False
@@ -353,9 +529,19 @@ class Database(object):
         if "_raw_json" in params:
             raw_json = params.pop("_raw_json")
         
-        docid = resource.escape_docid(docid)
-        
-        doc = maybe_raw(self.res.get(docid, **params), raw=raw_json)        
+        loader = self.doc_loader
+        if loader is not None and not raw_json and \
+                not [v for v in params.values() if v is not None]:
+            doc = loader.load(docid)
+        elif self.doc_cache is not None and \
+                not [v for v in params.values() if v is not None]:
+            doc = self._open_cached_doc(docid, raw_json)
+        else:
+            docid = resource.escape_docid(docid)
+            doc = maybe_raw(self.res.get(docid, **params), raw=raw_json)
+        if self.rev_cache is not None and not raw_json and \
+                not [k for k in params if 'rev' in k]:
+            self.rev_cache.update_docs([doc])
         if wrapper is not None:
             if not callable(wrapper):
                 raise TypeError("wrapper isn't a callable")
@@ -364,6 +550,171 @@ class Database(object):
         return doc
     get = open_doc
 
+    def _open_cached_doc(self, docid, raw=False):
+        cache = self.doc_cache
+        headers = {}
+        entry = cache.get_entry(docid)
+        if entry is not None:
+            headers['If-None-Match'] = entry[0]
+
+        try:
+            resp = self.res.get(resource.escape_docid(docid),
+                    headers=headers)
+        except resource.ResourceNotFound:
+            cache.pop(docid)
+            raise
+
+        body = resp.body_string()
+        if resp.status_int == 304 and entry is not None:
+            body = entry[1]
+            cache.hit(body)
+        else:
+            cache.miss()
+            cache.set_entry(docid, resp.headers.get('etag'), body)
+
+        if raw:
+            return body
+        return self.res.codec.decode(body)
+
+    def _uncache_docs(self, docids):
+        """ remove docs changed by this client from the doc cache """
+        if self.doc_cache is None:
+            return
+        for docid in docids:
+            if docid is not None:
+                self.doc_cache.pop(docid)
+
+    def open_docs(self, docids, chunk_size=DEFAULT_OPEN_DOCS_CHUNK_SIZE,
+            concurrency=1, wrapper=None, ignore_missing=False, **params):
+        """ Get multiple documents from database. Ids are posted as
+        `keys` to `_all_docs` in chunks, so any number of ids can be
+        fetched.
+
+        @param docids: iterable of document ids
+        @param chunk_size: int, max number of ids sent in one request
+        @param concurrency: int, number of requests sent at the same time
+        @param wrapper: callable. function that takes dict as a param.
+        Used to wrap an object.
+        @param ignore_missing: bool, if True documents not found are None
+        in the results instead of raising `DocsNotFound`.
+        @param params: other params of `_all_docs`, like `conflicts`.
+
+        @return: list of documents in the order of `docids`. If documents
+        are missing or deleted `DocsNotFound` is raised with their ids.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size should be > 0")
+        if wrapper is not None and not callable(wrapper):
+            raise TypeError("wrapper isn't a callable")
+
+        params['include_docs'] = True
+        def fetch(keys):
+            resp = self.res.post('_all_docs', payload={'keys': keys},
+                    **params)
+            return resp.json_body['rows']
+
+        docs = []
+        missing = []
+        deleted = {}
+        for keys, rows in imap_ordered(fetch,
+                self._iter_keys_chunks(docids, chunk_size),
+                concurrency=concurrency):
+            if self.rev_cache is not None:
+                self._cache_rows_revs(rows)
+            for docid, row in zip(keys, rows):
+                doc = row.get('doc')
+                if doc is None:
+                    if row.get('value', {}).get('deleted'):
+                        deleted[docid] = row['value']['rev']
+                    else:
+                        missing.append(docid)
+                elif wrapper is not None:
+                    doc = wrapper(doc)
+                docs.append(doc)
+
+        if (missing or deleted) and not ignore_missing:
+            raise DocsNotFound(missing, deleted, docs)
+        return docs
+
+    def batching(self, **params):
+        """ return a `couchdbkit.batching.DocLoader` coalescing gets of
+        documents of this database. Used as a context manager, gets done
+        with `open_doc` in the block by the thread which entered it use
+        it. Threads entering the same loader share its batches.
+
+        @param params: `wait` and `max_batch_size` of the loader
+        """
+        return DocLoader(self, **params)
+
+    def buffered(self, **params):
+        """ return a `couchdbkit.batching.BufferedWriter` sending saves
+        of documents of this database in `_bulk_docs` requests. Used as a
+        context manager, saves done with `save_doc` in the block by the
+        thread which entered it use it and it's flushed at the end of the
+        block.
+
+        @param params: `max_docs`, `max_bytes`, `interval`, `max_pending`,
+        `timeout` and `all_or_nothing` of the writer
+        """
+        return BufferedWriter(self, **params)
+
+    def parallel(self, max_workers=DEFAULT_MAX_WORKERS):
+        """ return a `couchdbkit.asyncclient.ParallelDatabase` running
+        calls on this database concurrently, over its connection pool.
+        Calls return futures, `map` and `results` return ordered results.
+
+            >>> with db.parallel(max_workers=8) as p:
+            ...     futures = [p.open_doc(docid) for docid in docids]
+            >>> docs = [f.result() for f in futures]
+
+        @param max_workers: int, max number of calls running at the same
+        time. The keepalive of the connection pool should be as large to
+        reuse all the connections.
+        """
+        from couchdbkit.asyncclient import ParallelDatabase
+        return ParallelDatabase(self, max_workers=max_workers)
+
+    def _cache_rows_revs(self, rows):
+        """ remember revisions of rows of `_all_docs` """
+        for row in rows:
+            value = row.get('value')
+            if 'id' not in row or not isinstance(value, dict):
+                continue
+            if value.get('deleted'):
+                self.rev_cache.pop(row['id'])
+            else:
+                self.rev_cache.set_rev(row['id'], value.get('rev'))
+
+    def lookup_revs(self, docids, chunk_size=DEFAULT_OPEN_DOCS_CHUNK_SIZE):
+        """ return a dict of the current revisions of documents, with
+        one `_all_docs` request by chunk of ids. Missing documents aren't
+        in the dict, the revision of deleted documents is their deletion.
+
+        @param docids: iterable of document ids
+        @param chunk_size: int, max number of ids sent in one request
+        """
+        revs = {}
+        for keys in self._iter_keys_chunks(docids, chunk_size):
+            resp = self.res.post('_all_docs', payload={'keys': keys})
+            rows = resp.json_body['rows']
+            if self.rev_cache is not None:
+                self._cache_rows_revs(rows)
+            for row in rows:
+                value = row.get('value')
+                if 'id' in row and isinstance(value, dict):
+                    revs[row['id']] = value['rev']
+        return revs
+
+    def _iter_keys_chunks(self, keys, chunk_size):
+        chunk = []
+        for key in keys:
+            chunk.append(key)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
     def all_docs(self, by_seq=False, _raw_json=False, **params):
         """Get all documents from a database
 
@@ -438,7 +789,18 @@ class Database(object):
         @return rev: str, the last revision of document.
         """
         response = self.res.head(resource.escape_docid(docid))
-        return response.headers['etag'].strip('"')
+        rev = response.headers['etag'].strip('"')
+        if self.rev_cache is not None:
+            self.rev_cache.set_rev(docid, rev)
+        return rev
+
+    def _known_rev(self, docid):
+        """ return the revision of a doc from the rev cache, or ask it """
+        if self.rev_cache is not None:
+            rev = self.rev_cache.get_rev(docid)
+            if rev is not None:
+                return rev
+        return self.get_rev(docid)
 
     def save_doc(self, doc, encode_attachments=True, force_update=False,
             _raw_json=False, **params):
@@ -452,13 +814,24 @@ class Database(object):
         with doc '_id' and '_rev' properties returned
         by CouchDB server when you save.
         @param force_update: boolean, if there is conlict, try to update
-        with latest revision
+        with latest revision. With a `rev_cache`, the latest revision known
+        is used from the start.
         @param _raw_json: return raw json instead deserializing it
         @param params, list of optionnal params, like batch="ok"
 
         with `_raw_json=True` It return raw response. If False it update
         doc instance with new revision (if batch=False).
 
+        In a `buffered` block, saves without params (except `batch`) are
+        buffered by the writer of the database. The doc gets its `_id`
+        at once and its `_rev` when it's written, the result is like the
+        one of a save with `batch="ok"`.
+
+        With a `spool`, if the server can't be reached the doc gets an
+        `_id` and is journaled in the spool, the result is
+        `{"ok": True, "id": ..., "spooled": True}`. Docs are spooled at
+        once while the spool isn't replayed.
+
         @return res: result of save. doc is updated in the mean time
         """
         if doc is None:
@@ -467,9 +840,33 @@ class Database(object):
         if '_attachments' in doc and encode_attachments:
             doc['_attachments'] = resource.encode_attachments(doc['_attachments'])
 
+        writer = self.doc_writer
+        if writer is not None and not _raw_json and not force_update and \
+                not [k for k in params if k != 'batch']:
+            writer.save(doc)
+            return {'ok': True, 'id': doc['_id']}
+
+        if self.spool is None or _raw_json:
+            return self._save_doc(doc, force_update, _raw_json, params)
+
+        if not self.spool.pending:
+            try:
+                return self._save_doc(doc, force_update, False, params)
+            except resource.RequestFailed, e:
+                if not is_transient(e):
+                    raise
+        self._spool_docs([doc])
+        return {'ok': True, 'id': doc['_id'], 'spooled': True}
+
+    def _save_doc(self, doc, force_update, _raw_json, params):
         if '_id' in doc:
             docid = doc['_id']
             docid1 = resource.escape_docid(doc['_id'])
+            if force_update and self.rev_cache is not None:
+                rev = self.rev_cache.get_rev(docid)
+                if rev is not None and \
+                        rev_generation(rev) > rev_generation(doc.get('_rev')):
+                    doc['_rev'] = rev
             try:
                 res = maybe_raw(self.res.put(docid1, payload=doc,
                             **params), raw=_raw_json)
@@ -480,6 +877,10 @@ class Database(object):
                                 **params), raw=_raw_json)
                 else:
                     raise
+        elif self.server.uuid_generator is not None:
+            doc['_id'] = self.server.next_uuid()
+            res =  maybe_raw(self.res.put(doc['_id'], payload=doc, **params),
+                        raw=_raw_json)
         else:
             try:
                 doc['_id'] = self.server.next_uuid()
@@ -488,6 +889,7 @@ class Database(object):
             except:
                 res = maybe_raw(self.res.post(payload=doc, **params), raw=_raw_json)
 
+        self._uncache_docs([doc.get('_id')])
         if _raw_json:
             return res
 
@@ -495,10 +897,15 @@ class Database(object):
             doc.update({ '_id': res['id']})
         else:
             doc.update({'_id': res['id'], '_rev': res['rev']})
+            if self.rev_cache is not None:
+                self.rev_cache.set_rev(res['id'], res['rev'])
 
         return res
 
-    def bulk_save(self, docs, use_uuids=True, all_or_nothing=False, _raw_json=False):
+    def bulk_save(self, docs, use_uuids=True, all_or_nothing=False,
+            _raw_json=False, batch_size=None, batch_bytes=None,
+            concurrency=1, stream=False, force_update=False, retries=0,
+            raise_errors=True):
         """ bulk save. Modify Multiple Documents With a Single Request
 
         @param docs: list of docs
@@ -506,56 +913,383 @@ class Database(object):
         @param all_or_nothing: In the case of a power failure, when the database
         restarts either all the changes will have been saved or none of them.
         However, it does not do conflict checking, so the documents will
-        @param _raw_json: return raw json instead deserializing it
         be committed even if this creates conflicts.
-
-        With `_raw_json=True` it return raw response. When False it return anything
-        but update list of docs with new revisions and members (like deleted)
+        @param _raw_json: return raw json instead deserializing it
+        @param batch_size: int, max number of docs sent in one request.
+        @param batch_bytes: int, max size in bytes of docs sent in one
+        request.
+        @param concurrency: int, number of requests sent at the same time
+        when docs are split in batches. Needs `batch_size` or
+        `batch_bytes`.
+        @param stream: bool, encode docs one by one while the request is
+        sent, using chunked transfer encoding. The whole encoded body is
+        never kept in memory. Can't be used with `batch_size` or
+        `batch_bytes`, batches are already bounded.
+        @param force_update: bool, if True docs in conflict are saved
+        again with their current revision. Revisions of all of them are
+        looked up with `_all_docs` and they are sent again in follow-up
+        `_bulk_docs` requests, by chunks of `batch_size`.
+        @param retries: int, number of follow-up requests sending again
+        docs which failed for a transient reason, and docs in conflict
+        with `force_update`. Docs of a request which failed are retried
+        too instead of raising the error.
+        @param raise_errors: bool, if False the result is returned when
+        some docs failed instead of raising `BulkSaveError`
+
+        With a `spool`, docs of requests which failed for a transient
+        reason, after their retries, are journaled in the spool and counted
+        in `spooled` of the result instead of failing. While the spool
+        isn't replayed all docs are spooled at once.
+
+        With `_raw_json=True` it return raw response, docs aren't retried.
+        When False it returns a `couchdbkit.bulk.BulkResult` with the status
+        of each doc and update list of docs with new revisions and members
+        (like deleted). If docs failed `BulkSaveError` is raised with their
+        errors and the result.
+
+        If `batch_size` or `batch_bytes` is set, docs can be any iterable,
+        like a generator. Docs are read and sent batch by batch so only
+        `concurrency` batches are kept in memory, the result only keeps
+        docs which failed. Docs are updated in input order and errors of
+        all batches are raised at the end in one `BulkSaveError`. With
+        `_raw_json=True` a list of raw responses, one per batch, is
+        returned.
 
         .. seealso:: `HTTP Bulk Document API <http://wiki.apache.org/couchdb/HTTP_Bulk_Document_API>`
 
         """
-        # we definitely need a list here, not any iterable, or groupby will fail
-        docs = list(docs)
-
-        def is_id(doc):
-            return '_id' in doc
-
-        if use_uuids:
-            ids = []
-            noids = []
-            for k, g in groupby(docs, is_id):
-                if not k:
-                    noids = list(g)
-                else:
-                    ids = list(g)
-
-            uuid_count = max(len(noids), self.server.uuid_batch_count)
-            for doc in noids:
-                nextid = self.server.next_uuid(count=uuid_count)
-                if nextid:
-                    doc['_id'] = nextid
-
-        payload = { "docs": docs }
-        if all_or_nothing:
-            payload["all_or_nothing"] = True
+        spool = self.spool
+        if _raw_json:
+            spool = None
+        batched = batch_size is not None or batch_bytes is not None
+        if concurrency != 1 and not batched:
+            raise ValueError("concurrency needs batch_size or batch_bytes")
+        if stream and batched:
+            raise ValueError("stream can't be used with batch_size or "
+                    "batch_bytes")
+        if spool is not None and spool.pending:
+            return self._spool_bulk(docs,
+                    batch_size or DEFAULT_OPEN_DOCS_CHUNK_SIZE,
+                    keep_items=not batched)
+
+        if batched:
+            result = self._bulk_save_batches(docs, use_uuids,
+                    all_or_nothing, _raw_json, batch_size, batch_bytes,
+                    concurrency, catch=retries > 0 or spool is not None)
+            if _raw_json:
+                return result
+        else:
+            # we definitely need a list here, not any iterable
+            docs = list(docs)
+
+            if use_uuids:
+                noids = [doc for doc in docs if '_id' not in doc]
+                uuid_count = max(len(noids), self.server.uuid_batch_count)
+                for doc in noids:
+                    nextid = self._next_uuid(uuid_count)
+                    if nextid:
+                        doc['_id'] = nextid
+
+            payload = { "docs": docs }
+            if all_or_nothing:
+                payload["all_or_nothing"] = True
+            if stream:
+                payload = resource.JSONStream(payload)
+
+            # update docs
+            try:
+                results = maybe_raw(self.res.post('/_bulk_docs',
+                    payload=payload), raw=_raw_json)
+            except resource.RequestFailed, e:
+                failure = request_failed(e)
+                if (retries <= 0 and spool is None) or failure is None or \
+                        _raw_json:
+                    raise
+                results = [failure] * len(docs)
+            self._uncache_docs([doc.get('_id') for doc in docs])
 
-        # update docs
-        results = maybe_raw(self.res.post('/_bulk_docs', payload=payload),
-                        raw=_raw_json)
+            if _raw_json:
+                return results
+
+            result = BulkResult()
+            self._add_bulk_results(result, docs, results)
+
+        self._retry_bulk_docs(result, max(retries, int(force_update)),
+                force_update, all_or_nothing,
+                batch_size or DEFAULT_OPEN_DOCS_CHUNK_SIZE)
+        if spool is not None:
+            items = result.pop_request_failed()
+            if items:
+                self._spool_docs([item.doc for item in items])
+                for item in items:
+                    item.set_spooled()
+                result.spooled += len(items)
+        if result.failed and raise_errors:
+            raise BulkSaveError(result.errors, result=result)
+        return result
 
-        if _raw_json:
-            return results
+    def _next_uuid(self, count=None):
+        """ return a new doc id. With a spool, the id is generated on the
+        client if the server can't be reached. """
+        try:
+            return self.server.next_uuid(count=count)
+        except resource.RequestFailed, e:
+            if self.spool is None or not is_transient(e):
+                raise
+            return random_hex(32)
+
+    def _spool_docs(self, docs):
+        """ journal docs in the spool. Docs without `_id` get one. """
+        self.spool.append(docs, self.res.codec.encode)
+        self._uncache_docs([doc['_id'] for doc in docs])
+
+    def _spool_bulk(self, docs, chunk_size, keep_items=True):
+        """ spool docs of a bulk save without sending them """
+        result = BulkResult(keep_items=keep_items)
+        for chunk in self._iter_keys_chunks(docs, chunk_size):
+            self._spool_docs(chunk)
+            for doc in chunk:
+                item = BulkItem(doc)
+                item.set_spooled()
+                result.add(item)
+        return result
 
+    def _update_bulk_docs(self, docs, results, conflicts=None):
+        """ update docs with results of `_bulk_docs` and return errors.
+        Docs in conflict are added to `conflicts` instead if it's a list.
+        """
         errors = []
-        for i, res in enumerate(results):
+        for doc, res in zip(docs, results):
             if 'error' in res:
-                errors.append(res)
+                if conflicts is not None and res['error'] == 'conflict':
+                    conflicts.append(doc)
+                else:
+                    errors.append(res)
             else:
-                docs[i].update({'_id': res['id'], '_rev': res['rev']})
-        if errors:
-            raise BulkSaveError(errors)
+                self._update_bulk_doc(doc, res)
+        return errors
+
+    def _update_bulk_doc(self, doc, res):
+        doc.update({'_id': res['id'], '_rev': res['rev']})
+        if self.rev_cache is not None:
+            if doc.get('_deleted'):
+                self.rev_cache.pop(res['id'])
+            else:
+                self.rev_cache.set_rev(res['id'], res['rev'])
+
+    def _add_bulk_results(self, result, docs, results):
+        """ add the status of docs to a `BulkResult` """
+        for doc, res in zip(docs, results):
+            item = BulkItem(doc)
+            item.update(res)
+            if item.ok:
+                self._update_bulk_doc(doc, res)
+            result.add(item)
+
+    def _retry_bulk_docs(self, result, retries, force_update,
+            all_or_nothing, chunk_size):
+        """ send again docs of a `BulkResult` which can be retried, in
+        chunks of `chunk_size` docs. Docs in conflict get their current
+        revision with `force_update`. """
+        encode = self.res.codec.encode
+        for attempt in range(retries):
+            items = result.pop_retries(force_update)
+            if not items:
+                return
+
+            conflicts = [item.doc for item in items
+                    if item.error == 'conflict']
+            if conflicts:
+                revs = self.lookup_revs([doc['_id'] for doc in conflicts],
+                        chunk_size=chunk_size)
+                for doc in conflicts:
+                    rev = revs.get(doc['_id'])
+                    if rev is None:
+                        doc.pop('_rev', None)
+                    else:
+                        doc['_rev'] = rev
+
+            for chunk in self._iter_keys_chunks(items, chunk_size):
+                docs = [item.doc for item in chunk]
+                results = self._post_bulk_docs(docs,
+                        [encode(doc) for doc in docs], all_or_nothing,
+                        catch=True)
+                for item, res in zip(chunk, results):
+                    item.update(res)
+                    if item.ok:
+                        self._update_bulk_doc(item.doc, res)
+                        result.saved += 1
+                    else:
+                        result.failed.append(item)
+
+    def _bulk_save_batches(self, docs, use_uuids, all_or_nothing, raw,
+            batch_size, batch_bytes, concurrency, catch=False):
+        def post(batch):
+            return self._post_bulk_docs(batch[0], batch[1], all_or_nothing,
+                    raw, catch=catch)
+
+        batches = self._iter_bulk_batches(docs, use_uuids, batch_size,
+                batch_bytes)
+        raw_results = []
+        result = BulkResult(keep_items=False)
+        for batch, results in imap_ordered(post, batches,
+                concurrency=concurrency):
+            if raw:
+                raw_results.append(results)
+            else:
+                self._add_bulk_results(result, batch[0], results)
 
+        if raw:
+            return raw_results
+        return result
+
+    def _iter_bulk_batches(self, docs, use_uuids, batch_size, batch_bytes):
+        """ split docs in batches. Docs are encoded only once, to compute
+        the size of the batch and to build the payload. """
+        encode = self.res.codec.encode
+        uuid_count = max(batch_size or 0, self.server.uuid_batch_count)
+        batch = []
+        encoded = []
+        size = 0
+        for doc in docs:
+            if use_uuids and '_id' not in doc:
+                doc['_id'] = self._next_uuid(uuid_count)
+            data = encode(doc)
+            if batch and ((batch_size and len(batch) >= batch_size) or
+                    (batch_bytes and size + len(data) > batch_bytes)):
+                yield batch, encoded
+                batch = []
+                encoded = []
+                size = 0
+            batch.append(doc)
+            encoded.append(data)
+            size += len(data) + 1
+
+        if batch:
+            yield batch, encoded
+
+    def _post_bulk_docs(self, docs, encoded, all_or_nothing=False,
+            raw=False, catch=False):
+        """ post a list of encoded docs to `_bulk_docs`. With `catch`, a
+        transient failure of the request is returned as the error of
+        each doc. """
+        options = ""
+        retry_payload = {'docs': docs}
+        if all_or_nothing:
+            options = ',"all_or_nothing":true'
+            # docs aren't checked for conflicts, a second try could
+            # create conflicting revisions
+            retry_payload = None
+        payload = '{"docs":[%s]%s}' % (",".join(encoded), options)
+        try:
+            resp = self.res.post('/_bulk_docs', payload=payload,
+                    headers={"Content-Type": "application/json"},
+                    _retry_payload=retry_payload)
+        except resource.RequestFailed, e:
+            failure = request_failed(e)
+            if not catch or raw or failure is None:
+                raise
+            return [failure] * len(docs)
+        self._uncache_docs([doc.get('_id') for doc in docs])
+        if raw:
+            return resp.body_string()
+        return resp.json_body
+
+    def update_docs(self, docids, mutator, max_retries=DEFAULT_UPDATE_RETRIES,
+            chunk_size=DEFAULT_OPEN_DOCS_CHUNK_SIZE, concurrency=1,
+            create=False):
+        """ read, change and save documents, retrying documents changed
+        by another client in the mean time. Documents are fetched with
+        `open_docs` and saved with `_bulk_docs`, by chunks of
+        `chunk_size`. Documents in conflict are fetched and changed again,
+        so there are at most `max_retries + 1` rounds of reads and writes
+        whatever the number of documents.
+
+            >>> def incr(doc):
+            ...     doc['count'] = doc.get('count', 0) + 1
+            >>> results = db.update_docs(['a', 'b'], incr)
+            >>> [r['status'] for r in results]
+            ['updated', 'updated']
+
+        @param docids: iterable of document ids
+        @param mutator: callable taking a document. It changes the
+        document in place or returns the new document, which gets the
+        `_id` and `_rev` of the document read. If it returns False the
+        document isn't saved.
+        @param max_retries: int, max number of retries of documents in
+        conflict
+        @param chunk_size: int, max number of documents read or saved in
+        one request
+        @param concurrency: int, number of requests sent at the same time
+        @param create: bool, if True missing documents are created, the
+        mutator gets a dict with only their `_id`.
+
+        @return: list of dicts, one per id in the order of `docids`, with
+        the `id` and `status` of the document: "updated" (the new `rev`
+        is given), "unchanged", "missing", "conflict" when it was still in
+        conflict after the retries, or "error" with the `error` and
+        `reason` given by CouchDB.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size should be > 0")
+
+        order = []
+        outcomes = {}
+        for docid in docids:
+            if docid not in outcomes:
+                order.append(docid)
+                outcomes[docid] = None
+
+        encode = self.res.codec.encode
+        def post(batch):
+            return self._post_bulk_docs(batch,
+                    [encode(doc) for doc in batch])
+
+        pending = order
+        for attempt in range(max_retries + 1):
+            if not pending:
+                break
+
+            docs = []
+            current = self.open_docs(pending, chunk_size=chunk_size,
+                    concurrency=concurrency, ignore_missing=True)
+            for docid, doc in zip(pending, current):
+                if doc is None:
+                    if not create:
+                        outcomes[docid] = {'id': docid, 'status': 'missing'}
+                        continue
+                    doc = {'_id': docid}
+                new = mutator(doc)
+                if new is False:
+                    outcomes[docid] = {'id': docid, 'status': 'unchanged'}
+                    continue
+                if new is not None:
+                    if '_rev' in doc and '_rev' not in new:
+                        new['_rev'] = doc['_rev']
+                    doc = new
+                doc['_id'] = docid
+                docs.append(doc)
+
+            conflicts = []
+            for batch, results in imap_ordered(post,
+                    self._iter_keys_chunks(docs, chunk_size),
+                    concurrency=concurrency):
+                for error in self._update_bulk_docs(batch, results,
+                        conflicts):
+                    outcomes[error['id']] = {'id': error['id'],
+                            'status': 'error', 'error': error['error'],
+                            'reason': error.get('reason')}
+            in_conflict = set([doc['_id'] for doc in conflicts])
+            for doc in docs:
+                if doc['_id'] not in in_conflict and \
+                        outcomes[doc['_id']] is None:
+                    outcomes[doc['_id']] = {'id': doc['_id'],
+                            'status': 'updated', 'rev': doc['_rev']}
+            pending = [doc['_id'] for doc in conflicts]
+
+        for docid in pending:
+            outcomes[docid] = {'id': docid, 'status': 'conflict'}
+        return [outcomes[docid] for docid in order]
 
     def bulk_delete(self, docs, all_or_nothing=False, _raw_json=False):
         """ bulk delete.
@@ -590,11 +1324,24 @@ class Database(object):
             docid = resource.escape_docid(doc['_id'])
             result = maybe_raw(self.res.delete(docid, rev=doc['_rev']),
                         raw=_raw_json)
+            self._uncache_docs([doc['_id']])
+            if self.rev_cache is not None:
+                self.rev_cache.pop(doc['_id'])
         elif isinstance(doc, basestring): # we get a docid
-            rev = self.get_rev(doc)
+            rev = self._known_rev(doc)
             docid = resource.escape_docid(doc)
-            result = maybe_raw(self.res.delete(docid, rev=rev),
-                            raw=_raw_json)
+            try:
+                result = maybe_raw(self.res.delete(docid, rev=rev),
+                                raw=_raw_json)
+            except resource.ResourceConflict:
+                if self.rev_cache is None:
+                    raise
+                # the cached revision is outdated
+                result = maybe_raw(self.res.delete(docid,
+                    rev=self.get_rev(doc)), raw=_raw_json)
+            self._uncache_docs([doc])
+            if self.rev_cache is not None:
+                self.rev_cache.pop(doc)
         return result
 
     def copy_doc(self, doc, dest=None, _raw_json=False):
@@ -613,11 +1360,12 @@ class Database(object):
         if dest is None:
             destination = self.server.next_uuid(count=1)
         elif isinstance(dest, basestring):
-            if dest in self:
-                dest = self.get(dest)['_rev']
-                destination = "%s?rev=%s" % (dest['_id'], dest['_rev'])
-            else:
+            try:
+                rev = self._known_rev(dest)
+            except resource.ResourceNotFound:
                 destination = dest
+            else:
+                destination = "%s?rev=%s" % (dest, rev)
         elif isinstance(dest, dict):
             if '_id' in dest and '_rev' in dest and dest['_id'] in self:
                 rev = dest['_rev']
@@ -629,11 +1377,19 @@ class Database(object):
             result = maybe_raw(self.res.copy('/%s' % docid,
                         headers={ "Destination": str(destination) }),
                         raw=_raw_json)
+            destid = str(destination).split('?', 1)[0]
+            self._uncache_docs([destid])
+            if self.rev_cache is not None:
+                if _raw_json:
+                    self.rev_cache.pop(destid)
+                else:
+                    self.rev_cache.set_rev(result.get('id', destid),
+                            result.get('rev'))
             return result
 
         result = { 'ok': False }
         if _raw_json:
-            return anyjson.serialize(result)
+            return self.res.codec.encode(result)
         return result
 
 
@@ -651,7 +1407,8 @@ class Database(object):
         and beginning slash will be removed. Usefull with c-l for example.
         @param obj, Object with a wrapper function
         @param wrapper: function used to wrap results
-        @param params: params of the view
+        @param params: params of the view. With `_stream_keys=True`,
+        `keys` are encoded one by one while the request is sent.
 
         """
         if view_name.startswith('/'):
@@ -754,6 +1511,7 @@ class Database(object):
         docid = resource.escape_docid(doc1['_id'])
         res = self.res(docid).put(name, payload=content,
                 headers=headers, rev=doc1['_rev']).json_body
+        self._uncache_docs([doc1['_id']])
 
         if res['ok']:
             new_doc = self.get(doc1['_id'], rev=res['rev'])
@@ -772,6 +1530,7 @@ class Database(object):
         name = url_quote(name, safe="")
 
         res = self.res(docid).delete(name, rev=doc['_rev']).json_body
+        self._uncache_docs([doc['_id']])
         if res['ok']:
             new_doc = self.get(doc['_id'], rev=res['rev'])
             doc.update(new_doc)
@@ -824,11 +1583,17 @@ class Database(object):
        self.delete_doc(docid)
 
     def __iter__(self):
-        return self.documents().iterator()
+        return self.documents().paged()
 
     def __nonzero__(self):
         return (len(self) > 0)
 
+def _count_rows(rows, call):
+    # count rows of a profiled view while they are iterated
+    for row in rows:
+        call.rows += 1
+        yield row
+
 class ViewResults(object):
     """
     Object to retrieve view results.
@@ -848,16 +1613,143 @@ class ViewResults(object):
         self._total_rows = None
         self._offset = 0
         self._dynamic_keys = []
+        self._has_info = False
+        # `ViewCall` of the cached results when views are profiled
+        self._view_call = None
 
-    def iterator(self):
+    def iterator(self, stream=False):
+        """ iterate view results
+
+        @param stream: boolean, if True and the results haven't been
+        fetched yet, rows are parsed and wrapped one by one while the
+        response is read. They aren't cached so memory stays flat
+        whatever the size of the results.
+        """
+        if stream and not self._result_cache:
+            return self._stream_iterator()
+        return self._cached_iterator()
+
+    def _cached_iterator(self):
         self._fetch_if_needed()
         rows = self._result_cache.get('rows', [])
+        return self._wrap_rows(rows, self._view_call)
+
+    def _stream_iterator(self):
+        self._reset_info()
+        resp = self.view._exec(**self.params)
+        call = resp.view_call
+        rows = resp.iter_rows(info_callback=self._update_info)
+        if call is not None:
+            call.rows = 0
+            rows = _count_rows(rows, call)
+        return self._wrap_rows(rows, call)
+
+    def _wrap_rows(self, rows, call):
         wrapper = self.view._wrapper
-        for row in rows:
-            if  wrapper is not None:
-                yield self.view._wrapper(row)
-            else:
+        if wrapper is None:
+            for row in rows:
                 yield row
+        elif call is None:
+            for row in rows:
+                yield wrapper(row)
+        else:
+            for row in rows:
+                start = time.time()
+                obj = wrapper(row)
+                call.wrap_time += time.time() - start
+                yield obj
+
+    def paged(self, page_size=DEFAULT_PAGE_SIZE, prefetch=0):
+        """ iterate over all the results page by page. Each page is
+        fetched with a new request starting at the key and doc id of the
+        next row (`startkey` + `startkey_docid`) instead of using `skip`,
+        so each page costs the same whatever its position in the view and
+        only one page is kept in memory. `descending`, `endkey`,
+        `inclusive_end` and `limit` are respected.
+
+        @param page_size: int, number of rows fetched per request
+        @param prefetch: int, number of pages read ahead in a background
+        thread while the current one is processed. 0 (the default) fetch
+        pages only when they are needed.
+        """
+        if 'keys' in self.params:
+            raise ValueError("results with keys can't be paginated")
+        if page_size < 1:
+            raise ValueError("page_size should be greater than 0")
+
+        params = self.params.copy()
+        limit = params.pop('limit', None)
+        if 'key' in params:
+            params['startkey'] = params['endkey'] = params.pop('key')
+            params['inclusive_end'] = True
+
+        pages = self._iter_pages(params, page_size, limit)
+        if prefetch > 0:
+            pages = read_ahead(pages, depth=prefetch)
+        return self._iter_pages_rows(pages)
+
+    def _iter_pages(self, params, page_size, limit):
+        while params is not None:
+            size = page_size
+            if limit is not None:
+                if limit <= 0:
+                    break
+                size = min(page_size, limit)
+
+            result, call, params = self._fetch_page(params, size)
+            if limit is not None:
+                limit -= len(result.get('rows', []))
+            yield result, call
+
+    def _iter_pages_rows(self, pages):
+        first_page = True
+        for result, call in pages:
+            if first_page:
+                self._reset_info()
+                self._update_info(result)
+                first_page = False
+
+            for row in self._wrap_rows(result.get('rows', []), call):
+                yield row
+
+    def _fetch_page(self, params, page_size):
+        """ fetch one page of results. Return the result, its `ViewCall`
+        and params of the next page or None if it's the last one. """
+        page_params = params.copy()
+        page_params['limit'] = page_size + 1
+        result, call = self.view._fetch(**page_params)
+        rows = result.get('rows', [])
+        if len(rows) <= page_size:
+            return result, call, None
+
+        # the extra row is the start of the next page
+        next_row = rows.pop()
+        next_params = params.copy()
+        next_params['startkey'] = next_row['key']
+        if 'id' in next_row:
+            next_params['startkey_docid'] = next_row['id']
+        else:
+            next_params.pop('startkey_docid', None)
+
+        # a doc could emit the same key more than once, skip rows with
+        # the same key and id than the next one we already got.
+        skip = 0
+        for row in reversed(rows):
+            if row['key'] != next_row['key'] or \
+                    row.get('id') != next_row.get('id'):
+                break
+            skip += 1
+
+        if skip == len(rows) and 'startkey' in params and \
+                params['startkey'] == next_row['key'] and \
+                params.get('startkey_docid') == next_row.get('id'):
+            skip += params.get('skip', 0)
+
+        if skip:
+            next_params['skip'] = skip
+        else:
+            next_params.pop('skip', None)
+        return result, call, next_params
 
     def first(self):
         """
@@ -903,7 +1795,14 @@ class ViewResults(object):
 
     def fetch(self):
         """ fetch results and cache them """
-        # reset dynamic keys
+        self._reset_info()
+        self._result_cache, self._view_call = self.view._fetch(**self.params)
+        self._update_info(self._result_cache)
+
+    def _reset_info(self):
+        self._total_rows = None
+        self._offset = 0
+        self._has_info = False
         for key in  self._dynamic_keys:
             try:
                 delattr(self, key)
@@ -911,17 +1810,19 @@ class ViewResults(object):
                 pass
         self._dynamic_keys = []
 
-        self._result_cache = self.view._exec(**self.params).json_body
-        self._total_rows = self._result_cache.get('total_rows')
-        self._offset = self._result_cache.get('offset', 0)
+    def _update_info(self, info):
+        self._has_info = True
+        if 'total_rows' in info:
+            self._total_rows = info['total_rows']
+        if 'offset' in info:
+            self._offset = info['offset']
 
         # add key in view results that could be added by an external
         # like couchdb-lucene
-        for key in self._result_cache.keys():
+        for key in info.keys():
             if key not in ["total_rows", "offset", "rows"]:
                 self._dynamic_keys.append(key)
-                setattr(self, key, self._result_cache[key])
-
+                setattr(self, key, info[key])
 
     def fetch_raw(self):
         """ retrive the raw result """
@@ -931,10 +1832,15 @@ class ViewResults(object):
         if not self._result_cache:
             self.fetch()
 
+    def _fetch_info_if_needed(self):
+        # view infos may have been already read while streaming rows
+        if not self._has_info:
+            self._fetch_if_needed()
+
     @property
     def total_rows(self):
         """ return number of total rows in the view """
-        self._fetch_if_needed()
+        self._fetch_info_if_needed()
         # reduce case, count number of lines
         if self._total_rows is None:
             return self.count()
@@ -943,7 +1849,7 @@ class ViewResults(object):
     @property
     def offset(self):
         """ current position in the view """
-        self._fetch_if_needed()
+        self._fetch_info_if_needed()
         return self._offset
 
     def __getitem__(self, key):
@@ -980,34 +1886,78 @@ class ViewInterface(object):
     def __call__(self, **params):
         return ViewResults(self, **params)
 
+    # results can be kept in the view cache of the database
+    _cacheable = False
+
     def __iter__(self):
         return self()
 
+    def _fetch(self, **params):
+        """ return decoded results, from the view cache of the database
+        if there is one, and the `ViewCall` of the request made when the
+        database has a view profiler. The call is None if there was no
+        request. """
+        profiler = self._db.view_profiler
+        if profiler is not None:
+            profiler.pop_call()
+
+        cache = self._db.view_cache
+        if cache is None or not self._cacheable:
+            result = self._exec(**params).json_body
+        else:
+            result = cache.fetch(self, params)
+
+        call = None
+        if profiler is not None:
+            call = profiler.pop_call()
+            if call is not None and isinstance(result, dict):
+                call.rows = len(result.get('rows', []))
+        return result, call
+
     def _exec(self, **params):
+        """ send the request of the view, recorded by the view profiler
+        of the database if there is one """
+        profiler = self._db.view_profiler
+        if profiler is None:
+            return self._request(**params)
+        return profiler.exec_view(self, params)
+
+    def _request(self, **params):
         raise NotImplementedError
 
 class View(ViewInterface):
     """ Object used to wrap a view and return ViewResults.
     Generally called via the `view` method in a `Database` instance. """
 
+    _cacheable = True
+
     def __init__(self, db, view_path, wrapper=None):
         ViewInterface.__init__(self, db, wrapper=wrapper)
         self.view_path = view_path
 
-    def _exec(self, **params):
+    def _request(self, **params):
+        headers = params.pop('_headers', None)
+        stream_keys = params.pop('_stream_keys', False)
         if 'keys' in params:
             keys = params.pop('keys')
-            return self._db.res.post(self.view_path, payload={ 'keys': keys }, **params)
+            payload = { 'keys': keys }
+            if stream_keys:
+                payload = resource.JSONStream(payload)
+            return self._db.res.post(self.view_path, payload=payload,
+                    headers=headers, **params)
         else:
-            return self._db.res.get(self.view_path, **params)
+            return self._db.res.get(self.view_path, headers=headers, **params)
 
 class TempView(ViewInterface):
     """ Object used to wrap a temporary and return ViewResults. """
+
+    view_path = '_temp_view'
+
     def __init__(self, db, design, wrapper=None):
         ViewInterface.__init__(self, db, wrapper=wrapper)
         self.design = design
         self._wrapper = wrapper
 
-    def _exec(self, **params):
-        return self._db.res.post('_temp_view', payload=self.design,
+    def _request(self, **params):
+        return self._db.res.post(self.view_path, payload=self.design,
                 **params)
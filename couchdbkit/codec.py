@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+JSON codecs used by couchdbkit to encode and decode documents, view
+results and changes.
+
+Codecs are registered by name with a loader returning the encode and
+decode functions of a JSON library. By default the first library
+installed in `AUTO_ORDER` is used: simplejson or the standard json
+module. Faster libraries like ujson and yajl must be chosen explicitly,
+ujson rounds floats to 10 significant digits by default. A codec can
+also be set globally with `set_default_codec`, or per `Server` or
+`Database` instance:
+
+    >>> from couchdbkit import Server
+    >>> server = Server(codec="simplejson")
+    >>> server.res.codec
+    <Codec simplejson>
+
+Use `examples/benchmarks/codec_bench.py` to compare installed codecs on
+CouchDB payloads.
+"""
+
+AUTO_ORDER = ['simplejson', 'json', 'anyjson']
+
+class Codec(object):
+    """ Object wrapping the encode and decode functions of a JSON
+    library. `encode` always return a utf-8 bytestring. """
+
+    def __init__(self, name, encode, decode):
+        self.name = name
+        self._encode = encode
+        self.decode = decode
+
+    def __repr__(self):
+        return "<%s %s>" % (self.__class__.__name__, self.name)
+
+    def encode(self, obj):
+        data = self._encode(obj)
+        if isinstance(data, unicode):
+            return data.encode('utf-8')
+        return data
+
+def _load_ujson():
+    import ujson
+    return ujson.dumps, ujson.loads
+
+def _load_yajl():
+    import yajl
+    return yajl.dumps, yajl.loads
+
+def _load_simplejson():
+    import simplejson
+    return simplejson.dumps, simplejson.loads
+
+def _load_json():
+    import json
+    return json.dumps, json.loads
+
+def _load_anyjson():
+    import anyjson
+    return anyjson.serialize, anyjson.deserialize
+
+_loaders = {
+    'ujson': _load_ujson,
+    'yajl': _load_yajl,
+    'simplejson': _load_simplejson,
+    'json': _load_json,
+    'anyjson': _load_anyjson
+}
+_codecs = {}
+_default_codec = None
+
+def register_codec(name, loader):
+    """ register a JSON codec
+
+    @param name: str, name of the codec
+    @param loader: callable returning a tuple (encode, decode). It
+    should raise ImportError if the library isn't installed.
+    """
+    _loaders[name] = loader
+    _codecs.pop(name, None)
+
+def load_codec(name):
+    """ return the `Codec` instance registered with this name.
+    Raise ImportError if its library isn't installed."""
+    if name not in _codecs:
+        try:
+            loader = _loaders[name]
+        except KeyError:
+            raise ValueError("unknown JSON codec %r" % name)
+        encode, decode = loader()
+        _codecs[name] = Codec(name, encode, decode)
+    return _codecs[name]
+
+def available_codecs():
+    """ return names of installed codecs """
+    names = []
+    others = sorted([name for name in _loaders if name not in AUTO_ORDER])
+    for name in AUTO_ORDER + others:
+        try:
+            load_codec(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+def get_codec(codec=None):
+    """ return a `Codec` instance
+
+    @param codec: None, codec name or `Codec` instance. If None the
+    default codec is returned.
+    """
+    if codec is None:
+        return default_codec()
+    elif isinstance(codec, Codec):
+        return codec
+    return load_codec(codec)
+
+def default_codec():
+    """ return the default codec, the first installed one of
+    `AUTO_ORDER` if none has been set with `set_default_codec`. """
+    global _default_codec
+    if _default_codec is None:
+        for name in AUTO_ORDER:
+            try:
+                _default_codec = load_codec(name)
+                break
+            except ImportError:
+                continue
+        else:
+            raise ImportError("no JSON library found, tried %s" %
+                    ", ".join(AUTO_ORDER))
+    return _default_codec
+
+def set_default_codec(codec):
+    """ set the codec used when no codec is given to a `Server`,
+    `Database` or `CouchdbResource`. If None auto select it again. """
+    global _default_codec
+    if codec is None:
+        _default_codec = None
+    else:
+        _default_codec = get_codec(codec)
+
+def encode(obj):
+    """ encode obj in JSON with the default codec """
+    return default_codec().encode(obj)
+
+def decode(data):
+    """ decode JSON data with the default codec """
+    return default_codec().decode(data)
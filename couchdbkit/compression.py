@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Compression of bodies. With `accept_encoding=True` a server asks for gzip
+or deflate responses and decodes them while they are read, streamed view
+rows included. With a `compress_threshold`, request bodies of at least
+this size are sent gzipped:
+
+    >>> from couchdbkit import Server
+    >>> server = Server(accept_encoding=True, compress_threshold=16384)
+
+CouchDB itself only compresses attachments, compressed JSON responses
+and compressed request bodies need a proxy supporting them in front of
+the server. Changes feeds are never asked compressed, a compressor
+buffers lines until it has enough data.
+
+Use `examples/benchmarks/compression_bench.py` to compare sizes and
+times of compressed payloads on a link.
+"""
+
+import zlib
+
+ACCEPT_ENCODING = 'gzip, deflate'
+DEFAULT_COMPRESS_LEVEL = 6
+READ_CHUNK_SIZE = 16384
+
+def gzip_compressor(level=DEFAULT_COMPRESS_LEVEL):
+    """ return a zlib compressor writing the gzip format """
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def gzip_compress(data, level=DEFAULT_COMPRESS_LEVEL):
+    c = gzip_compressor(level)
+    return c.compress(data) + c.flush()
+
+class Decoder(object):
+    """ incremental decoder of a gzip or deflate body. A deflate body
+    should have a zlib header but some servers send raw deflate data,
+    both are accepted. """
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._obj = None
+        self._first = ""
+
+    def decompress(self, data):
+        if self._obj is None:
+            # the zlib header needs 2 bytes
+            data = self._first + data
+            if len(data) < 2:
+                self._first = data
+                return ""
+            self._first = ""
+            self._obj = zlib.decompressobj()
+            try:
+                return self._obj.decompress(data)
+            except zlib.error:
+                self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._obj.decompress(data)
+
+    def flush(self):
+        if self._obj is None:
+            return self.decompress("")
+        return self._obj.flush()
+
+def get_decoder(encoding):
+    """ return a `Decoder` for the value of a Content-Encoding header or
+    None if the body isn't compressed """
+    if not encoding:
+        return None
+    encoding = encoding.strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return Decoder('gzip')
+    elif encoding == 'deflate':
+        return Decoder('deflate')
+    return None
+
+def decompress(data, encoding):
+    decoder = get_decoder(encoding)
+    if decoder is None:
+        return data
+    return decoder.decompress(data) + decoder.flush()
+
+class DecompressingReader(object):
+    """ file-like object decompressing a compressed stream while it's
+    read """
+
+    def __init__(self, stream, decoder):
+        self.stream = stream
+        self.decoder = decoder
+        self._buf = ""
+        self._eof = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            chunks = [self._buf]
+            self._buf = ""
+            while not self._eof:
+                chunks.append(self._fill())
+            return "".join(chunks)
+
+        while len(self._buf) < size and not self._eof:
+            self._buf += self._fill()
+        data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+    def _fill(self):
+        data = self.stream.read(READ_CHUNK_SIZE)
+        if not data:
+            self._eof = True
+            return self.decoder.flush()
+        return self.decoder.decompress(data)
+
+    def readline(self, size=-1):
+        while "\n" not in self._buf and not self._eof:
+            self._buf += self._fill()
+        pos = self._buf.find("\n") + 1 or len(self._buf)
+        if size is not None and size >= 0:
+            pos = min(pos, size)
+        data, self._buf = self._buf[:pos], self._buf[pos:]
+        return data
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        self.stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
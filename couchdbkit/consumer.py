@@ -5,11 +5,10 @@
 
 from __future__ import with_statement
 
-import anyjson
-import asyncore
-import asynchat
-import socket
-import sys
+from restkit.errors import NoMoreData
+from restkit.http.body import ChunkedReader
+
+from couchdbkit.codec import get_codec
 
 class Consumer(object):
     """ Database change consumer
@@ -75,87 +74,78 @@ class Consumer(object):
                     break
                 buf += data
             
-            ret = anyjson.deserialize(buf)
+            ret = self.db.res.codec.decode(buf)
             for callback in self.callbacks:
                 callback(ret)
             return ret
         
     def wait(self, **params):
-        """ Wait for changes until the connection close (continuous feed)
+        """ Wait for changes until the connection close (continuous feed).
+        Callbacks are called with each line of change as soon as it's
+        received. With green threads, only the current greenlet waits.
         
         Args:
         @param params: kwargs
         See Changes API (http://wiki.apache.org/couchdb/HTTP_database_API#Changes)
         
-        @return: dict, line of change
+        @return: dict, last line of change
         """
         params.update({"feed": "continuous"})
         self.resp = resp = self.db.res.get("_changes", **params)
-        
-        if resp.headers.get('transfer-encoding') == "chunked":
-            chunked = True
-        else:
-            chunked = False
-        
-        change_handler = continuous_changes_handler(resp, self.callbacks, 
-                                                    chunked)
-        asyncore.loop()
 
-        
-        
-class continuous_changes_handler(asynchat.async_chat):
-    
-    def __init__(self, resp, callbacks, chunked):
-        self.resp = resp
-        self.callbacks = callbacks
-        self.chunked = chunked
-        
-        
-        self.buf = []
-        self.sock = sock = resp.response.body.reader.unreader.sock
-        asynchat.async_chat.__init__(self, sock=sock)
-        
-        if self.chunked:
-            self.set_terminator("\r\n")
-        else:
-            self.set_terminator("\n")
-            
-        data = resp.response.body.reader.buf.getvalue()
-        self.buf.append(data)
+        line = None
+        for line in iter_changes(resp, self.db.res.codec):
+            for callback in self.callbacks:
+                callback(line)
+        return line
 
-        self.chunk_left = False        
-        
-    def handle_close(self):
-    
-        self.close()
-        
-    def collect_incoming_data(self, data):
-        if not data: return
-        if self.chunked:
-            if not self.chunk_left:
-                return
-                
-            self.buf.append(data)
+def iter_lines(resp):
+    """ iterate lines of a response while they are received. Reads don't
+    wait for a full buffer so each line is returned as soon as it's
+    received. With green threads only the current greenlet waits.
+
+    The connection is released at the end of the response, or closed if
+    the iteration is stopped before.
+    """
+    body = resp.response.body
+    reader = body.reader
+    if isinstance(reader, ChunkedReader):
+        pieces = reader.parser or ()
+        buf = [reader.buf.getvalue()]
+    else:
+        pieces = iter(reader.unreader.read, "")
+        buf = []
+
+    complete = False
+    try:
+        try:
+            for data in pieces:
+                if "\n" not in data:
+                    buf.append(data)
+                    continue
+                lines = ("".join(buf) + data).split("\n")
+                buf = [lines.pop()]
+                for line in lines:
+                    yield line
+        except NoMoreData:
+            pass
+        if "".join(buf):
+            yield "".join(buf)
+        complete = True
+    finally:
+        if complete:
+            body.close()
         else:
-            self.buf.append(data)
-            
-    def emit_line(self, line):
-        line = anyjson.deserialize(line)
-        for callback in self.callbacks:
-            callback(line)
-            
-    def found_terminator(self):
-        if self.chunked and not self.chunk_left:
-            # we got the length
-            self.chunk_left = True
-            self.buf = []
-            return
-            
-        line = "".join(self.buf)
-        self.buf = []
-        if self.chunked: 
-            self.chunk_left = False
-            line = line.strip()
+            # unread data are left on the socket, it can't be reused
+            body.req.unreader.close()
+            body.closed = True
+        resp.closed = True
 
+def iter_changes(resp, codec=None):
+    """ iterate decoded lines of a continuous changes feed, heartbeats
+    are skipped """
+    codec = get_codec(codec)
+    for line in iter_lines(resp):
+        line = line.strip()
         if line:
-            self.emit_line(line)
\ No newline at end of file
+            yield codec.decode(line)
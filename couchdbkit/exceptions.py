@@ -34,10 +34,25 @@ class DocsPathNotFound(Exception):
     
 class BulkSaveError(Exception):
     """ exception raised when bulk save contain errors.
-    error are saved in `errors` property.
+    error are saved in `errors` property, the
+    `couchdbkit.bulk.BulkResult` of the save in `result`.
     """
-    def __init__(self, errors, *args):
+    def __init__(self, errors, *args, **kwargs):
         self.errors = errors
+        self.result = kwargs.get('result')
+
+class DocsNotFound(Exception):
+    """ exception raised when some documents requested with
+    `Database.open_docs` are missing. Ids of documents that never existed
+    are in the `missing` property, ids of deleted documents in `deleted`.
+    Results are in `docs`, with None for each document not found.
+    """
+    def __init__(self, missing, deleted, docs, *args):
+        Exception.__init__(self, "%s missing and %s deleted documents" % (
+            len(missing), len(deleted)))
+        self.missing = missing
+        self.deleted = deleted
+        self.docs = docs
 
 class ViewServerError(Exception):
     """ exception raised by view server"""
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Futures and a pool of worker threads running functions in background,
+used by the asynchronous client (`couchdbkit.asyncclient`):
+
+    >>> executor = ThreadPoolExecutor(max_workers=4)
+    >>> future = executor.submit(db.open_doc, "mydoc")
+    >>> doc = future.result()
+"""
+
+from __future__ import with_statement
+
+import Queue
+import sys
+import threading
+
+DEFAULT_MAX_WORKERS = 10
+
+class TimeoutError(Exception):
+    """ raised when the result of a future isn't available in time """
+
+class Future(object):
+    """ result of a call running in background """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def __repr__(self):
+        if self.done():
+            state = "done"
+        else:
+            state = "pending"
+        return "<%s %s>" % (self.__class__.__name__, state)
+
+    def done(self):
+        """ return True if the call is finished """
+        return self._done.isSet()
+
+    def result(self, timeout=None):
+        """ wait for the call and return its result or raise its
+        exception
+
+        @param timeout: float, max time to wait in seconds. `TimeoutError`
+        is raised if the call isn't finished. Wait forever if None.
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """ wait for the call and return its exception or None """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, callback):
+        """ call `callback` with the future when the call is finished.
+        It's called immediately if it's already finished. """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _wait(self, timeout):
+        self._done.wait(timeout)
+        if not self.done():
+            raise TimeoutError("call not finished after %ss" % timeout)
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                pass
+
+class ThreadPoolExecutor(object):
+    """ run calls in a pool of worker threads. Threads are started when
+    needed, up to `max_workers`.
+
+    @param max_workers: int, max number of calls running at the same time
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        if max_workers < 1:
+            raise ValueError("max_workers should be > 0")
+        self.max_workers = max_workers
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._idle = 0
+        self._shutdown = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown(wait=True)
+
+    def submit(self, func, *args, **kwargs):
+        """ run `func(*args, **kwargs)` in background and return a
+        `Future` """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("can't submit calls after shutdown")
+            self._queue.put((future, func, args, kwargs))
+            if self._idle > 0:
+                self._idle -= 1
+            elif len(self._threads) < self.max_workers:
+                t = threading.Thread(target=self._work)
+                t.setDaemon(True)
+                self._threads.append(t)
+                t.start()
+        return future
+
+    def map(self, func, *iterables):
+        """ like `itertools.imap` but calls are run in background. Results
+        are returned in order. """
+        futures = [self.submit(func, *args) for args in zip(*iterables)]
+        def results():
+            for future in futures:
+                yield future.result()
+        return results()
+
+    def shutdown(self, wait=True):
+        """ stop workers once pending calls are done
+
+        @param wait: bool, wait for the workers to stop
+        """
+        with self._lock:
+            self._shutdown = True
+            threads = list(self._threads)
+        for t in threads:
+            self._queue.put(None)
+        if wait:
+            for t in threads:
+                t.join()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, func, args, kwargs = item
+            try:
+                result = func(*args, **kwargs)
+            except:
+                future.set_exc_info(sys.exc_info())
+            else:
+                future.set_result(result)
+            with self._lock:
+                self._idle += 1
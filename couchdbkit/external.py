@@ -3,8 +3,9 @@
 # This file is part of couchdbkit released under the MIT license. 
 # See the NOTICE for more information.
 
-import anyjson
 import sys
+
+from couchdbkit.codec import get_codec
         
 class External(object):
     """ simple class to handle an external
@@ -27,9 +28,10 @@ class External(object):
         
     """
 
-    def __init__(self, stdin=sys.stdin, stdout=sys.stdout):
+    def __init__(self, stdin=sys.stdin, stdout=sys.stdout, codec=None):
         self.stdin = stdin
         self.stdout = stdout
+        self.codec = get_codec(codec)
         
     def handle_line(self, line):
         raise NotImplementedError
@@ -41,7 +43,7 @@ class External(object):
     def lines(self):
         line = self.stdin.readline()
         while line:
-            yield anyjson.deserialize(line)
+            yield self.codec.decode(line)
             line = self.stdin.readline()
     
     def run(self):
@@ -54,4 +56,4 @@ class External(object):
             'body': body, 
             'headers': headers
         }
-        self.write(anyjson.serialize(resp))
\ No newline at end of file
+        self.write(self.codec.encode(resp))
\ No newline at end of file
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Cooperative mode for green threads (gevent or eventlet). Patch the
+standard library as usual and give a `GreenPool` to the server, sockets
+then yield to the hub instead of blocking it:
+
+    >>> from gevent import monkey; monkey.patch_all()
+    >>> from couchdbkit import Server
+    >>> from couchdbkit.green import GreenPool
+    >>> server = Server(pool_instance=GreenPool("gevent", keepalive=50))
+
+`Consumer.wait` reads the continuous changes feed line by line on the
+socket of the response, it can run in its own greenlet and be stopped
+with `gevent.kill`.
+"""
+
+import collections
+import time
+
+from restkit.pool.base import BasePool
+from restkit.util import sock
+
+DEFAULT_GREEN_KEEPALIVE = 50
+DEFAULT_REAP_INTERVAL = 1.0
+
+def green_lib(mode):
+    """ return the `(spawn, sleep)` functions of a green threads library
+
+    @param mode: str, "gevent" or "eventlet"
+    """
+    if mode == "gevent":
+        import gevent
+        return gevent.spawn, gevent.sleep
+    elif mode == "eventlet":
+        import eventlet
+        return eventlet.spawn, eventlet.sleep
+    raise ValueError("unknown green mode %r" % mode)
+
+class GreenPool(BasePool):
+    """ keep-alive pool of connections for green threads. Connections are
+    only taken and given back between two switches of the hub, so the pool
+    doesn't need locks. A greenlet closes expired connections.
+
+    The last connection released is the first one reused, so connections
+    in excess expire and are closed when the load goes down.
+
+    @param mode: str, green threads library, "gevent" or "eventlet"
+    @param keepalive: int, max number of idle connections kept by host
+    @param timeout: int, seconds an idle connection is kept
+    @param reap_interval: float, seconds between two checks of expired
+    connections
+    """
+
+    def __init__(self, mode="gevent", keepalive=DEFAULT_GREEN_KEEPALIVE,
+            timeout=300, reap_interval=DEFAULT_REAP_INTERVAL):
+        BasePool.__init__(self, keepalive=keepalive, timeout=timeout)
+        self.mode = mode
+        self.reap_interval = reap_interval
+        self._spawn, self._sleep = green_lib(mode)
+        self._hosts = {}
+        self.reaper = self._spawn(self._reap_loop)
+
+    def get(self, netloc):
+        connections = self._hosts.get(netloc)
+        now = time.time()
+        while connections:
+            conn, expires = connections.pop()
+            if expires >= now:
+                return conn
+            sock.close(conn)
+        return None
+
+    def put(self, netloc, conn):
+        connections = self._hosts.setdefault(netloc, collections.deque())
+        if not self.alive or len(connections) >= self.keepalive:
+            sock.close(conn)
+            return
+        connections.append((conn, time.time() + self.timeout))
+
+    def clear_host(self, netloc):
+        connections = self._hosts.pop(netloc, None)
+        while connections:
+            conn, expires = connections.pop()
+            sock.close(conn)
+
+    def clear(self):
+        for netloc in self._hosts.keys():
+            self.clear_host(netloc)
+
+    def size(self, netloc):
+        """ number of idle connections kept for a host """
+        return len(self._hosts.get(netloc, ()))
+
+    def reap(self):
+        """ close expired connections """
+        now = time.time()
+        for connections in self._hosts.values():
+            # oldest connections are on the left
+            while connections and connections[0][1] < now:
+                conn, expires = connections.popleft()
+                sock.close(conn)
+
+    def _reap_loop(self):
+        while self.alive:
+            self._sleep(self.reap_interval)
+            self.reap()
@@ -25,8 +25,7 @@ import os
 import socket
 import sys
 
-import anyjson
-
+from couchdbkit import codec
 from couchdbkit.exceptions import DocsPathNotFound
 from couchdbkit.resource import ResourceNotFound
 from couchdbkit.utils import *
@@ -403,7 +402,7 @@ class FileSystemDocsLoader(BaseDocsLoader):
                         
                 if name.endswith('.json'):
                     try:
-                        content = anyjson.deserialize(content)
+                        content = codec.decode(content)
                     except ValueError:
                         if verbose >= 2:
                             print >>sys.stderr, "Json invalid in %s" % current_path
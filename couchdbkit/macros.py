@@ -38,8 +38,7 @@ import re
 import sys
 from hashlib import md5
 
-import anyjson
-
+from couchdbkit import codec
 from couchdbkit.utils import read_file, read_json, to_bytestring
 
 def package_shows(doc, funcs, app_dir, objs, verbose=False):
@@ -164,6 +163,6 @@ def run_json_macros(doc, f_string, app_dir, verbose=False):
         return f_string
 
     for k, v in included.iteritems():
-        varstrings.append("var %s = %s;" % (k, anyjson.serialize(v)))
+        varstrings.append("var %s = %s;" % (k, codec.encode(v)))
 
     return re_json.sub(rjson2, f_string)
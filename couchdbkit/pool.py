@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Connection pool used by `CouchdbResource` when no `pool_instance` is
+given. Connections are kept alive between requests, the number of
+connections opened to a host can be limited, requests then wait for a
+free connection:
+
+    >>> from couchdbkit import Server, ConnectionPool
+    >>> pool = ConnectionPool(max_connections=20, keepalive=10,
+    ...         wait_timeout=5)
+    >>> server = Server(pool_instance=pool)
+    >>> server.res.prewarm(5) # open 5 connections now
+    >>> pool.stats()
+    {'created': 5, 'reused': 0, 'discarded': 0, 'waits': 0, ...}
+
+The pool is reset in a process created by `os.fork()` (a prefork server
+like gunicorn), connections of the parent process aren't shared.
+"""
+
+from __future__ import with_statement
+
+import collections
+import os
+import select
+import socket
+try:
+    import ssl
+except ImportError:
+    ssl = None
+import threading
+import time
+import weakref
+
+from restkit.errors import RequestFailed
+from restkit.pool.base import BasePool
+from restkit.util import sock
+
+DEFAULT_KEEPALIVE = 10
+DEFAULT_POOL_TIMEOUT = 300
+
+class PoolTimeout(RequestFailed):
+    """ raised when no connection of the pool is free in time """
+
+class PooledConnection(object):
+    """ socket of a `ConnectionPool`. Closing it frees its place in the
+    pool. restkit only reads sockets, so connections are real sockets
+    subclasses. """
+
+    def _init_pooled(self, pool, netloc):
+        self._pool = pool
+        self._pool_netloc = netloc
+        self._pool_pid = os.getpid()
+        self._pool_active = False
+        self._pool_ref = None
+        self._pool_closed = False
+        self.pool_expires = None
+
+    def close(self):
+        self._pool._discard(self)
+
+class PooledSocket(PooledConnection, socket.socket):
+
+    def __init__(self, pool, netloc, skt):
+        socket.socket.__init__(self, _sock=skt._sock)
+        self._init_pooled(pool, netloc)
+
+    def _close(self):
+        socket.socket.close(self)
+
+if ssl is not None:
+    class PooledSSLSocket(PooledConnection, ssl.SSLSocket):
+
+        def __init__(self, pool, netloc, skt, **ssl_args):
+            ssl.SSLSocket.__init__(self, skt, **ssl_args)
+            self._init_pooled(pool, netloc)
+
+        def _close(self):
+            ssl.SSLSocket.close(self)
+
+def connect(pool, netloc, is_ssl=False,
+        timeout=sock._GLOBAL_DEFAULT_TIMEOUT, ssl_args=None):
+    """ open a `PooledConnection` of `pool` """
+    skt = sock.connect(netloc, False, timeout)
+    # restkit sends headers and body of requests separately, don't wait
+    # for the ack of the headers
+    skt.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if not is_ssl:
+        return PooledSocket(pool, netloc, skt)
+    if ssl is None:
+        raise ValueError("https isn't supported without the ssl module")
+    return PooledSSLSocket(pool, netloc, skt, **(ssl_args or {}))
+
+class _Host(object):
+
+    def __init__(self):
+        # idle connections, last released on the right
+        self.idle = collections.deque()
+        self.active = 0
+
+class ConnectionPool(BasePool):
+    """ thread-safe keep-alive pool with limits and stats
+
+    @param max_connections: int, max number of connections in use by
+    host. Unlimited if None.
+    @param keepalive: int, max number of idle connections kept by host
+    @param timeout: int, seconds an idle connection is kept
+    @param wait_timeout: float, max seconds a request waits for a free
+    connection when `max_connections` are in use. `PoolTimeout` is
+    raised after. Wait forever if None.
+    """
+
+    def __init__(self, max_connections=None, keepalive=DEFAULT_KEEPALIVE,
+            timeout=DEFAULT_POOL_TIMEOUT, wait_timeout=None):
+        BasePool.__init__(self, keepalive=keepalive, timeout=timeout)
+        self.max_connections = max_connections
+        self.wait_timeout = wait_timeout
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # reentrant, connections lost are released by the garbage
+        # collector at any time
+        self._cond = threading.Condition(threading.RLock())
+        self._hosts = {}
+        # weak references of connections in use
+        self._refs = {}
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+
+    def _check_pid(self):
+        if self._pid == os.getpid():
+            return
+        # forked. sockets of the parent are closed in this process only,
+        # the parent can still use them.
+        hosts = self._hosts
+        self._reset()
+        for host in hosts.values():
+            for conn in host.idle:
+                conn._close()
+
+    def _host(self, netloc):
+        host = self._hosts.get(netloc)
+        if host is None:
+            host = self._hosts[netloc] = _Host()
+        return host
+
+    def acquire(self, netloc, is_ssl=False,
+            timeout=sock._GLOBAL_DEFAULT_TIMEOUT, ssl_args=None):
+        """ return a `PooledConnection` to a host, an idle one or a new
+        one. Wait for a free connection if the limit is reached.
+
+        @param netloc: tuple (host, port)
+        @param is_ssl: bool, True to open SSL connections
+        @param timeout: socket timeout of new connections
+        @param ssl_args: dict, ssl arguments of new connections
+        """
+        self._check_pid()
+        start = time.time()
+        with self._cond:
+            host = self._host(netloc)
+            if self.max_connections is not None and \
+                    host.active >= self.max_connections:
+                self.waits += 1
+                while host.active >= self.max_connections:
+                    remaining = None
+                    if self.wait_timeout is not None:
+                        remaining = start + self.wait_timeout - time.time()
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise PoolTimeout("no free connection to "
+                                    "%s:%s after %ss" % (netloc[0],
+                                    netloc[1], self.wait_timeout))
+                    self._cond.wait(remaining)
+                self.wait_time += time.time() - start
+            host.active += 1
+
+        try:
+            conn = self._pop_idle(netloc)
+            if conn is None:
+                conn = connect(self, netloc, is_ssl=is_ssl, timeout=timeout,
+                        ssl_args=ssl_args)
+                with self._cond:
+                    self.created += 1
+        except:
+            self._release_slot(netloc)
+            raise
+        self._checkout(conn)
+        return conn
+
+    def get(self, netloc):
+        """ return an idle connection to a host or None. Used when the
+        pool is given to a restkit client directly, limits are only
+        applied to requests done with `CouchdbResource`. """
+        self._check_pid()
+        with self._cond:
+            self._host(netloc).active += 1
+        conn = self._pop_idle(netloc)
+        if conn is None:
+            self._release_slot(netloc)
+            return None
+        self._checkout(conn)
+        return conn
+
+    def put(self, netloc, conn):
+        """ release a connection. It's kept if there are less than
+        `keepalive` idle connections to the host. """
+        self._check_pid()
+        if not isinstance(conn, PooledConnection):
+            # opened by restkit
+            if ssl is not None and isinstance(conn, ssl.SSLSocket):
+                sock.close(conn)
+                return
+            conn = PooledSocket(self, netloc, conn)
+            with self._cond:
+                self.created += 1
+        elif conn._pool is not self or conn._pool_pid != self._pid:
+            conn._close()
+            return
+
+        with self._cond:
+            host = self._host(netloc)
+            self._expire(host)
+            if self.alive and len(host.idle) < self.keepalive:
+                conn.pool_expires = time.time() + self.timeout
+                host.idle.append(conn)
+                # released once idle so a request waiting for it reuses it
+                self._checkin(conn)
+                return
+        self._discard(conn)
+
+    def prewarm(self, netloc, count, is_ssl=False,
+            timeout=sock._GLOBAL_DEFAULT_TIMEOUT, ssl_args=None):
+        """ open connections to a host now, until there are `count` idle
+        connections. Return the number of connections opened.
+
+        @param count: int, number of idle connections wanted. It can't
+        be more than `keepalive`.
+        """
+        count = min(count, self.keepalive)
+        opened = 0
+        while True:
+            with self._cond:
+                host = self._host(netloc)
+                self._expire(host)
+                if len(host.idle) >= count or \
+                        (self.max_connections is not None and
+                        host.active + len(host.idle) >= self.max_connections):
+                    return opened
+                host.active += 1
+            try:
+                conn = connect(self, netloc, is_ssl=is_ssl, timeout=timeout,
+                        ssl_args=ssl_args)
+            except:
+                self._release_slot(netloc)
+                raise
+            self._checkout(conn)
+            with self._cond:
+                self.created += 1
+            opened += 1
+            self.put(netloc, conn)
+
+    def clear_host(self, netloc):
+        self._check_pid()
+        with self._cond:
+            host = self._hosts.get(netloc)
+            if host is None:
+                return
+            idle = list(host.idle)
+            host.idle.clear()
+        for conn in idle:
+            self._discard(conn)
+
+    def clear(self):
+        for netloc in self._hosts.keys():
+            self.clear_host(netloc)
+
+    def stats(self):
+        """ return a dict with counters of the pool: connections created,
+        reused and discarded (closed instead of being kept), requests
+        which waited for a free connection, total time waited in seconds,
+        waits timed out, connections in use and idle connections. """
+        self._check_pid()
+        with self._cond:
+            return {
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'timeouts': self.timeouts,
+                'active': sum([h.active for h in self._hosts.values()]),
+                'idle': sum([len(h.idle) for h in self._hosts.values()])
+            }
+
+    def _pop_idle(self, netloc):
+        while True:
+            with self._cond:
+                host = self._host(netloc)
+                self._expire(host)
+                if not host.idle:
+                    return None
+                conn = host.idle.pop()
+            if is_connected(conn):
+                with self._cond:
+                    self.reused += 1
+                return conn
+            self._discard(conn)
+
+    def _expire(self, host):
+        now = time.time()
+        while host.idle and host.idle[0].pool_expires < now:
+            conn = host.idle.popleft()
+            conn._pool_closed = True
+            conn._close()
+            self.discarded += 1
+
+    def _checkout(self, conn):
+        ref = weakref.ref(conn, self._lost)
+        with self._cond:
+            conn._pool_active = True
+            conn._pool_ref = ref
+            self._refs[ref] = conn._pool_netloc
+
+    def _checkin(self, conn):
+        with self._cond:
+            if not conn._pool_active:
+                return
+            conn._pool_active = False
+            self._refs.pop(conn._pool_ref, None)
+            conn._pool_ref = None
+            self._release_slot(conn._pool_netloc)
+
+    def _lost(self, ref):
+        # a connection in use was garbage collected without being
+        # released or closed, like the one of a response not read
+        with self._cond:
+            netloc = self._refs.pop(ref, None)
+            if netloc is None:
+                return
+            self.discarded += 1
+            self._release_slot(netloc)
+
+    def _release_slot(self, netloc):
+        with self._cond:
+            self._host(netloc).active -= 1
+            self._cond.notifyAll()
+
+    def _discard(self, conn):
+        if conn._pool_closed:
+            return
+        conn._pool_closed = True
+        conn._close()
+        if conn._pool is not self or conn._pool_pid != self._pid:
+            return
+        with self._cond:
+            self._checkin(conn)
+            self.discarded += 1
+
+def is_connected(skt):
+    """ return False if the peer closed the connection or sent unexpected
+    data on an idle connection """
+    try:
+        readable = select.select([skt], [], [], 0)[0]
+    except (select.error, socket.error, ValueError):
+        return False
+    return not readable
+
+class PoolFilter(object):
+    """ restkit filter giving connections of a `ConnectionPool` to
+    requests, so limits apply to all connections, and releasing
+    connections of HEAD responses (restkit doesn't) """
+
+    def on_connect(self, req):
+        if req._sock is not None or not isinstance(req.pool, ConnectionPool):
+            return
+        req._sock = req.pool.acquire((req.host, req.port),
+                is_ssl=req.uri.scheme == "https", timeout=req.timeout,
+                ssl_args=req.ssl_args)
+
+    def on_response(self, req):
+        if req.method == "HEAD" and req._sock is not None and \
+                isinstance(req.pool, ConnectionPool):
+            req.release_connection((req.host, req.port), req._sock)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Profiling of views. A `ViewProfiler` given to a database records a
+`ViewCall` for each request of a view or a temporary view:
+
+    >>> from couchdbkit import Database, ViewProfiler
+    >>> profiler = ViewProfiler(top_n=10)
+    >>> db = Database('http://127.0.0.1:5984/mydb', view_profiler=profiler)
+    >>> rows = db.view('blog/by_date', limit=20, include_docs=True).all()
+    >>> profiler.stats()['/mydb/_design/blog/_view/by_date']['p95']
+    0.012
+    >>> profiler.slowest()[0].params
+    {'key': False, 'keys': None, 'range': False, 'limit': 20, ...}
+
+Calls have the path of the view, the shape of its params (values of keys
+aren't kept), the number of rows and bytes returned and timings in
+seconds:
+
+- `server_time`: time from the start of the request to response headers
+- `read_time`: time to read and decode the body. Rows iterated with
+  `stream=True` are read while they are used, the time spent by the
+  caller between rows is included.
+- `wrap_time`: time spent in the wrapper of the view by
+  `ViewResults.iterator`
+
+Results read from the view cache of the database aren't requests and
+aren't recorded.
+"""
+
+from __future__ import with_statement
+
+import collections
+import heapq
+import itertools
+import math
+import threading
+import time
+
+from couchdbkit.resource import BufferedResponse
+from couchdbkit.tracing import RequestEvent
+
+DEFAULT_TOP_N = 20
+DEFAULT_MAX_SAMPLES = 1000
+
+def normalize_params(params):
+    """ return the shape of the params of a view: keys and ranges are
+    replaced by flags so calls differing only by their values have the
+    same params
+
+        >>> normalize_params({'startkey': 'a', 'limit': 10})
+        {'key': False, 'keys': None, 'range': True, 'limit': 10,
+        'group_level': None, 'include_docs': False}
+    """
+    keys = params.get('keys')
+    if keys is not None:
+        # keys can be an iterator encoded while it's sent
+        if hasattr(keys, '__len__'):
+            keys = len(keys)
+        else:
+            keys = True
+    return {
+        'key': 'key' in params,
+        'keys': keys,
+        'range': 'startkey' in params or 'endkey' in params,
+        'limit': params.get('limit'),
+        'group_level': params.get('group_level'),
+        'include_docs': bool(params.get('include_docs', False))
+    }
+
+class ViewCall(object):
+    """ request of a view. Values not measured yet are None. """
+
+    def __init__(self, path, params):
+        self.path = path
+        self.params = params
+        self.status = None
+        self.error = None
+        self.rows = None
+        self.bytes = None
+        self.started = time.time()
+        self.server_time = None
+        self.read_time = None
+        self.wrap_time = 0.0
+
+    def __repr__(self):
+        return "<%s %s %s>" % (self.__class__.__name__, self.path,
+                self.duration)
+
+    @property
+    def duration(self):
+        """ server time plus read time, None until the body is read """
+        if self.server_time is None or self.read_time is None:
+            return None
+        return self.server_time + self.read_time
+
+    def to_dict(self):
+        return {
+            'path': self.path,
+            'params': self.params,
+            'status': self.status,
+            'error': self.error,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'started': self.started,
+            'server_time': self.server_time,
+            'read_time': self.read_time,
+            'wrap_time': self.wrap_time,
+            'duration': self.duration
+        }
+
+class _CallTracer(object):
+    # tracer of the response of a view call, completes the call once
+    # the body is read then emits the event to the tracer of the
+    # database if there is one
+    def __init__(self, profiler, call, tracer):
+        self.profiler = profiler
+        self.call = call
+        self.tracer = tracer
+
+    def emit(self, event):
+        if self.tracer is not None:
+            self.tracer.emit(event)
+        self.call.bytes = event.bytes_in
+        self.call.read_time = (event.transfer or 0.0) + (event.decode or 0.0)
+        self.profiler._finish(self.call)
+
+class _ViewEntry(object):
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.samples = collections.deque()
+
+class ViewProfiler(object):
+    """ record requests of views of databases. Stats of each view are
+    computed on its last `max_samples` calls, the `top_n` slowest calls
+    of all views are kept.
+
+    @param top_n: int, number of slowest calls kept
+    @param max_samples: int, number of calls kept by view
+    """
+
+    def __init__(self, top_n=DEFAULT_TOP_N, max_samples=DEFAULT_MAX_SAMPLES):
+        self.top_n = top_n
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counter = itertools.count()
+        self._views = {}
+        # min heap of (duration, order, call)
+        self._slowest = []
+
+    def exec_view(self, view, params):
+        """ send the request of a `couchdbkit.client.ViewInterface` and
+        record it. Return the response. """
+        call = ViewCall("/%s/%s" % (view._db.dbname, view.view_path),
+                normalize_params(params))
+        self._local.call = call
+        try:
+            resp = view._request(**params)
+        except Exception, e:
+            call.server_time = time.time() - call.started
+            call.status = getattr(e, 'status_int', None)
+            call.error = e.__class__.__name__
+            call.read_time = 0.0
+            self._finish(call)
+            raise
+
+        call.server_time = time.time() - call.started
+        call.status = resp.status_int
+        resp.view_call = call
+        if isinstance(resp, BufferedResponse):
+            # shared response, the body is already read
+            call.bytes = len(resp._body)
+            call.read_time = 0.0
+            self._finish(call)
+        else:
+            event = resp.trace_event
+            if event is None:
+                # only used to measure the read of the body
+                event = RequestEvent("GET", call.path)
+            resp.trace_event = event
+            resp.tracer = _CallTracer(self, call, resp.tracer)
+        return resp
+
+    def pop_call(self):
+        """ return the last call made by the current thread and forget
+        it, None if there isn't one """
+        call = getattr(self._local, 'call', None)
+        self._local.call = None
+        return call
+
+    def _finish(self, call):
+        duration = call.duration
+        with self._lock:
+            entry = self._views.get(call.path)
+            if entry is None:
+                entry = self._views[call.path] = _ViewEntry()
+            entry.count += 1
+            if call.error is not None:
+                entry.errors += 1
+            entry.samples.append(call)
+            if len(entry.samples) > self.max_samples:
+                entry.samples.popleft()
+
+            item = (duration, self._counter.next(), call)
+            if len(self._slowest) < self.top_n:
+                heapq.heappush(self._slowest, item)
+            elif self._slowest and duration > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+            self._slowest = []
+
+    def slowest(self):
+        """ return the `top_n` slowest calls, slowest first """
+        with self._lock:
+            items = list(self._slowest)
+        return [call for duration, order, call in sorted(items, reverse=True)]
+
+    def _percentile(self, durations, p):
+        # nearest rank of the percentile `p` (0-100) of sorted durations
+        rank = int(math.ceil(len(durations) * p / 100.0)) - 1
+        return durations[max(0, rank)]
+
+    def stats(self):
+        """ return a dict of stats by view path: count of calls, errors,
+        and on the last calls: samples, mean/min/max/p50/p95/p99
+        durations, mean server time, total rows, bytes and wrap time """
+        with self._lock:
+            entries = [(path, entry.count, entry.errors, list(entry.samples))
+                    for path, entry in self._views.items()]
+        stats = {}
+        for path, count, errors, samples in entries:
+            durations = sorted([c.duration for c in samples])
+            server_times = [c.server_time for c in samples]
+            stats[path] = entry = {
+                'count': count,
+                'errors': errors,
+                'samples': len(samples),
+                'mean': sum(durations) / len(durations),
+                'min': durations[0],
+                'max': durations[-1],
+                'server_time': sum(server_times) / len(server_times),
+                'rows': sum([c.rows or 0 for c in samples]),
+                'bytes': sum([c.bytes or 0 for c in samples]),
+                'wrap_time': sum([c.wrap_time for c in samples])
+            }
+            for p in (50, 95, 99):
+                entry['p%s' % p] = self._percentile(durations, p)
+        return stats
@@ -20,19 +20,29 @@ Example:
 
 """
 import base64
+from StringIO import StringIO
 import re
 import socket
 import sys
 import time
 import types
-
-import anyjson
+import urlparse
 
 from restkit import Resource, HttpResponse
 from restkit.errors import ResourceError, RequestFailed, RequestError
-from restkit.util import url_quote
+from restkit.util import url_quote, parse_netloc
+from restkit.util.sock import _GLOBAL_DEFAULT_TIMEOUT, _allowed_ssl_args
   
 from couchdbkit import __version__
+from couchdbkit.codec import get_codec
+from couchdbkit.compression import ACCEPT_ENCODING, \
+DEFAULT_COMPRESS_LEVEL, get_decoder, gzip_compress, gzip_compressor, \
+DecompressingReader
+from couchdbkit.pool import ConnectionPool, PoolFilter, DEFAULT_KEEPALIVE
+from couchdbkit.retry import RetryPolicy
+from couchdbkit.singleflight import SingleFlight
+from couchdbkit.tracing import Tracer, TraceFilter, RequestEvent, \
+set_current_event
 
 USER_AGENT = 'couchdbkit/%s' % __version__
 
@@ -49,13 +59,402 @@ class PreconditionFailed(ResourceError):
 RequestFailed = RequestFailed
 
 class CouchDBResponse(HttpResponse):
+
+    # set by CouchdbResource, default codec is used if None
+    codec = None
+    # set by CouchdbResource when requests are traced, the event is
+    # emitted once the body is read
+    trace_event = None
+    tracer = None
+    _trace_reading = False
+    # `couchdbkit.profiler.ViewCall` of a view response, set by
+    # `ViewProfiler`
+    view_call = None
     
+    def content_decoder(self):
+        """ return a `couchdbkit.compression.Decoder` of the body or None
+        if it isn't compressed """
+        return get_decoder(self.headers.get('content-encoding'))
+
     @property
     def json_body(self):
+        if self.trace_event is None:
+            try:
+                return get_codec(self.codec).decode(self.body_string())
+            except ValueError:
+                return self.body_string()
+
+        body = self._read_traced()
+        start = time.time()
         try:
-            return anyjson.deserialize(self.body_string())
+            value = get_codec(self.codec).decode(body)
         except ValueError:
-            return self.body_string()
+            value = body
+        self.trace_event.decode = time.time() - start
+        self._emit_trace()
+        return value
+
+    def body_string(self, charset=None, unicode_errors="strict"):
+        if self.trace_event is None:
+            return self._body_string(charset=charset,
+                    unicode_errors=unicode_errors)
+        body = self._read_traced(charset=charset,
+                unicode_errors=unicode_errors)
+        self._emit_trace()
+        return body
+
+    def body_stream(self):
+        stream = HttpResponse.body_stream(self)
+        decoder = self.content_decoder()
+        if decoder is None:
+            return stream
+        return DecompressingReader(stream, decoder)
+
+    @property
+    def body_file(self):
+        return self.body_stream()
+
+    def _body_string(self, charset=None, unicode_errors="strict"):
+        decoder = self.content_decoder()
+        if decoder is None:
+            return HttpResponse.body_string(self, charset=charset,
+                    unicode_errors=unicode_errors)
+        body = HttpResponse.body_string(self)
+        body = decoder.decompress(body) + decoder.flush()
+        if charset is not None:
+            try:
+                body = body.decode(charset, unicode_errors)
+            except UnicodeDecodeError:
+                pass
+        return body
+
+    def close(self):
+        HttpResponse.close(self)
+        if not self._trace_reading:
+            self._emit_trace()
+
+    def _read_traced(self, **kwargs):
+        event = self.trace_event
+        start = time.time()
+        self._trace_reading = True
+        try:
+            body = self._body_string(**kwargs)
+        finally:
+            self._trace_reading = False
+        event.transfer = time.time() - start
+        event.bytes_in = len(body)
+        return body
+
+    def _emit_trace(self):
+        event, self.trace_event = self.trace_event, None
+        if event is not None:
+            self.tracer.emit(event)
+
+    def iter_rows(self, info_callback=None, chunk_size=None):
+        """ iterate rows of a view response while they are read from the
+        socket. See `iter_rows` for the arguments. """
+        body = self.body_stream()
+        event = self.trace_event
+        if event is not None:
+            body = _CountingReader(body)
+            start = time.time()
+        completed = False
+        try:
+            for row in iter_rows(body, info_callback=info_callback,
+                    chunk_size=chunk_size, codec=self.codec):
+                yield row
+            completed = True
+        finally:
+            if event is not None:
+                # rows are decoded while they are read
+                event.transfer = time.time() - start
+                event.bytes_in = body.bytes_read
+            if completed:
+                self.close()
+            else:
+                self.discard()
+
+    def discard(self):
+        """ close the response without reading the rest of the body.
+        The connection is closed instead of being released to the pool
+        since it still has some data pending. """
+        body = self.response.body
+        if not body.closed:
+            body.req.unreader.close()
+            body.closed = True
+        self.closed = True
+        self._emit_trace()
+
+class _CountingReader(object):
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+class BufferedResponse(CouchDBResponse):
+    """ response with a body already read. Used to give the same
+    response to several callers. """
+
+    def __init__(self, resp, body):
+        self.response = None
+        self.status = resp.status
+        self.status_int = resp.status_int
+        self.version = resp.version
+        self.headerslist = resp.headerslist
+        self.headers = resp.headers
+        self.final_url = resp.final_url
+        self.codec = resp.codec
+        self.closed = False
+        self._body = body
+
+    def content_decoder(self):
+        # the body is already decoded
+        return None
+
+    def body_string(self, charset=None, unicode_errors="strict"):
+        body = self._body
+        if charset is not None:
+            try:
+                body = body.decode(charset, unicode_errors)
+            except UnicodeDecodeError:
+                pass
+        self.closed = True
+        return body
+
+    def body_stream(self):
+        return StringIO(self._body)
+
+    def close(self):
+        self.closed = True
+
+    def discard(self):
+        self.closed = True
+
+ROWS_CHUNK_SIZE = 16384
+
+re_token = re.compile(r'"(?:[^"\\]|\\.)*"|["{}\[\]]', re.S)
+re_rows_start = re.compile(r'\s*:\s*\[')
+re_rows_partial = re.compile(r'\s*(:\s*)?$')
+
+def iter_rows(stream, info_callback=None, chunk_size=None, codec=None):
+    """ parse the `rows` member of a view response incrementally from
+    a file-like object and yield each row as soon as it's decoded. Only
+    the row being read is kept in memory.
+
+    @param stream: file-like object with a `read(size)` method
+    @param info_callback: callable. It's called with a dict containing
+    members of the response found before the rows (like `total_rows`
+    and `offset`) and once again with the members found after them.
+    @param chunk_size: int, size of data read at once on the stream
+    @param codec: `couchdbkit.codec.Codec` instance or name used to decode
+    rows
+    """
+    chunk_size = chunk_size or ROWS_CHUNK_SIZE
+    decode = get_codec(codec).decode
+    buf = ""
+    pos = 0
+    depth = 0
+    start = None
+    in_rows = False
+    while True:
+        m = re_token.search(buf, pos)
+        need_more = m is None or m.group() == '"'
+        if not need_more and not in_rows and depth == 1 and \
+                m.group() == '"rows"':
+            m1 = re_rows_start.match(buf, m.end())
+            if m1 is not None:
+                # we got the header of the response
+                if info_callback is not None:
+                    header = buf[:m.start()].rstrip().rstrip(',')
+                    info_callback(decode(header + '}'))
+                buf = buf[m1.end():]
+                pos = 0
+                depth = 2
+                in_rows = True
+                continue
+            need_more = re_rows_partial.match(buf, m.end()) is not None
+
+        if need_more:
+            if m is None:
+                pos = len(buf)
+            else:
+                pos = m.start()
+
+            # size of the chunk grows with the buffer so reading a
+            # large row stays linear.
+            data = stream.read(max(chunk_size, len(buf)))
+            if not data:
+                if in_rows:
+                    raise ValueError("unexpected end of view response")
+                # no rows in this response
+                if info_callback is not None and buf.strip():
+                    info_callback(decode(buf))
+                return
+
+            if in_rows:
+                # forget what has already been parsed
+                mark = pos
+                if start is not None:
+                    mark = start
+                    start = 0
+                buf = buf[mark:]
+                pos -= mark
+            buf += data
+            continue
+
+        pos = m.end()
+        c = m.group()[0]
+        if c == '"':
+            continue
+        elif c in '{[':
+            depth += 1
+            if in_rows and depth == 3:
+                start = m.start()
+        else:
+            depth -= 1
+            if not in_rows:
+                continue
+
+            if depth == 2 and start is not None:
+                yield decode(buf[start:pos])
+                start = None
+            elif depth == 1:
+                # end of rows, read members left
+                trailer = [buf[pos:]]
+                while True:
+                    data = stream.read(chunk_size)
+                    if not data:
+                        break
+                    trailer.append(data)
+                trailer = "".join(trailer).strip().lstrip(',').lstrip()
+                if info_callback is not None and trailer != '}':
+                    info_callback(decode('{' + trailer))
+                return
+
+def iter_json(obj, codec=None):
+    """ encode obj in JSON piece by piece. Lists, tuples and iterators
+    found in obj, or in the members of obj if it's a dict, are encoded one
+    item at a time. Other values are encoded at once.
+
+    @param obj: object to encode
+    @param codec: `couchdbkit.codec.Codec` instance or name
+    """
+    encode = get_codec(codec).encode
+    if isinstance(obj, dict):
+        yield '{'
+        sep = ''
+        for key, value in obj.iteritems():
+            yield sep + encode(key) + ':'
+            for data in _iter_json_value(value, encode):
+                yield data
+            sep = ','
+        yield '}'
+    else:
+        for data in _iter_json_value(obj, encode):
+            yield data
+
+def _iter_json_value(value, encode):
+    if isinstance(value, (basestring, dict)) or \
+            not hasattr(value, '__iter__'):
+        yield encode(value)
+        return
+
+    yield '['
+    sep = ''
+    for item in value:
+        yield sep + encode(item)
+        sep = ','
+    yield ']'
+
+class JSONStream(object):
+    """ file-like object encoding a JSON body while it's read. Used as a
+    payload of `CouchdbResource.request`, it's sent with chunked transfer
+    encoding so sending starts before the end of the encoding and only
+    one item of the lists of the body is kept encoded in memory.
+
+        >>> docs = ({"n": i} for i in xrange(100000))
+        >>> resource.post('/db/_bulk_docs', payload=JSONStream({"docs": docs}))
+
+    The body can only be read once.
+
+    @param obj: object to encode, see `iter_json`
+    @param codec: `couchdbkit.codec.Codec` instance or name. If None the
+    codec of the resource is used.
+    @param compress: int, gzip compression level of the body. Not
+    compressed if None. Set by the resource when it compresses request
+    bodies.
+    """
+
+    content_type = 'application/json'
+
+    def __init__(self, obj, codec=None, compress=None):
+        self.obj = obj
+        self.codec = codec
+        self.compress = compress
+        self.bytes_read = 0
+        self._iter = None
+        self._buf = ""
+
+    def _chunks(self):
+        chunks = iter_json(self.obj, codec=self.codec)
+        if self.compress is None:
+            return chunks
+        return _iter_gzip(chunks, self.compress)
+
+    def read(self, size=-1):
+        """ return at most `size` bytes of the body, or the rest of the
+        body if size is None or negative """
+        if self._iter is None:
+            self._iter = self._chunks()
+
+        if size is None or size < 0:
+            chunks = [self._buf]
+            chunks.extend(self._iter)
+            data = "".join(chunks)
+            self._buf = ""
+            self.bytes_read += len(data)
+            return data
+
+        chunks = [self._buf]
+        length = len(self._buf)
+        while length < size:
+            try:
+                data = self._iter.next()
+            except StopIteration:
+                break
+            chunks.append(data)
+            length += len(data)
+
+        data = "".join(chunks)
+        self._buf = data[size:]
+        data = data[:size]
+        self.bytes_read += len(data)
+        return data
+
+def _iter_gzip(chunks, level):
+    compressor = gzip_compressor(level)
+    for data in chunks:
+        data = compressor.compress(data)
+        if data:
+            yield data
+    yield compressor.flush()
+
+class JSONStreamFilter(object):
+    """ restkit doesn't send the Content-Type header of chunked bodies,
+    this filter adds it back for `JSONStream` payloads """
+
+    def on_request(self, req, *args):
+        if not isinstance(req.body, JSONStream):
+            return
+        for name, value in req.headers:
+            if name.lower() == 'content-type':
+                return
+        req.headers.append(('Content-Type', req.body.content_type))
 
 
 class CouchdbResource(Resource):
@@ -66,12 +465,130 @@ class CouchdbResource(Resource):
         CouchdbResource represent an HTTP resource to CouchDB.
 
         @param uri: str, full uri to the server.
+        @param codec: `couchdbkit.codec.Codec` instance or name of the
+        JSON codec used to encode and decode bodies. If None the default
+        codec is used.
+        @param single_flight: `couchdbkit.singleflight.SingleFlight`
+        instance. If set, identical GET and HEAD requests sent at the
+        same time share one response.
+        @param tracer: `couchdbkit.tracing.Tracer` instance. If set,
+        timings of requests are sent to its observers.
+        @param retry_policy: `couchdbkit.retry.RetryPolicy` instance. If
+        set, failed requests are retried.
+        @param accept_encoding: bool, if True gzip or deflate responses
+        are asked, see `couchdbkit.compression`. Compressed responses are
+        always decoded.
+        @param compress_threshold: int, request bodies of at least this
+        size, and streamed bodies, are sent gzipped. Not compressed if
+        None.
+        @param pool_instance: restkit pool. By default a
+        `couchdbkit.pool.ConnectionPool` keeping `keepalive` idle
+        connections.
         """
         client_opts['response_class'] = CouchDBResponse
+        codec = client_opts.pop('codec', None)
+        single_flight = client_opts.pop('single_flight', None)
+        tracer = client_opts.pop('tracer', None)
+        retry_policy = client_opts.pop('retry_policy', None)
+        accept_encoding = client_opts.pop('accept_encoding', False)
+        compress_threshold = client_opts.pop('compress_threshold', None)
+        if client_opts.get('pool_instance') is None:
+            client_opts['pool_instance'] = ConnectionPool(
+                    keepalive=client_opts.pop('keepalive', None) or \
+                            DEFAULT_KEEPALIVE)
+
+        filters = list(client_opts.get('filters') or [])
+        if not [f for f in filters if isinstance(f, JSONStreamFilter)]:
+            filters.append(JSONStreamFilter())
+        if not [f for f in filters if isinstance(f, TraceFilter)]:
+            # before the pool filter to time the wait for a connection
+            filters.append(TraceFilter())
+        if not [f for f in filters if isinstance(f, PoolFilter)]:
+            filters.append(PoolFilter())
+        client_opts['filters'] = filters
         
         Resource.__init__(self, uri=uri, **client_opts)
         self.safe = ":/%"
+        self.set_codec(codec)
+        self.set_single_flight(single_flight)
+        self.set_tracer(tracer)
+        self.set_retry_policy(retry_policy)
+        self.set_accept_encoding(accept_encoding)
+        self.set_compress_threshold(compress_threshold)
+
+    def set_codec(self, codec):
+        """ change the JSON codec of this resource and of resources
+        created from it. """
+        self.codec = get_codec(codec)
+        self.initial['client_opts']['codec'] = codec
+
+    def set_single_flight(self, single_flight):
+        """ set the `SingleFlight` group of this resource and of
+        resources created from it. True creates a new group, None
+        disables single-flight. """
+        if single_flight is True:
+            single_flight = SingleFlight()
+        self.single_flight = single_flight
+        self.initial['client_opts']['single_flight'] = single_flight
         
+    def set_tracer(self, tracer):
+        """ set the `couchdbkit.tracing.Tracer` of this resource and of
+        resources created from it. True creates a new tracer without
+        observers, None disables tracing. """
+        if tracer is True:
+            tracer = Tracer()
+        self.tracer = tracer
+        self.initial['client_opts']['tracer'] = tracer
+
+    def set_retry_policy(self, retry_policy):
+        """ set the `couchdbkit.retry.RetryPolicy` of this resource and
+        of resources created from it. True creates a policy with default
+        settings, None disables retries. """
+        if retry_policy is True:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+        self.initial['client_opts']['retry_policy'] = retry_policy
+
+    def set_accept_encoding(self, accept_encoding):
+        """ ask compressed responses, or not, on this resource and on
+        resources created from it. """
+        self.accept_encoding = bool(accept_encoding)
+        self.initial['client_opts']['accept_encoding'] = \
+                self.accept_encoding
+
+    def set_compress_threshold(self, compress_threshold):
+        """ set the min size of request bodies sent gzipped by this
+        resource and resources created from it. None disables the
+        compression. """
+        self.compress_threshold = compress_threshold
+        self.initial['client_opts']['compress_threshold'] = \
+                compress_threshold
+
+    @property
+    def pool(self):
+        """ connection pool of this resource """
+        return self.client_opts.get('pool_instance')
+
+    def prewarm(self, count=None):
+        """ open connections to the server now so first requests don't
+        wait for them. Return the number of connections opened.
+
+        @param count: int, number of idle connections wanted. By default
+        the keepalive of the pool.
+        """
+        pool = self.pool
+        if not isinstance(pool, ConnectionPool):
+            raise TypeError("only a ConnectionPool can be prewarmed")
+        if count is None:
+            count = pool.keepalive
+        u = urlparse.urlparse(self.uri)
+        return pool.prewarm(parse_netloc(u), count,
+                is_ssl=u.scheme == "https",
+                timeout=self.client_opts.get('timeout',
+                    _GLOBAL_DEFAULT_TIMEOUT),
+                ssl_args=dict([(k, v) for k, v in self.client_opts.items()
+                    if k in _allowed_ssl_args]))
+
     def copy(self, path=None, headers=None, **params):
         """ add copy to HTTP verbs """
         return self.request('COPY', path=path, headers=headers, **params)
@@ -92,7 +609,7 @@ class CouchdbResource(Resource):
             'GET', 'HEAD', 'POST', 'PUT', or 'DELETE'
         @param path: str or list, path to add to the uri
         @param data: str or string or any object that could be
-            converted to JSON.
+            converted to JSON. A `JSONStream` is encoded while it's sent.
         @param headers: dict, optional headers that will
             be added to HTTP request.
         @param raw: boolean, response return a Response object
@@ -100,6 +617,9 @@ class CouchdbResource(Resource):
             Parameterss are for example the parameters for a view. See 
             `CouchDB View API reference 
             <http://wiki.apache.org/couchdb/HTTP_view_API>`_ for example.
+            `_retry_payload` is the payload of an already encoded body,
+            like `{"docs": docs}` for `_bulk_docs`, used by the retry
+            policy to know if the request can be sent again.
         
         @return: tuple (data, resp), where resp is an `httplib2.Response` 
             object and data a python object (often a dict).
@@ -108,18 +628,100 @@ class CouchdbResource(Resource):
         headers = headers or {}
         headers.setdefault('Accept', 'application/json')
         headers.setdefault('User-Agent', USER_AGENT)
+        retry_payload = params.pop('_retry_payload', None)
 
         body = None
-        if payload is not None:
+        compress = self.compress_threshold is not None and \
+                'Content-Encoding' not in headers
+        if isinstance(payload, JSONStream):
+            if payload.codec is None:
+                payload.codec = self.codec
+            if compress and payload.compress is None and \
+                    payload.bytes_read == 0:
+                payload.compress = DEFAULT_COMPRESS_LEVEL
+            if payload.compress is not None:
+                headers['Content-Encoding'] = 'gzip'
+            body = payload
+            headers.setdefault('Content-Type', payload.content_type)
+            headers['Transfer-Encoding'] = 'chunked'
+        elif payload is not None:
             #TODO: handle case we want to put in payload json file.
             if not hasattr(payload, 'read') and not isinstance(payload, basestring):
-                body = anyjson.serialize(payload).encode('utf-8')
+                body = self.codec.encode(payload)
                 headers.setdefault('Content-Type', 'application/json')
             else:
                 body = payload
+            if compress and isinstance(body, str) and \
+                    len(body) >= self.compress_threshold:
+                body = gzip_compress(body)
+                headers['Content-Encoding'] = 'gzip'
 
-        params = encode_params(params)
-        
+        params = encode_params(params, codec=self.codec)
+        if self.accept_encoding and 'feed' not in params:
+            headers.setdefault('Accept-Encoding', ACCEPT_ENCODING)
+
+        # changes feeds are read while they are received, they can't
+        # be shared
+        if self.single_flight is not None and body is None and \
+                method in ('GET', 'HEAD') and 'feed' not in params:
+            key = (method, self.uri, path, tuple(sorted(params.items())),
+                    tuple(sorted(headers.items())))
+            def shared_request():
+                resp = self._call(method, path, None, headers, params)
+                return BufferedResponse(resp, resp.body_string())
+            resp = self.single_flight.do(key, shared_request)
+            return BufferedResponse(resp, resp._body)
+
+        if retry_payload is None:
+            retry_payload = payload
+        return self._call(method, path, body, headers, params,
+                payload=retry_payload)
+
+    def _call(self, method, path, body, headers, params, payload=None):
+        policy = self.retry_policy
+        if policy is None:
+            return self._request(method, path, body, headers, params)
+
+        # a streamed body can only be read once
+        retry = (body is None or isinstance(body, basestring)) and \
+                policy.can_retry(method, path, payload)
+        def send():
+            return self._request(method, path, body, dict(headers), params)
+        return policy.call(self.uri, send, retry=retry)
+
+    def _request(self, method, path, body, headers, params):
+        tracer = self.tracer
+        if tracer is None:
+            return self._send(method, path, body, headers, params)
+
+        event = RequestEvent(method, "%s/%s" % (
+                urlparse.urlparse(self.uri).path.rstrip('/'), path or ''))
+        if isinstance(body, basestring):
+            event.bytes_out = len(body)
+        set_current_event(event)
+        try:
+            try:
+                resp = self._send(method, path, body, headers, params)
+            except ResourceError, e:
+                event.status = e.status_int
+                event.error = e.__class__.__name__
+                tracer.emit(event)
+                raise
+        finally:
+            set_current_event(None)
+            if isinstance(body, JSONStream):
+                event.bytes_out = body.bytes_read
+
+        event.status = resp.status_int
+        if method == 'HEAD' or 'feed' in params:
+            # body isn't read or is read while it's received
+            tracer.emit(event)
+        else:
+            resp.trace_event = event
+            resp.tracer = tracer
+        return resp
+
+    def _send(self, method, path, body, headers, params):
         try:
             resp = Resource.request(self, method, path=path,
                              payload=body, headers=headers, **params)
@@ -130,7 +732,7 @@ class CouchdbResource(Resource):
             if e.response and msg:
                 if e.response.headers.get('content-type') == 'application/json':
                     try:
-                        msg = anyjson.deserialize(msg)
+                        msg = self.codec.decode(msg)
                     except ValueError:
                         pass
                     
@@ -154,10 +756,12 @@ class CouchdbResource(Resource):
         except Exception, e:
             raise RequestFailed(str(e))
         
+        resp.codec = self.codec
         return resp
 
-def encode_params(params):
+def encode_params(params, codec=None):
     """ encode parameters in json if needed """
+    encode = get_codec(codec).encode
     _params = {}
     if params:
         for name, value in params.items():
@@ -166,7 +770,7 @@ def encode_params(params):
             
             if name in ('key', 'startkey', 'endkey') \
                     or not isinstance(value, basestring):
-                value = anyjson.serialize(value)
+                value = encode(value)
             _params[name] = value
     return _params
 
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Retry of failed requests. A `RetryPolicy` given to a server retries
+requests which failed because CouchDB couldn't be reached or answered
+with a temporary error (500, 502, 503 or 504), waiting a bit more between
+each try:
+
+    >>> from couchdbkit import Server, RetryPolicy
+    >>> policy = RetryPolicy(max_retries=5, deadline=30)
+    >>> server = Server(retry_policy=policy)
+    >>> doc = server['mydb'].get('mydoc')
+    >>> policy.stats()
+    {'calls': 1, 'retries': 0, 'failures': 0, 'gave_up': 0, ...}
+
+Only requests which can be sent twice safely are retried: GET, HEAD,
+OPTIONS, PUT and DELETE requests, and `_bulk_docs` requests where all
+documents have an `_id` (documents saved by the first try are reported
+as conflicts by the next one) and without `all_or_nothing`. Requests
+with a streamed body are never retried. A retried PUT or DELETE may fail
+with a conflict if the first try reached the server.
+
+Each host has a circuit breaker. After `failure_threshold` failures in a
+row the circuit opens and requests to the host fail at once with
+`CircuitOpen`, without waiting for timeouts. After `reset_timeout`
+seconds one request is let through, the circuit is closed again if it
+succeeds.
+"""
+
+from __future__ import with_statement
+
+import random
+import sys
+import threading
+import time
+import urlparse
+
+from restkit.errors import RequestFailed
+
+from couchdbkit.pool import PoolTimeout
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+RETRY_STATUSES = (500, 502, 503, 504)
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF = 0.1
+DEFAULT_MAX_BACKOFF = 10.0
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30.0
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpen(RequestFailed):
+    """ raised when a request is sent to a host which circuit is open """
+
+class CircuitBreaker(object):
+    """ state of the circuit of a host. Not thread-safe, used under the
+    lock of its `RetryPolicy`.
+
+    @param failure_threshold: int, failures in a row opening the circuit
+    @param reset_timeout: float, seconds before a request is tried again
+    on an open circuit
+    """
+
+    def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+            reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+
+    def allow(self, now):
+        """ return True if a request can be sent. On an open circuit only
+        one request is let through every `reset_timeout` seconds. """
+        if self.state == CLOSED:
+            return True
+        if now - self.opened_at < self.reset_timeout:
+            return False
+        # the trial request. If it never ends another one is let through
+        # after `reset_timeout`.
+        self.state = HALF_OPEN
+        self.opened_at = now
+        return True
+
+    def success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self, now):
+        self.failures += 1
+        if self.state == HALF_OPEN or \
+                self.failures >= self.failure_threshold:
+            if self.state == CLOSED:
+                self.trips += 1
+            self.state = OPEN
+            self.opened_at = now
+
+class RetryPolicy(object):
+    """ retry of failed requests with exponential backoff and a circuit
+    breaker by host. A policy is thread-safe and can be shared by several
+    servers.
+
+    @param max_retries: int, max number of retries of a request
+    @param backoff: float, seconds waited before the first retry. The
+    wait doubles after each retry.
+    @param max_backoff: float, max seconds waited between two tries
+    @param jitter: bool, if True the wait is a random time between 0 and
+    the backoff, so clients don't retry all at once
+    @param deadline: float, max seconds spent on a request with its
+    retries. A request isn't retried if the wait would end after the
+    deadline. No deadline if None.
+    @param methods: HTTP methods retried
+    @param statuses: HTTP statuses retried. Connection errors are always
+    retried.
+    @param failure_threshold: int, failures in a row opening the circuit
+    of a host. The circuit breaker is disabled if None.
+    @param reset_timeout: float, seconds a circuit stays open
+    @param sleep: function used to wait, `time.sleep` by default
+    """
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES,
+            backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+            jitter=True, deadline=None, methods=IDEMPOTENT_METHODS,
+            statuses=RETRY_STATUSES,
+            failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+            reset_timeout=DEFAULT_RESET_TIMEOUT, sleep=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.methods = frozenset(methods)
+        self.statuses = frozenset(statuses)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = sleep or time.sleep
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.gave_up = 0
+        self.rejected = 0
+
+    def can_retry(self, method, path=None, payload=None):
+        """ return True if a request can be sent again safely
+
+        @param payload: body of the request before its encoding, or the
+        `_retry_payload` given with an encoded body
+        """
+        if method in self.methods:
+            return True
+        if method != 'POST' or not path or \
+                path.rstrip('/').rsplit('/', 1)[-1] != '_bulk_docs':
+            return False
+        if not isinstance(payload, dict) or payload.get('all_or_nothing'):
+            return False
+        docs = payload.get('docs')
+        if not isinstance(docs, (list, tuple)) or not docs:
+            return False
+        for doc in docs:
+            if not isinstance(doc, dict) or not doc.get('_id'):
+                return False
+        return True
+
+    def is_failure(self, error):
+        """ return True if an error is a failure of the host: a connection
+        error or one of the retried statuses. """
+        if not isinstance(error, RequestFailed) or \
+                isinstance(error, (PoolTimeout, CircuitOpen)):
+            return False
+        status = getattr(error, 'status_int', None)
+        return status is None or status in self.statuses
+
+    def backoff_time(self, retry):
+        """ return the seconds to wait before a retry
+
+        @param retry: int, number of the retry, starting at 0
+        """
+        delay = min(self.max_backoff, self.backoff * (2 ** retry))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def call(self, uri, func, retry=True):
+        """ call `func` until it succeeds or fails with an error which
+        isn't a failure, retrying failures if `retry` is True. Return the
+        result of `func` or raise its last error.
+
+        @param uri: str, uri of the request. Circuits are by scheme, host
+        and port.
+        @param func: callable without arguments sending the request
+        @param retry: bool, False if the request can't be sent again
+        """
+        host = _host(uri)
+        start = time.time()
+        with self._lock:
+            self.calls += 1
+        tries = 0
+        while True:
+            self._check_circuit(host)
+            try:
+                result = func()
+            except Exception:
+                error = sys.exc_info()
+                failed = self.is_failure(error[1])
+                self._record(host, failed)
+                if not failed or not retry or tries >= self.max_retries:
+                    if failed:
+                        self._count('gave_up')
+                    raise error[0], error[1], error[2]
+
+                delay = self.backoff_time(tries)
+                if self.deadline is not None and \
+                        time.time() + delay - start > self.deadline:
+                    self._count('gave_up')
+                    raise error[0], error[1], error[2]
+                del error
+                self.sleep(delay)
+                tries += 1
+                self._count('retries')
+                continue
+
+            self._record(host, False)
+            return result
+
+    def circuit_state(self, uri):
+        """ return the state of the circuit of a host: 'closed', 'open' or
+        'half_open' """
+        with self._lock:
+            breaker = self._breakers.get(_host(uri))
+            if breaker is None:
+                return CLOSED
+            return breaker.state
+
+    def reset(self, uri=None):
+        """ close the circuit of a host, or of all hosts if uri is None """
+        with self._lock:
+            if uri is None:
+                self._breakers.clear()
+            else:
+                self._breakers.pop(_host(uri), None)
+
+    def stats(self):
+        """ return a dict with the number of requests, retries, failures
+        (errors of the hosts, retried or not), requests which failed after
+        their retries, requests rejected by an open circuit, circuits
+        opened and the state of the circuit of each host. """
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'retries': self.retries,
+                'failures': self.failures,
+                'gave_up': self.gave_up,
+                'rejected': self.rejected,
+                'trips': sum([b.trips for b in self._breakers.values()]),
+                'circuits': dict([(host, b.state) for host, b in
+                    self._breakers.items()])
+            }
+
+    def _check_circuit(self, host):
+        if self.failure_threshold is None:
+            return
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None or breaker.allow(time.time()):
+                return
+            self.rejected += 1
+        raise CircuitOpen("circuit of %s is open after %s failures" % (
+            host, breaker.failures))
+
+    def _record(self, host, failed):
+        with self._lock:
+            if failed:
+                self.failures += 1
+            if self.failure_threshold is None:
+                return
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                if not failed:
+                    return
+                breaker = self._breakers[host] = CircuitBreaker(
+                        self.failure_threshold, self.reset_timeout)
+            if failed:
+                breaker.failure(time.time())
+            else:
+                breaker.success()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+def _host(uri):
+    u = urlparse.urlparse(uri)
+    return "%s://%s" % (u.scheme, u.netloc)
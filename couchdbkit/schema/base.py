@@ -442,7 +442,7 @@ class DocumentBase(DocumentSchema):
     store = save
 
     @classmethod
-    def bulk_save(cls, docs, use_uuids=True, all_or_nothing=False):
+    def bulk_save(cls, docs, use_uuids=True, all_or_nothing=False, **params):
         """ Save multiple documents in database.
 
         @params docs: list of couchdbkit.schema.Document instance
@@ -451,14 +451,24 @@ class DocumentBase(DocumentSchema):
         restarts either all the changes will have been saved or none of them.
         However, it does not do conflict checking, so the documents will
         be committed even if this creates conflicts.
+        @param params: `batch_size`, `batch_bytes` and `concurrency` to
+        save docs by batches. docs can then be any iterable. `retries`,
+        `force_update` and `raise_errors` to send again docs which
+        failed. See `couchdbkit.client.Database.bulk_save`.
+
+        @return: `couchdbkit.bulk.BulkResult`
 
         """
         if cls._db is None:
             raise TypeError("doc database required to save document")
-        docs_to_save= [doc._doc for doc in docs if doc._doc_type == cls._doc_type]
-        if not len(docs_to_save) == len(docs):
-            raise ValueError("one of your documents does not have the correct type")
-        cls._db.bulk_save(docs_to_save, use_uuids=use_uuids, all_or_nothing=all_or_nothing)
+
+        def docs_to_save():
+            for doc in docs:
+                if doc._doc_type != cls._doc_type:
+                    raise ValueError("one of your documents does not have the correct type")
+                yield doc._doc
+        return cls._db.bulk_save(docs_to_save(), use_uuids=use_uuids,
+                all_or_nothing=all_or_nothing, **params)
 
     @classmethod
     def get(cls, docid, rev=None, db=None, dynamic_properties=True):
@@ -471,6 +481,18 @@ class DocumentBase(DocumentSchema):
             raise TypeError("doc database required to save document")
         return cls._db.get(docid, rev=rev, wrapper=cls.wrap)
 
+    @classmethod
+    def get_many(cls, docids, db=None, dynamic_properties=True, **params):
+        """ get documents with `docids` in one pass. See
+        `couchdbkit.client.Database.open_docs` for params.
+        """
+        if db is not None:
+            cls._db = db
+        cls._allow_dynamic_properties = dynamic_properties
+        if cls._db is None:
+            raise TypeError("doc database required to save document")
+        return cls._db.open_docs(docids, wrapper=cls.wrap, **params)
+
     @classmethod
     def get_or_create(cls, docid=None, db=None, dynamic_properties=True, **params):
         """ get  or create document with `docid` """
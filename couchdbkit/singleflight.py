@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Single-flight of identical requests. When several threads send the same
+GET or HEAD request at the same time, only the first one is sent to
+CouchDB, the other threads wait for its response and share it:
+
+    >>> from couchdbkit import Server
+    >>> server = Server(single_flight=True)
+    >>> db = server['mydb']
+    >>> server.res.single_flight.stats()
+    {'calls': 0, 'collapsed': 0, 'in_flight': 0}
+
+A `SingleFlight` is shared by all databases of a server. Pass
+`single_flight=True` to a `Database` to give it its own group, or the same
+`SingleFlight` instance to several servers to share one group between
+them.
+"""
+
+from __future__ import with_statement
+
+import sys
+import threading
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """ group of calls in flight. Calls with the same key done while one
+    is running wait for it and get its result. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    def do(self, key, func):
+        """ call `func` or wait for the call in flight with the same key.
+        Return the result of the call or raise its exception.
+
+        @param key: hashable key of the call
+        @param func: callable without arguments
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.collapsed += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+
+        if leader:
+            try:
+                call.result = func()
+            except:
+                call.error = sys.exc_info()
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error[0], call.error[1], call.error[2]
+        return call.result
+
+    def stats(self):
+        """ return a dict with the number of calls sent, calls collapsed
+        in a call in flight and calls in flight """
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'collapsed': self.collapsed,
+                'in_flight': len(self._calls)
+            }
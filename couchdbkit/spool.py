@@ -0,0 +1,548 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Durable spool of writes. With a `WriteSpool`, documents which can't be
+saved because CouchDB is unreachable or fails (a connection error or a 5xx
+status) are appended to files on the local disk instead of raising, and
+sent again in `_bulk_docs` batches once the server is back:
+
+    >>> from couchdbkit import Database, WriteSpool
+    >>> db = Database("http://127.0.0.1:5984/mydb",
+    ...         spool=WriteSpool("/var/spool/mydb", replay_interval=5.0))
+    >>> db.save_doc({"type": "event"}) # the server is down
+    {'ok': True, 'id': '...', 'spooled': True}
+    >>> db.spool.stats()
+    {'pending': 1, 'bytes': 36, 'segments': 1, 'replayed': 0, ...}
+
+While documents are pending, saves go to the spool at once without
+waiting for the server, so writes are replayed in order and a dead server
+doesn't slow writers down. A background thread replays the spool every
+`replay_interval` seconds, or call `replay` yourself.
+
+Documents get a client-side `_id` before they are spooled and keep their
+`_rev`, so replaying a document twice (after a crash during a replay, or
+when a failed request reached the server) gives a conflict instead of a
+duplicate. Conflicts and other errors found by the replay are counted
+and given to `on_error`. A batch refused as a whole by the server (like
+a 401 or a 413) won't be saved by sending it again, it's moved to a
+quarantine file and the replay goes on. Quarantined documents can be
+spooled again with `requeue_quarantined` once the cause is fixed.
+
+A document saved several times during an outage is spooled each time
+with the same revision. The last write wins: only the last save of a
+document in a replay batch is sent, and the revision given by the replay
+of a document is used by its next saves in the spool.
+
+The spool is a directory of append-only segments. Each line of a segment
+is a document encoded in JSON with its CRC32, torn or corrupt lines are
+skipped. A checkpoint file keeps the position of the replay. A spool
+belongs to one database.
+"""
+
+from __future__ import with_statement
+
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+from couchdbkit.bulk import request_failed
+from couchdbkit.codec import get_codec
+from couchdbkit.resource import ResourceError
+from couchdbkit.uuids import random_hex
+
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+DEFAULT_FSYNC_INTERVAL = 1.0
+DEFAULT_REPLAY_BATCH_SIZE = 1000
+DEFAULT_REPLAY_BATCH_BYTES = 4 * 1024 * 1024
+DEFAULT_REPLAY_INTERVAL = 5.0
+
+FSYNC_ALWAYS = 'always'
+FSYNC_INTERVAL = 'interval'
+FSYNC_NEVER = 'never'
+
+SEGMENT_SUFFIX = '.spool'
+CHECKPOINT = 'checkpoint'
+QUARANTINE = 'quarantine'
+QUARANTINED = 'quarantined'
+
+def is_transient(error):
+    """ return True if a write failed because the server couldn't be
+    reached or had a temporary error, and can be spooled """
+    return request_failed(error) is not None
+
+def encode_record(data):
+    """ return the line of a segment for an encoded document """
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    # newlines of a JSON document are only whitespace
+    data = data.replace("\n", " ")
+    return "%08x %s\n" % (zlib.crc32(data) & 0xffffffff, data)
+
+def decode_record(line):
+    """ return the encoded document of a line of a segment, or None if the
+    line is torn or corrupt """
+    if not line.endswith("\n") or len(line) < 10 or line[8] != " ":
+        return None
+    data = line[9:-1]
+    try:
+        crc = int(line[:8], 16)
+    except ValueError:
+        return None
+    if zlib.crc32(data) & 0xffffffff != crc:
+        return None
+    return data
+
+class WriteSpool(object):
+    """ append-only journal of documents which couldn't be saved. Thread
+    safe.
+
+    @param path: str, directory of the spool, created if needed
+    @param segment_size: int, size in bytes of a segment file before a
+    new one is started. Replayed segments are deleted.
+    @param fsync: str, when spooled documents are synced to the disk:
+    'always' after each append, 'interval' at most every `fsync_interval`
+    seconds, 'never' leaves it to the OS.
+    @param fsync_interval: float, seconds between syncs with 'interval'
+    @param batch_size: int, max number of documents of a replay request
+    @param batch_bytes: int, max size of the documents of a replay request
+    @param replay_interval: float, seconds between replays of the
+    background thread started by the database. No thread if None.
+    @param on_error: function called with the document and the
+    `_bulk_docs` row of documents refused by the replay
+    """
+
+    def __init__(self, path, segment_size=DEFAULT_SEGMENT_SIZE,
+            fsync=FSYNC_ALWAYS, fsync_interval=DEFAULT_FSYNC_INTERVAL,
+            batch_size=DEFAULT_REPLAY_BATCH_SIZE,
+            batch_bytes=DEFAULT_REPLAY_BATCH_BYTES,
+            replay_interval=DEFAULT_REPLAY_INTERVAL, on_error=None):
+        if fsync not in (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER):
+            raise ValueError("unknown fsync policy %r" % fsync)
+        self.path = path
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.batch_size = batch_size
+        self.batch_bytes = batch_bytes
+        self.replay_interval = replay_interval
+        self.on_error = on_error
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        self._lock = threading.Lock()
+        # only one replay at a time
+        self._replay_lock = threading.Lock()
+        self._file = None
+        self._segment = None
+        self._size = 0
+        self._synced = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self.spooled = 0
+        self.replayed = 0
+        self.conflicts = 0
+        self.errors = 0
+        self.corrupt = 0
+        self.superseded = 0
+        self.quarantined = 0
+        self.fsyncs = 0
+        # revisions of documents replayed, used by their next saves
+        self._revs = {}
+        self.replay_time = 0.0
+        self.last_error = None
+        self._load()
+
+    def __repr__(self):
+        return "<%s %s pending=%s>" % (self.__class__.__name__, self.path,
+                self.pending)
+
+    def __len__(self):
+        return self.pending
+
+    def __nonzero__(self):
+        return True
+
+    def _load(self):
+        """ count documents left by a previous process """
+        checkpoint = self._read_checkpoint()
+        self.pending = 0
+        self._bytes = 0
+        for segment in self._segments():
+            if segment < checkpoint[0]:
+                # replayed, the process stopped before deleting it
+                self._unlink(segment)
+                continue
+            offset = 0
+            if segment == checkpoint[0]:
+                offset = checkpoint[1]
+            for record, end in self._iter_records(segment, offset):
+                if record is not None:
+                    self.pending += 1
+            self._bytes += os.path.getsize(self._fname(segment)) - offset
+        self.quarantined = len(self._read_quarantine())
+
+    def append(self, docs, encode=None):
+        """ journal a list of documents. Documents without `_id` get one.
+
+        @param encode: function encoding a document in JSON, by default the
+        default codec
+        """
+        if encode is None:
+            encode = get_codec().encode
+        lines = []
+        for doc in docs:
+            if not doc.get('_id'):
+                doc['_id'] = random_hex(32)
+            lines.append(encode_record(encode(doc)))
+        self._append_lines(lines)
+
+    def _append_lines(self, lines):
+        if not lines:
+            return
+        data = "".join(lines)
+
+        with self._lock:
+            if self._file is None or self._size >= self.segment_size:
+                self._roll()
+            self._file.write(data)
+            self._file.flush()
+            self._size += len(data)
+            self._sync()
+            self.pending += len(lines)
+            self.spooled += len(lines)
+            self._bytes += len(data)
+
+    def replay(self, db, max_docs=None):
+        """ send pending documents to `db` in `_bulk_docs` batches and
+        return the number of spooled saves replayed. Stop at the first
+        request which fails for a transient reason. Batches refused by the
+        server are quarantined, their documents are given to `on_error`
+        with the error 'quarantined'.
+
+        @param max_docs: int, max number of documents sent
+        """
+        with self._replay_lock:
+            start = time.time()
+            sent = 0
+            try:
+                while max_docs is None or sent < max_docs:
+                    count = self._replay_next(db, max_docs and max_docs - sent)
+                    if count is None:
+                        # end of a segment
+                        continue
+                    if not count:
+                        break
+                    sent += count
+            finally:
+                with self._lock:
+                    self.replay_time += time.time() - start
+            return sent
+
+    def requeue_quarantined(self):
+        """ spool again the documents of the quarantine file and return
+        their number """
+        with self._replay_lock:
+            records = self._read_quarantine()
+            self._append_lines([encode_record(data) for data in records])
+            with self._lock:
+                self._unlink_quarantine()
+                self.quarantined = 0
+            return len(records)
+
+    def start(self, db):
+        """ start a thread replaying the spool to `db` every
+        `replay_interval` seconds """
+        if self.replay_interval is None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(db,))
+            self._thread.setDaemon(True)
+        self._thread.start()
+
+    def close(self):
+        """ stop the replay thread and sync the spool """
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.currentThread():
+            thread.join()
+        with self._lock:
+            if self._file is not None:
+                self._close_segment()
+
+    def stats(self):
+        """ return a dict with the number of documents and bytes pending,
+        segments, documents spooled and replayed, documents refused by
+        the replay (conflicts and other errors), documents quarantined,
+        saves replaced by a later save of the same document, corrupt
+        records skipped, syncs and the replay rate in documents per
+        second """
+        with self._lock:
+            rate = 0.0
+            if self.replay_time:
+                rate = self.replayed / self.replay_time
+            return {
+                'pending': self.pending,
+                'bytes': self._bytes,
+                'segments': len(self._segments()),
+                'spooled': self.spooled,
+                'replayed': self.replayed,
+                'conflicts': self.conflicts,
+                'errors': self.errors,
+                'quarantined': self.quarantined,
+                'corrupt': self.corrupt,
+                'superseded': self.superseded,
+                'fsyncs': self.fsyncs,
+                'replay_rate': rate
+            }
+
+    def _run(self, db):
+        while not self._stop.isSet():
+            self._stop.wait(self.replay_interval)
+            if self._stop.isSet() or not self.pending:
+                continue
+            try:
+                self.replay(db)
+            except Exception, e:
+                self.last_error = e
+
+    def _replay_next(self, db, max_docs=None):
+        """ replay the next batch of the oldest segment, return the number
+        of documents sent, or None if the segment was fully replayed """
+        segment, offset = self._read_checkpoint()
+        with self._lock:
+            segments = self._segments()
+            if not segments:
+                return 0
+            if segment not in segments:
+                segment, offset = segments[0], 0
+            if segment == self._segment:
+                # appends go to a new segment, this one is read until its end
+                self._close_segment()
+
+        batch_size = self.batch_size
+        if max_docs:
+            batch_size = min(batch_size, max_docs)
+        encoded = []
+        size = 0
+        end = offset
+        for record, end in self._iter_records(segment, offset):
+            if record is None:
+                # not counted in pending
+                with self._lock:
+                    self.corrupt += 1
+                continue
+            encoded.append(record)
+            size += len(record) + 1
+            if len(encoded) >= batch_size or size >= self.batch_bytes:
+                break
+        else:
+            if not encoded:
+                self._end_segment(segment, offset)
+                return None
+
+        count = len(encoded)
+        docs, encoded = self._last_writes(db, encoded)
+        try:
+            results = db._post_bulk_docs(docs, encoded)
+        except ResourceError, e:
+            self.last_error = e
+            if is_transient(e):
+                self._write_checkpoint(segment, offset)
+                return 0
+            # refused by the server, sending it again won't help
+            self._quarantine(encoded)
+            results = [{'id': doc['_id'], 'error': QUARANTINED,
+                'reason': str(e)} for doc in docs]
+
+        conflicts = errors = 0
+        for doc, res in zip(docs, results):
+            if 'error' in res:
+                if res['error'] == 'conflict':
+                    conflicts += 1
+                else:
+                    errors += 1
+                if self.on_error is not None:
+                    self.on_error(doc, res)
+            else:
+                db._update_bulk_doc(doc, res)
+                self._revs[res['id']] = res['rev']
+
+        self._write_checkpoint(segment, end)
+        with self._lock:
+            self.pending -= count
+            if not self.pending:
+                self._revs.clear()
+            self._bytes -= end - offset
+            self.replayed += len(docs) - conflicts - errors
+            self.conflicts += conflicts
+            self.errors += errors
+            self.superseded += count - len(docs)
+        return count
+
+    def _last_writes(self, db, encoded):
+        """ return the docs of a batch to send and their encoded JSON,
+        keeping the last save of each doc with the revision of its last
+        replay """
+        codec = db.res.codec
+        docs = [codec.decode(data) for data in encoded]
+        last = {}
+        for i, doc in enumerate(docs):
+            last[doc['_id']] = i
+        if len(last) < len(docs):
+            keep = sorted(last.values())
+            docs = [docs[i] for i in keep]
+            encoded = [encoded[i] for i in keep]
+
+        for i, doc in enumerate(docs):
+            rev = self._revs.get(doc['_id'])
+            if rev is not None and doc.get('_rev') != rev:
+                doc['_rev'] = rev
+                encoded[i] = codec.encode(doc)
+        return docs, encoded
+
+    def _quarantine(self, encoded):
+        data = "".join([encode_record(record) for record in encoded])
+        with self._lock:
+            f = open(os.path.join(self.path, QUARANTINE), 'ab')
+            try:
+                f.write(data)
+                f.flush()
+                if self.fsync != FSYNC_NEVER:
+                    os.fsync(f.fileno())
+            finally:
+                f.close()
+            self.quarantined += len(encoded)
+
+    def _read_quarantine(self):
+        try:
+            f = open(os.path.join(self.path, QUARANTINE), 'rb')
+        except IOError:
+            return []
+        try:
+            records = [decode_record(line) for line in f]
+        finally:
+            f.close()
+        return [record for record in records if record is not None]
+
+    def _unlink_quarantine(self):
+        try:
+            os.unlink(os.path.join(self.path, QUARANTINE))
+        except OSError:
+            pass
+
+    def _end_segment(self, segment, offset):
+        """ delete a segment which was fully replayed """
+        try:
+            size = os.path.getsize(self._fname(segment))
+        except OSError:
+            size = offset
+        with self._lock:
+            segments = self._segments()
+            # corrupt records and a torn line left
+            self._bytes -= size - offset
+        following = [s for s in segments if s > segment]
+        if following:
+            self._write_checkpoint(following[0], 0)
+        else:
+            self._write_checkpoint(segment + 1, 0)
+        self._unlink(segment)
+
+    def _iter_records(self, segment, offset):
+        """ iterate on (encoded document or None, offset of the next line)
+        from `offset`. A torn last line ends the segment. """
+        try:
+            f = open(self._fname(segment), 'rb')
+        except IOError:
+            return
+        try:
+            f.seek(offset)
+            while True:
+                line = f.readline()
+                if not line.endswith("\n"):
+                    return
+                offset += len(line)
+                yield decode_record(line), offset
+        finally:
+            f.close()
+
+    def _roll(self):
+        """ start a new segment, called with the lock """
+        if self._file is not None:
+            self._close_segment()
+        segments = self._segments()
+        segment = max(segments + [self._read_checkpoint()[0] - 1]) + 1
+        self._file = open(self._fname(segment), 'ab')
+        self._segment = segment
+        self._size = 0
+
+    def _close_segment(self):
+        if self.fsync != FSYNC_NEVER:
+            os.fsync(self._file.fileno())
+            self.fsyncs += 1
+        self._file.close()
+        self._file = None
+        self._segment = None
+
+    def _sync(self):
+        if self.fsync == FSYNC_NEVER:
+            return
+        now = time.time()
+        if self.fsync == FSYNC_INTERVAL and \
+                now - self._synced < self.fsync_interval:
+            return
+        os.fsync(self._file.fileno())
+        self._synced = now
+        self.fsyncs += 1
+
+    def _segments(self):
+        segments = []
+        for fname in os.listdir(self.path):
+            if fname.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append(int(fname[:-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    pass
+        segments.sort()
+        return segments
+
+    def _fname(self, segment):
+        return os.path.join(self.path, "%016d%s" % (segment, SEGMENT_SUFFIX))
+
+    def _unlink(self, segment):
+        try:
+            os.unlink(self._fname(segment))
+        except OSError:
+            pass
+
+    def _read_checkpoint(self):
+        try:
+            f = open(os.path.join(self.path, CHECKPOINT), 'rb')
+        except IOError:
+            return 0, 0
+        try:
+            try:
+                segment, offset = f.read().split()
+                return int(segment), int(offset)
+            except ValueError:
+                return 0, 0
+        finally:
+            f.close()
+
+    def _write_checkpoint(self, segment, offset):
+        fd, tmp = tempfile.mkstemp(dir=self.path)
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write("%d %d\n" % (segment, offset))
+            f.flush()
+            if self.fsync != FSYNC_NEVER:
+                os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, os.path.join(self.path, CHECKPOINT))
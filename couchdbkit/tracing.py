@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Timing of requests. A `Tracer` given to a server emits a `RequestEvent`
+for each request to its observers, once the response is read:
+
+    >>> from couchdbkit import Server
+    >>> from couchdbkit.tracing import Tracer, LatencyHistogram, \\
+    ...         SlowRequestLogger
+    >>> histogram = LatencyHistogram()
+    >>> server = Server(tracer=Tracer(histogram, SlowRequestLogger(0.5)))
+    >>> doc = server['mydb'].get('mydoc')
+    >>> histogram.stats()[('GET', '/mydb/{docid}')]['p95']
+    0.005
+
+Events have the method, the path of the request with documents ids and
+attachments names replaced by placeholders, the status, bytes sent and
+received, and timings in seconds:
+
+- `connect`: time to get a connection, from the pool or a new one
+- `ttfb`: time from the start of sending the request to response headers
+- `transfer`: time to read the body
+- `decode`: time to decode the JSON body
+
+Without a tracer nothing is measured.
+"""
+
+from __future__ import with_statement
+
+import bisect
+import logging
+import threading
+import time
+import urllib
+
+# buckets of `LatencyHistogram`, in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+        0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_SLOW_THRESHOLD = 1.0
+
+# paths of databases which parts are kept in templates
+_DB_SPECIAL = ('_all_docs', '_bulk_docs', '_changes', '_compact',
+        '_view_cleanup', '_temp_view', '_ensure_full_commit', '_purge',
+        '_missing_revs', '_revs_diff', '_revs_limit', '_security')
+_DESIGN_NAMED = ('_view', '_list')
+_DESIGN_DOC = ('_show', '_update')
+
+def path_template(path):
+    """ return the path of a request with documents ids and attachments
+    names replaced by placeholders
+
+        >>> path_template('/mydb/mydoc/photo.jpg')
+        '/mydb/{docid}/{attachment}'
+        >>> path_template('/mydb/_design/blog/_view/by_date')
+        '/mydb/_design/blog/_view/by_date'
+    """
+    parts = [urllib.unquote(p) for p in path.strip('/').split('/') if p]
+    if not parts or parts[0].startswith('_'):
+        # server
+        return '/' + '/'.join(parts)
+
+    template = [parts[0]]
+    rest = parts[1:]
+    if not rest:
+        pass
+    elif rest[0] in _DB_SPECIAL:
+        template.extend(rest)
+    elif rest[0] == '_local':
+        template.extend(['_local', '{docid}'])
+    elif rest[0] == '_design' and len(rest) > 1:
+        template.extend(rest[:2])
+        rest = rest[2:]
+        if rest and rest[0] in _DESIGN_NAMED:
+            template.extend(rest[:3])
+        elif rest and rest[0] in _DESIGN_DOC:
+            template.extend(rest[:2])
+            if len(rest) > 2:
+                template.append('{docid}')
+        elif rest:
+            template.append('{attachment}')
+    else:
+        template.append('{docid}')
+        if len(rest) > 1:
+            template.append('{attachment}')
+    return '/' + '/'.join(template)
+
+class RequestEvent(object):
+    """ timings of a request. Timings not measured are None. """
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path_template(path)
+        self.status = None
+        self.error = None
+        self.bytes_out = None
+        self.bytes_in = None
+        self.started = time.time()
+        self.connect = None
+        self.ttfb = None
+        self.transfer = None
+        self.decode = None
+        self.duration = None
+        self._connect_start = None
+        self._send_start = None
+
+    def __repr__(self):
+        return "<%s %s %s %s>" % (self.__class__.__name__, self.method,
+                self.path, self.status)
+
+    @property
+    def key(self):
+        return (self.method, self.path)
+
+    def to_dict(self):
+        return {
+            'method': self.method,
+            'path': self.path,
+            'status': self.status,
+            'error': self.error,
+            'bytes_out': self.bytes_out,
+            'bytes_in': self.bytes_in,
+            'started': self.started,
+            'connect': self.connect,
+            'ttfb': self.ttfb,
+            'transfer': self.transfer,
+            'decode': self.decode,
+            'duration': self.duration
+        }
+
+class Tracer(object):
+    """ emit events of requests to observers. Errors of observers are
+    ignored.
+
+    @param observers: callables taking a `RequestEvent`
+    """
+
+    def __init__(self, *observers):
+        self.observers = list(observers)
+
+    def add_observer(self, observer):
+        if not callable(observer):
+            raise TypeError("observer isn't a callable")
+        self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        self.observers.remove(observer)
+
+    def emit(self, event):
+        event.duration = time.time() - event.started
+        for observer in self.observers:
+            try:
+                observer(event)
+            except Exception:
+                pass
+
+# event of the request being sent by the current thread, read by
+# `TraceFilter`
+_local = threading.local()
+
+def set_current_event(event):
+    _local.event = event
+
+class TraceFilter(object):
+    """ restkit filter measuring the connection and the wait for response
+    headers of traced requests """
+
+    def on_connect(self, req):
+        event = getattr(_local, 'event', None)
+        if event is not None:
+            event._connect_start = time.time()
+
+    def on_request(self, req, *args):
+        event = getattr(_local, 'event', None)
+        if event is not None:
+            event._send_start = now = time.time()
+            if event._connect_start is not None:
+                event.connect = now - event._connect_start
+
+    def on_response(self, req):
+        event = getattr(_local, 'event', None)
+        if event is not None and event._send_start is not None:
+            event.ttfb = time.time() - event._send_start
+
+class LatencyHistogram(object):
+    """ observer counting durations of requests in buckets, by method and
+    path template
+
+    @param buckets: sorted list of upper bounds of buckets in seconds
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def __call__(self, event):
+        with self._lock:
+            entry = self._entries.get(event.key)
+            if entry is None:
+                entry = self._entries[event.key] = {
+                    'count': 0,
+                    'errors': 0,
+                    'total': 0.0,
+                    'min': None,
+                    'max': None,
+                    'bytes_in': 0,
+                    'bytes_out': 0,
+                    'counts': [0] * (len(self.buckets) + 1)
+                }
+            duration = event.duration
+            entry['count'] += 1
+            if event.error is not None or (event.status or 0) >= 400:
+                entry['errors'] += 1
+            entry['total'] += duration
+            if entry['min'] is None or duration < entry['min']:
+                entry['min'] = duration
+            if entry['max'] is None or duration > entry['max']:
+                entry['max'] = duration
+            entry['bytes_in'] += event.bytes_in or 0
+            entry['bytes_out'] += event.bytes_out or 0
+            entry['counts'][bisect.bisect_left(self.buckets, duration)] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _percentile(self, counts, max_duration, p):
+        # upper bound of the bucket of the percentile `p` (0-100)
+        rank = sum(counts) * p / 100.0
+        seen = 0
+        for i, count in enumerate(counts):
+            seen += count
+            if count and seen >= rank:
+                if i < len(self.buckets):
+                    return min(self.buckets[i], max_duration)
+                return max_duration
+        return max_duration
+
+    def stats(self):
+        """ return a dict of stats by (method, path template): count,
+        errors, total/mean/min/max durations, p50/p95/p99, bytes in and
+        out, and `buckets`, a list of (upper bound, count). The last
+        bound is None. """
+        with self._lock:
+            entries = [(k, dict(v, counts=list(v['counts'])))
+                    for k, v in self._entries.items()]
+        stats = {}
+        for key, entry in entries:
+            counts = entry.pop('counts')
+            entry['mean'] = entry['total'] / entry['count']
+            for p in (50, 95, 99):
+                entry['p%s' % p] = self._percentile(counts, entry['max'], p)
+            entry['buckets'] = zip(self.buckets + (None,), counts)
+            stats[key] = entry
+        return stats
+
+class SlowRequestLogger(object):
+    """ observer logging requests slower than a threshold
+
+    @param threshold: float, min duration in seconds of logged requests
+    @param logger: `logging.Logger`, by default "couchdbkit.slow"
+    @param level: logging level
+    """
+
+    def __init__(self, threshold=DEFAULT_SLOW_THRESHOLD, logger=None,
+            level=logging.WARNING):
+        self.threshold = threshold
+        if logger is None:
+            logger = logging.getLogger("couchdbkit.slow")
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, event):
+        if event.duration < self.threshold:
+            return
+        timings = ["%s=%.3fs" % (name, getattr(event, name))
+                for name in ('connect', 'ttfb', 'transfer', 'decode')
+                if getattr(event, name) is not None]
+        self.logger.log(self.level, "slow request %s %s %s %.3fs %s "
+                "bytes_in=%s bytes_out=%s", event.method, event.path,
+                event.status or event.error, event.duration,
+                " ".join(timings), event.bytes_in, event.bytes_out)
@@ -11,18 +11,20 @@ really belong anywhere else in the modules.
 from __future__ import with_statement
 
 import codecs
+from collections import deque
 import string
 from calendar import timegm
 import datetime
 import decimal
 from hashlib import md5
 import os
+import Queue
 import re
 import sys
+import threading
 import time
 
-
-import anyjson
+from couchdbkit import codec
 
 # backport relpath from python2.6
 if not hasattr(os.path, 'relpath'):
@@ -153,7 +155,7 @@ def write_json(filename, content):
     :attr content: string
     
     """
-    write_content(filename, anyjson.serialize(content))
+    write_content(filename, codec.encode(content))
 
 def read_json(filename, use_environment=False):
     """ read a json file and deserialize
@@ -176,8 +178,133 @@ def read_json(filename, use_environment=False):
         data = string.Template(data).substitute(os.environ)
 
     try:
-        data = anyjson.deserialize(data)
+        data = codec.decode(data)
     except ValueError:
         print >>sys.stderr, "Json is invalid, can't load %s" % filename
         raise
-    return data
\ No newline at end of file
+    return data
+
+def read_ahead(iterable, depth=1):
+    """ iterate over `iterable` in a background thread. At most `depth`
+    items are buffered while the caller processes the current one.
+    Errors raised by `iterable` are raised again in the caller. When the
+    caller stops early, the thread stops after the item being produced.
+
+    :attr iterable: iterable, usually a generator doing some I/O
+    :attr depth: int, max number of items waiting in the buffer
+
+    :return: generator
+    """
+    queue = Queue.Queue(maxsize=max(depth, 1))
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.isSet():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            try:
+                for item in iterable:
+                    if not put((True, item)):
+                        break
+                else:
+                    put((False, None))
+            except:
+                put((False, sys.exc_info()))
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    def consume():
+        t = threading.Thread(target=produce)
+        t.setDaemon(True)
+        t.start()
+        try:
+            while True:
+                is_item, value = queue.get()
+                if is_item:
+                    yield value
+                elif value is None:
+                    break
+                else:
+                    raise value[0], value[1], value[2]
+        finally:
+            stopped.set()
+
+    return consume()
+
+def imap_ordered(func, iterable, concurrency=1):
+    """ apply `func` to each item of `iterable` in `concurrency` threads.
+    Results are yielded in input order as tuples `(item, result)`. At most
+    `concurrency` items are read ahead from `iterable`. If `func` raises,
+    the error is raised again in the caller and items left are not
+    processed.
+
+    :attr func: callable
+    :attr iterable: iterable
+    :attr concurrency: int, number of threads
+
+    :return: generator
+    """
+    if concurrency <= 1:
+        for item in iterable:
+            yield item, func(item)
+        return
+
+    class Task(object):
+        def __init__(self, item):
+            self.item = item
+            self.result = None
+            self.error = None
+            self.done = threading.Event()
+
+    jobs = Queue.Queue()
+    stopped = threading.Event()
+
+    def work():
+        while True:
+            task = jobs.get()
+            if task is None:
+                break
+            if not stopped.isSet():
+                try:
+                    task.result = func(task.item)
+                except:
+                    task.error = sys.exc_info()
+            task.done.set()
+
+    workers = []
+    for i in range(concurrency):
+        t = threading.Thread(target=work)
+        t.setDaemon(True)
+        t.start()
+        workers.append(t)
+
+    def wait(task):
+        task.done.wait()
+        if task.error is not None:
+            raise task.error[0], task.error[1], task.error[2]
+        return task.item, task.result
+
+    pending = deque()
+    try:
+        for item in iterable:
+            task = Task(item)
+            jobs.put(task)
+            pending.append(task)
+            if len(pending) >= concurrency:
+                yield wait(pending.popleft())
+
+        while pending:
+            yield wait(pending.popleft())
+    finally:
+        if pending:
+            stopped.set()
+        for t in workers:
+            jobs.put(None)
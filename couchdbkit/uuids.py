@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+
+"""
+Document ids generated on the client side, without asking `/_uuids` to
+the server. Algorithms are the ones of CouchDB:
+
+- `random`: 32 random hex chars.
+- `sequential`: a random prefix of 26 hex chars followed by 6 hex
+  chars incremented by a random step. The prefix changes on overflow.
+  Ids are mostly increasing, which improves insert locality in the
+  B-tree of the database and keeps the file smaller.
+- `utc_random`: 14 hex chars of microseconds since the epoch followed
+  by 18 random hex chars.
+- `utc_id`: like `utc_random` but followed by a fixed suffix.
+
+Use them with a `Server`:
+
+    >>> from couchdbkit import Server
+    >>> server = Server(uuid_algorithm="sequential")
+    >>> len(server.next_uuid())
+    32
+"""
+
+import binascii
+import os
+import random
+import threading
+import time
+
+def random_hex(size):
+    """ return a string of `size` random hex chars """
+    return binascii.hexlify(os.urandom((size + 1) // 2))[:size]
+
+class UUIDGenerator(object):
+    """ base class of uuid generators. `next` should be thread-safe """
+
+    def next(self):
+        raise NotImplementedError
+
+    def __iter__(self):
+        return self
+
+class RandomUUIDs(UUIDGenerator):
+    """ 32 random hex chars """
+
+    def next(self):
+        return random_hex(32)
+
+class SequentialUUIDs(UUIDGenerator):
+    """ random prefix + monotonic suffix, like the `sequential`
+    algorithm of CouchDB """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self._new_prefix()
+
+    def _new_prefix(self):
+        self._prefix = random_hex(26)
+        self._seq = self._random.randint(1, 0xfff)
+
+    def next(self):
+        self._lock.acquire()
+        try:
+            self._seq += self._random.randint(1, 0xffe)
+            if self._seq >= 0xfff000:
+                self._new_prefix()
+            return "%s%06x" % (self._prefix, self._seq)
+        finally:
+            self._lock.release()
+
+class UTCRandomUUIDs(UUIDGenerator):
+    """ time prefixed ids, like the `utc_random` algorithm of CouchDB """
+
+    _lock = threading.Lock()
+    _last = 0
+
+    def _utc_prefix(self):
+        # never return the same prefix twice in a process
+        self._lock.acquire()
+        try:
+            now = max(int(time.time() * 1000000), UTCRandomUUIDs._last + 1)
+            UTCRandomUUIDs._last = now
+        finally:
+            self._lock.release()
+        return "%014x" % now
+
+    def next(self):
+        return self._utc_prefix() + random_hex(18)
+
+class UTCIdUUIDs(UTCRandomUUIDs):
+    """ time prefixed ids followed by a fixed suffix, like the `utc_id`
+    algorithm of CouchDB """
+
+    def __init__(self, suffix=None):
+        if suffix is None:
+            suffix = random_hex(18)
+        self.suffix = suffix
+
+    def next(self):
+        return self._utc_prefix() + self.suffix
+
+UUID_ALGORITHMS = {
+    "random": RandomUUIDs,
+    "sequential": SequentialUUIDs,
+    "utc_random": UTCRandomUUIDs,
+    "utc_id": UTCIdUUIDs
+}
+
+def get_uuid_generator(algorithm):
+    """ return an uuid generator
+
+    @param algorithm: name of an algorithm in `UUID_ALGORITHMS` or
+    `UUIDGenerator` instance
+    """
+    if isinstance(algorithm, UUIDGenerator):
+        return algorithm
+    try:
+        return UUID_ALGORITHMS[algorithm]()
+    except KeyError:
+        raise ValueError("unknown uuid algorithm %r" % algorithm)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license. 
+# See the NOTICE for more information.
+
+"""
+Compare encode and decode throughput of installed JSON codecs on
+payloads couchdbkit usually handles: `_bulk_docs` bodies, view responses
+and lines of the continuous changes feed.
+
+usage: python codec_bench.py [-n repeat] [codec ...]
+"""
+
+import optparse
+import random
+import sys
+import time
+
+from couchdbkit import codec
+
+def make_doc(i):
+    return {
+        "_id": "%032x" % random.getrandbits(128),
+        "_rev": "1-%032x" % random.getrandbits(128),
+        "doc_type": "Event",
+        "name": u"événement %s" % i,
+        "count": i,
+        "ratio": i / 3.0,
+        "active": bool(i % 2),
+        "tags": ["tag%s" % j for j in range(i % 5)],
+        "created": "2010-05-%02dT10:00:00Z" % (i % 28 + 1),
+        "author": {"name": "user%s" % (i % 50), "email": None},
+    }
+
+def bulk_docs_payload(size=1000):
+    return {"docs": [make_doc(i) for i in range(size)]}
+
+def view_payload(size=5000):
+    rows = []
+    for i in range(size):
+        doc = make_doc(i)
+        rows.append({"id": doc["_id"], "key": [doc["doc_type"], i],
+            "value": {"rev": doc["_rev"]}, "doc": doc})
+    return {"total_rows": size, "offset": 0, "rows": rows}
+
+def changes_lines(size=5000):
+    return [{"seq": i, "id": "%032x" % random.getrandbits(128), 
+        "changes": [{"rev": "1-%032x" % random.getrandbits(128)}]}
+            for i in range(size)]
+
+def timeit(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def bench_codec(c, payloads, repeat):
+    results = []
+    for name, obj in payloads:
+        if isinstance(obj, list):
+            # changes feed, one object per line
+            encoded = [c.encode(line) for line in obj]
+            size = sum([len(line) for line in encoded])
+            encode = lambda: [c.encode(line) for line in obj]
+            decode = lambda: [c.decode(line) for line in encoded]
+        else:
+            encoded = c.encode(obj)
+            size = len(encoded)
+            encode = lambda: c.encode(obj)
+            decode = lambda: c.decode(encoded)
+            
+        if c.decode(c.encode(obj)) != obj and not isinstance(obj, list):
+            print >>sys.stderr, "warning: %s doesn't roundtrip %s" % (
+                    c.name, name)
+            
+        t_enc = timeit(encode, repeat)
+        t_dec = timeit(decode, repeat)
+        mb = size / (1024.0 * 1024.0)
+        results.append((name, mb / t_enc, mb / t_dec))
+    return results
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [-n repeat] [codec ...]")
+    parser.add_option("-n", "--repeat", type="int", default=5,
+            help="number of runs, the best one is kept")
+    opts, args = parser.parse_args()
+
+    names = args or codec.available_codecs()
+    payloads = [
+        ("bulk_docs", bulk_docs_payload()),
+        ("view", view_payload()),
+        ("changes", changes_lines()),
+    ]
+
+    print "default codec: %s" % codec.default_codec().name
+    print "%-12s %-10s %12s %12s" % ("codec", "payload", "encode MB/s",
+            "decode MB/s")
+    for name in names:
+        try:
+            c = codec.load_codec(name)
+        except ImportError:
+            print "%-12s not installed" % name
+            continue
+        for payload, enc, dec in bench_codec(c, payloads, opts.repeat):
+            print "%-12s %-10s %12.1f %12.1f" % (name, payload, enc, dec)
+
+if __name__ == "__main__":
+    main()
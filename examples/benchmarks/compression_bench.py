@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license. 
+# See the NOTICE for more information.
+
+"""
+Compare bytes on the wire and end-to-end time of compressed and plain
+bodies on a link of a given bandwidth and latency. Payloads are
+`_bulk_docs` bodies and view responses with documents. The end-to-end
+time is the compression time, the transfer time of the compressed body
+and the decompression time.
+
+usage: python compression_bench.py [-n repeat] [-b mbits] [-l ms]
+"""
+
+import optparse
+import time
+
+from couchdbkit import codec
+from couchdbkit.compression import gzip_compress, decompress
+
+from codec_bench import bulk_docs_payload, view_payload, timeit
+
+LEVELS = (1, 6, 9)
+
+def bench_payload(data, level, repeat, bandwidth, latency):
+    """ return (size, compression time, decompression time, end to end
+    time) of a payload compressed at `level`, or plain if level is None """
+    if level is None:
+        return len(data), 0.0, 0.0, latency + len(data) / bandwidth
+
+    compressed = gzip_compress(data, level)
+    t_comp = timeit(lambda: gzip_compress(data, level), repeat)
+    t_dec = timeit(lambda: decompress(compressed, "gzip"), repeat)
+    total = t_comp + latency + len(compressed) / bandwidth + t_dec
+    return len(compressed), t_comp, t_dec, total
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [-n repeat] [-b mbits] "
+            "[-l ms]")
+    parser.add_option("-n", "--repeat", type="int", default=5,
+            help="number of runs, the best one is kept")
+    parser.add_option("-b", "--bandwidth", type="float", default=10.0,
+            help="bandwidth of the link in Mbit/s")
+    parser.add_option("-l", "--latency", type="float", default=20.0,
+            help="round trip time of the link in ms")
+    opts, args = parser.parse_args()
+
+    bandwidth = opts.bandwidth * 1000000 / 8.0
+    latency = opts.latency / 1000.0
+    c = codec.default_codec()
+    payloads = [
+        ("bulk_docs", c.encode(bulk_docs_payload())),
+        ("view", c.encode(view_payload())),
+    ]
+
+    print "link: %.1f Mbit/s, %.0f ms" % (opts.bandwidth, opts.latency)
+    print "%-10s %-6s %10s %7s %10s %10s %10s" % ("payload", "level",
+            "bytes", "ratio", "comp ms", "decomp ms", "total ms")
+    for name, data in payloads:
+        for level in (None,) + LEVELS:
+            size, t_comp, t_dec, total = bench_payload(data, level,
+                    opts.repeat, bandwidth, latency)
+            print "%-10s %-6s %10d %6.1f%% %10.1f %10.1f %10.1f" % (name,
+                    level or "plain", size, 100.0 * size / len(data),
+                    t_comp * 1000, t_dec * 1000, total * 1000)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license. 
+# See the NOTICE for more information.
+
+"""
+Compare uuid algorithms: insert throughput and size of the database
+file before and after compaction. Ids fetched from the server
+(`/_uuids`) are used as reference.
+
+usage: python uuids_bench.py [--uri URI] [-n docs] [-b batch] [algorithm ...]
+"""
+
+import optparse
+import time
+
+from couchdbkit import Server
+from couchdbkit.uuids import UUID_ALGORITHMS
+
+DBNAME = "couchdbkit_uuids_bench"
+
+def wait_compaction(db):
+    while db.info().get("compact_running"):
+        time.sleep(0.5)
+
+def bench(uri, algorithm, count, batch):
+    if algorithm == "server":
+        server = Server(uri)
+    else:
+        server = Server(uri, uuid_algorithm=algorithm)
+    if DBNAME in server:
+        del server[DBNAME]
+    db = server.create_db(DBNAME)
+
+    start = time.time()
+    if batch > 1:
+        for i in range(0, count, batch):
+            db.bulk_save([{"n": n} for n in range(i, min(i + batch, count))])
+    else:
+        for n in range(count):
+            db.save_doc({"n": n})
+    elapsed = time.time() - start
+
+    disk_size = db.info().get("disk_size", 0)
+    db.compact()
+    time.sleep(0.5)
+    wait_compaction(db)
+    compacted_size = db.info().get("disk_size", 0)
+    del server[DBNAME]
+    return count / elapsed, disk_size, compacted_size
+
+def main():
+    parser = optparse.OptionParser(
+            usage="%prog [--uri URI] [-n docs] [-b batch] [algorithm ...]")
+    parser.add_option("--uri", default="http://127.0.0.1:5984")
+    parser.add_option("-n", "--docs", type="int", default=20000,
+            help="number of docs inserted")
+    parser.add_option("-b", "--batch", type="int", default=1000,
+            help="docs per _bulk_docs request, 1 to use save_doc")
+    opts, args = parser.parse_args()
+
+    algorithms = args or ["server"] + sorted(UUID_ALGORITHMS)
+    print "%-12s %12s %14s %16s" % ("algorithm", "docs/s", "disk size",
+            "compacted size")
+    for algorithm in algorithms:
+        rate, size, compacted = bench(opts.uri, algorithm, opts.docs,
+                opts.batch)
+        print "%-12s %12.0f %14d %16d" % (algorithm, rate, size, compacted)
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,22 @@
 # This file is part of couchdbkit released under the MIT license. 
 # See the NOTICE for more information.
 #
+from __future__ import with_statement
+
 __author__ = 'benoitc@e-engura.com (Benoît Chesneau)'
 
 import copy
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 from couchdbkit import ResourceNotFound, RequestFailed, \
 ResourceConflict
 
 from couchdbkit import *
+from couchdbkit.asyncclient import AsyncServer, AsyncDatabase
 
 from restkit import SimplePool
 pool = SimplePool()
@@ -79,6 +86,48 @@ class ClientServerTestCase(unittest.TestCase):
         uuid2 = self.Server.next_uuid()
         self.assert_(uuid != uuid2)
         self.assert_(len(self.Server._uuids) == 998)
+
+    def testLocalUUIDs(self):
+        server = Server(uuid_algorithm="sequential")
+        uuid = server.next_uuid()
+        self.assert_(len(uuid) == 32)
+        self.assert_(server._uuids == [])
+        self.assert_(server.next_uuid() > uuid)
+
+        db = server.create_db('couchdbkit_test')
+        doc = {}
+        db.save_doc(doc)
+        self.assert_(doc['_id'] > uuid)
+        docs = [{}, {'_id': 'test'}, {}]
+        db.bulk_save(docs)
+        self.assert_(docs[0]['_id'] > doc['_id'])
+        self.assert_(docs[2]['_id'] > docs[0]['_id'])
+        self.assert_(docs[1]['_id'] == 'test')
+        del server['couchdbkit_test']
+
+    def testConnectionPool(self):
+        pool = ConnectionPool(max_connections=2, keepalive=2)
+        server = Server(pool_instance=pool)
+        self.assert_(server.res.prewarm() == 2)
+        db = server.create_db('couchdbkit_test')
+        db.save_doc({'_id': 'test'})
+
+        def get():
+            for i in range(5):
+                db.get('test')
+                db.doc_exist('test')
+        threads = [threading.Thread(target=get) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        stats = pool.stats()
+        self.assert_(stats['created'] == 2)
+        self.assert_(stats['reused'] >= 42)
+        self.assert_(stats['active'] == 0)
+        self.assert_(stats['idle'] == 2)
+        del server['couchdbkit_test']
         
 class ClientDatabaseTestCase(unittest.TestCase):
     def setUp(self):
@@ -462,7 +511,485 @@ class ClientDatabaseTestCase(unittest.TestCase):
         doc = db.get('test2')
         self.assert_(doc['number'] == 42) 
         del self.Server['couchdbkit_test']
+
+    def testSaveMultipleDocsBatches(self):
+        db = self.Server.create_db('couchdbkit_test')
+        docs = [{'_id': 'test%02d' % i, 'number': i} for i in range(20)]
+        db.bulk_save((doc for doc in docs), batch_size=3, concurrency=3)
+        self.assert_(len(db) == 20)
+        self.assertRaises(ValueError, db.bulk_save, docs, concurrency=3)
+        self.assertRaises(ValueError, db.bulk_save, docs, batch_size=3,
+                stream=True)
+        for doc in docs:
+            self.assert_('_rev' in doc)
+
+        docs.append({'number': 20})
+        docs[4].pop('_rev')
+        docs[13].pop('_rev')
+        try:
+            db.bulk_save(iter(docs), batch_bytes=100, concurrency=2)
+        except BulkSaveError, e:
+            self.assert_([error['id'] for error in e.errors] == 
+                    ['test04', 'test13'])
+        else:
+            self.fail("BulkSaveError not raised")
+        self.assert_('_id' in docs[20])
+        self.assert_(db.get('test05')['_rev'] == docs[5]['_rev'])
+        self.assert_(docs[5]['_rev'].startswith('2-'))
+        del self.Server['couchdbkit_test']
    
+    def testSaveMultipleDocsRetries(self):
+        db = self.Server.create_db('couchdbkit_test')
+        db['_design/validate'] = {'validate_doc_update': 
+            "function(doc) { if (doc.invalid) "
+            "throw({forbidden: 'invalid doc'}); }"}
+        docs = [{'_id': 'test%02d' % i, 'number': i} for i in range(10)]
+        result = db.bulk_save([doc.copy() for doc in docs])
+        self.assert_(result.saved == 10)
+        self.assert_([item.rev for item in result] ==
+                [item.doc['_rev'] for item in result])
+
+        # conflicts are sent again with their current revision, forbidden
+        # docs are returned
+        docs[2]['invalid'] = True
+        result = db.bulk_save(iter(docs), batch_size=4, retries=2,
+                force_update=True, raise_errors=False)
+        self.assert_(result.saved == 9)
+        self.assert_(result.retried == 10)
+        self.assert_([item.id for item in result.failed] == ['test02'])
+        self.assert_(result.failed[0].error == 'forbidden')
+        self.assert_(result.failed_docs == [docs[2]])
+        self.assert_(docs[5]['_rev'].startswith('2-'))
+
+        try:
+            db.bulk_save([docs[2]])
+        except BulkSaveError, e:
+            self.assert_(e.result.failed[0].id == 'test02')
+        else:
+            self.fail("BulkSaveError not raised")
+        del self.Server['couchdbkit_test']
+
+    def testOpenDocs(self):
+        db = self.Server.create_db('couchdbkit_test')
+        docs = [{'_id': 'test%s' % i, 'number': i} for i in range(10)]
+        db.bulk_save(docs)
+        db.delete_doc('test3')
+
+        ids = ['test9', 'test0', 'test5', 'test0']
+        results = db.open_docs(ids, chunk_size=3, concurrency=2,
+                wrapper=lambda doc: doc['number'])
+        self.assert_(results == [9, 0, 5, 0])
+
+        try:
+            db.open_docs(['test1', 'test3', 'missing'])
+        except DocsNotFound, e:
+            self.assert_(e.missing == ['missing'])
+            self.assert_(e.deleted.keys() == ['test3'])
+            self.assert_(e.docs[0]['number'] == 1)
+            self.assert_(e.docs[1:] == [None, None])
+        else:
+            self.fail("DocsNotFound not raised")
+
+        results = db.open_docs(iter(['missing', 'test2']),
+                ignore_missing=True)
+        self.assert_(results[0] is None)
+        self.assert_(results[1]['number'] == 2)
+        del self.Server['couchdbkit_test']
+
+    def testBatching(self):
+        db = self.Server.create_db('couchdbkit_test')
+        docs = [{'_id': 'test%s' % i, 'number': i} for i in range(10)]
+        db.bulk_save(docs)
+        db.delete_doc('test3')
+
+        requests = []
+        open_docs = db.open_docs
+        def counted_open_docs(docids, **params):
+            requests.append(list(docids))
+            return open_docs(docids, **params)
+        db.open_docs = counted_open_docs
+
+        results = {}
+        def get(docid):
+            try:
+                results[docid] = db.get(docid)['number']
+            except ResourceNotFound, e:
+                results[docid] = e.msg
+
+        loader = db.batching(wait=0.2)
+        def batched_get(docid):
+            with loader:
+                get(docid)
+
+        threads = [threading.Thread(target=batched_get, args=(docid,))
+                for docid in ['test1', 'test2', 'test3', 'missing']]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assert_(len(requests) == 1)
+        self.assert_(results == {'test1': 1, 'test2': 2,
+            'test3': 'deleted', 'missing': 'missing'})
+        self.assert_(db.doc_loader is None)
+
+        loader = db.batching()
+        deferred = [loader.defer(docid) for docid in ['test5', 'test6', 'test5']]
+        self.assert_(len(requests) == 1)
+        docs = [d.result() for d in deferred]
+        self.assert_(len(requests) == 2)
+        self.assert_([doc['number'] for doc in docs] == [5, 6, 5])
+        self.assert_(docs[0] is not docs[2])
+        self.assert_(requests[1] == ['test5', 'test6'])
+        del self.Server['couchdbkit_test']
+
+    def testBatchingThreads(self):
+        db = Database("http://127.0.0.1:5984/couchdbkit_test")
+        loaders = [db.batching(), db.batching()]
+        entered = [threading.Event(), threading.Event()]
+        exited = threading.Event()
+        seen = {}
+
+        def first():
+            with loaders[0]:
+                entered[0].set()
+                entered[1].wait()
+                seen['first'] = db.doc_loader
+            exited.set()
+            seen['first_after'] = db.doc_loader
+
+        def second():
+            entered[0].wait()
+            with loaders[1]:
+                entered[1].set()
+                # the first thread exits its block before this one
+                exited.wait()
+                seen['second'] = db.doc_loader
+            seen['second_after'] = db.doc_loader
+
+        threads = [threading.Thread(target=first),
+                threading.Thread(target=second)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assert_(seen == {'first': loaders[0], 'first_after': None,
+            'second': loaders[1], 'second_after': None})
+        self.assert_(db.doc_loader is None)
+
+        # nested blocks of a thread
+        with loaders[0]:
+            with loaders[1]:
+                self.assert_(db.doc_loader is loaders[1])
+            self.assert_(db.doc_loader is loaders[0])
+        self.assert_(db.doc_loader is None)
+
+    def testDocCache(self):
+        db = self.Server.create_db('couchdbkit_test')
+        db = Database(db.uri, server=self.Server, doc_cache=DocCache())
+        doc = {'_id': 'test', 'number': 1}
+        db.save_doc(doc)
+
+        doc1 = db.get('test')
+        doc2 = db.get('test')
+        self.assert_(doc1 == doc2)
+        self.assert_(doc1 is not doc2)
+        stats = db.doc_cache.stats()
+        self.assert_(stats['misses'] == 1)
+        self.assert_(stats['hits'] == 1)
+        self.assert_(stats['bytes_saved'] > 0)
+        self.assert_(db.get('test', rev=doc['_rev'])['number'] == 1)
+        self.assert_(db.doc_cache.stats()['hits'] == 1)
+
+        doc2['number'] = 2
+        db.save_doc(doc2)
+        self.assert_('test' not in db.doc_cache)
+        self.assert_(db.get('test')['number'] == 2)
+
+        # changed by another client
+        other = self.Server['couchdbkit_test']
+        doc3 = other.get('test')
+        doc3['number'] = 3
+        other.save_doc(doc3)
+        self.assert_(db.get('test')['number'] == 3)
+        self.assert_(db.doc_cache.stats()['misses'] == 3)
+
+        db.delete_doc(doc3)
+        self.assert_('test' not in db.doc_cache)
+        self.assertRaises(ResourceNotFound, db.get, 'test')
+        del self.Server['couchdbkit_test']
+
+    def testRevCache(self):
+        db = self.Server.create_db('couchdbkit_test')
+        db = Database(db.uri, server=self.Server, rev_cache=True)
+        doc = {'_id': 'test', 'number': 1}
+        db.save_doc(doc)
+        self.assert_(db.rev_cache.get_rev('test') == doc['_rev'])
+
+        # changed by another client
+        other = self.Server['couchdbkit_test']
+        doc2 = other.get('test')
+        other.save_doc(doc2)
+        self.assert_(db.get('test')['_rev'] == doc2['_rev'])
+        db.save_doc({'_id': 'test', 'number': 2}, force_update=True)
+        other.save_doc(other.get('test'))
+        # the cached revision is outdated
+        db.save_doc({'_id': 'test', 'number': 3}, force_update=True)
+        self.assert_(db.get('test')['number'] == 3)
+
+        db.delete_doc('test')
+        self.assert_('test' not in db.rev_cache)
+        self.assert_('test' not in db)
+
+        docs = [{'_id': 'test%s' % i, 'number': i} for i in range(10)]
+        other.bulk_save([doc.copy() for doc in docs[:5]])
+        self.assertRaises(BulkSaveError, db.bulk_save,
+                [doc.copy() for doc in docs])
+        # all docs are in conflict now
+        db.bulk_save(docs, force_update=True)
+        self.assert_(db.get('test0')['_rev'].startswith('2-'))
+        self.assert_(db.get('test9')['_rev'].startswith('2-'))
+        self.assert_(db.lookup_revs(['test0', 'missing']) ==
+                {'test0': docs[0]['_rev']})
+
+        db.copy_doc('test1', 'test2')
+        self.assert_(db.get('test2')['number'] == 1)
+        self.assert_(db.rev_cache.get_rev('test2').startswith('3-'))
+        del self.Server['couchdbkit_test']
+
+    def testUpdateDocs(self):
+        db = self.Server.create_db('couchdbkit_test')
+        db.bulk_save([{'_id': 'test%s' % i, 'count': 0} for i in range(10)])
+        other = self.Server['couchdbkit_test']
+
+        calls = []
+        def incr(doc):
+            calls.append(doc['_id'])
+            if doc['_id'] == 'test1' and calls.count('test1') == 1:
+                # changed by another client before the save
+                other.save_doc(other.get('test1'))
+            if doc['_id'] == 'test2':
+                return False
+            doc['count'] = doc.get('count', 0) + 1
+
+        ids = ['test%s' % i for i in range(10)] + ['test0', 'new']
+        results = db.update_docs(ids, incr, chunk_size=3)
+        self.assert_(len(results) == 11)
+        self.assert_([r['status'] for r in results[:3]] ==
+                ['updated', 'updated', 'unchanged'])
+        self.assert_(results[-1] == {'id': 'new', 'status': 'missing'})
+        self.assert_(calls.count('test1') == 2)
+        self.assert_(calls.count('test0') == 1)
+        doc = db.get('test1')
+        self.assert_(doc['count'] == 1)
+        self.assert_(doc['_rev'] == results[1]['rev'])
+        self.assert_(db.get('test2')['count'] == 0)
+
+        results = db.update_docs(['new'], incr, create=True)
+        self.assert_(results[0]['status'] == 'updated')
+        self.assert_(db.get('new')['count'] == 1)
+
+        def conflict(doc):
+            other.save_doc(other.get(doc['_id']))
+        results = db.update_docs(['test3'], conflict, max_retries=1)
+        self.assert_(results == [{'id': 'test3', 'status': 'conflict'}])
+
+        # a new dict gets the revision of the doc read
+        results = db.update_docs(['test4', 'test5'],
+                lambda doc: {'count': doc['count'] + 10}, max_retries=0)
+        self.assert_([r['status'] for r in results] == ['updated'] * 2)
+        self.assert_(db.get('test4')['count'] == 11)
+        del self.Server['couchdbkit_test']
+
+    def testBuffered(self):
+        db = self.Server.create_db('couchdbkit_test')
+        db.save_doc({'_id': 'taken'})
+        with db.buffered(max_docs=10, interval=0.1) as writer:
+            docs = [{'number': i} for i in range(25)]
+            for doc in docs:
+                db.save_doc(doc)
+                self.assert_('_id' in doc)
+            self.assert_(db.doc_writer is writer)
+            future = writer.save({'_id': 'taken'})
+            last = writer.save({'_id': 'last', 'number': 1})
+            writer.save({'_id': 'last', 'number': 2})
+        self.assert_(db.doc_writer is None)
+        self.assertRaises(ResourceConflict, future.result)
+        self.assert_(last.result()['id'] == 'last')
+        self.assert_(db.get('last')['number'] == 2)
+        for doc in docs:
+            self.assert_(db.get(doc['_id'])['_rev'] == doc['_rev'])
+        stats = writer.stats()
+        self.assert_(stats['written'] == 26)
+        self.assert_(stats['coalesced'] == 1)
+        self.assert_(stats['errors'] == 1)
+        self.assert_(stats['pending'] == 0)
+        del self.Server['couchdbkit_test']
+
+    def testBufferedThreads(self):
+        db = self.Server.create_db('couchdbkit_test')
+        writers = [db.buffered(interval=None), db.buffered(interval=None)]
+        entered = [threading.Event(), threading.Event()]
+        exited = threading.Event()
+        seen = {}
+
+        def first():
+            with writers[0]:
+                entered[0].set()
+                entered[1].wait()
+                seen['first'] = db.save_doc({'_id': 'first'})
+            exited.set()
+            seen['first_after'] = db.doc_writer
+
+        def second():
+            entered[0].wait()
+            with writers[1]:
+                entered[1].set()
+                # the first thread exits its block before this one
+                exited.wait()
+                seen['second'] = db.doc_writer
+            seen['second_after'] = db.doc_writer
+
+        threads = [threading.Thread(target=first),
+                threading.Thread(target=second)]
+        for t in threads:
+            t.start()
+            # saves of other threads aren't buffered
+            doc = {}
+            db.save_doc(doc)
+            self.assert_('_rev' in doc)
+        for t in threads:
+            t.join()
+        self.assert_('rev' not in seen['first'])
+        self.assert_(seen['second'] is writers[1])
+        self.assert_(seen['first_after'] is None)
+        self.assert_(seen['second_after'] is None)
+        self.assert_(db.doc_writer is None)
+        self.assert_('first' in db)
+        # the writers are closed, saves aren't sent to them
+        doc = {'_id': 'after'}
+        db.save_doc(doc)
+        self.assert_('_rev' in doc)
+        self.assertRaises(ValueError, writers[0].__enter__)
+
+        # nested blocks, and a writer shared by threads
+        writer = db.buffered(interval=None)
+        def enter_exit():
+            with writer:
+                self.assert_(db.doc_writer is writer)
+
+        with BufferedWriter(db) as outer:
+            with writer:
+                self.assert_(db.doc_writer is writer)
+                thread = threading.Thread(target=enter_exit)
+                thread.start()
+                thread.join()
+                # closed by the last exit only
+                future = writer.save({'_id': 'shared'})
+            self.assert_(db.doc_writer is outer)
+        self.assert_(future.result()['id'] == 'shared')
+        del self.Server['couchdbkit_test']
+
+    def testSpool(self):
+        db = self.Server.create_db('couchdbkit_test')
+        doc = {'_id': 'doc1', 'n': 1}
+        db.save_doc(doc)
+        path = tempfile.mkdtemp()
+        try:
+            down = Database("http://127.0.0.1:1/couchdbkit_test",
+                    spool=WriteSpool(path, replay_interval=None))
+            res = down.save_doc({'n': 2})
+            self.assert_(res['spooled'])
+            doc['n'] = 3
+            self.assert_(down.save_doc(doc)['spooled'])
+            result = down.bulk_save([{'_id': 'a'}, {'_id': 'b'}])
+            self.assert_(result.spooled == 2)
+            self.assert_(down.spool.stats()['pending'] == 4)
+
+            self.assert_(down.spool.replay(db) == 4)
+            self.assert_(db.get('doc1')['n'] == 3)
+            self.assert_(db.get(res['id'])['n'] == 2)
+            self.assert_('a' in db and 'b' in db)
+            stats = down.spool.stats()
+            self.assert_(stats['pending'] == 0)
+            self.assert_(stats['replayed'] == 4)
+            down.close()
+        finally:
+            shutil.rmtree(path)
+        del self.Server['couchdbkit_test']
+
+    def testParallel(self):
+        db = self.Server.create_db('couchdbkit_test')
+        docs = [{'_id': 'test%s' % i, 'number': i} for i in range(20)]
+        with db.parallel(max_workers=5) as p:
+            for doc in docs:
+                p.save_doc(doc)
+            p.save_doc({'_id': 'test0'})
+        results = p.results(return_exceptions=True)
+        self.assert_(len(results) == 21)
+        self.assert_([r['id'] for r in results[:20]] ==
+                [doc['_id'] for doc in docs])
+        self.assert_(isinstance(results[20], ResourceConflict))
+        self.assertRaises(ResourceConflict, p.results)
+
+        p = db.parallel(max_workers=5)
+        ids = [doc['_id'] for doc in reversed(docs)]
+        self.assert_([doc['number'] for doc in p.map('open_doc', ids)] ==
+                range(19, -1, -1))
+        future = p.delete_doc(docs[0])
+        self.assert_(future.result()['ok'])
+        self.assert_(p.view('_all_docs').count().result() == 19)
+        p.close()
+        del self.Server['couchdbkit_test']
+
+    def testTracing(self):
+        events = []
+        histogram = LatencyHistogram()
+        server = Server(tracer=Tracer(events.append, histogram))
+        db = server.create_db('couchdbkit_test')
+        del events[:]
+
+        db.save_doc({'_id': 'test', 'title': 'traced'})
+        db.get('test')
+        self.assert_(db.doc_exist('test'))
+        self.assertRaises(ResourceNotFound, db.get, 'missing')
+        self.assert_(len(list(db.view('_all_docs').iterator(stream=True))) == 1)
+
+        self.assert_([(e.method, e.path, e.status) for e in events] == [
+            ('PUT', '/couchdbkit_test/{docid}', 201),
+            ('GET', '/couchdbkit_test/{docid}', 200),
+            ('HEAD', '/couchdbkit_test/{docid}', 200),
+            ('GET', '/couchdbkit_test/{docid}', 404),
+            ('GET', '/couchdbkit_test/_all_docs', 200)])
+        for event in events:
+            self.assert_(event.connect is not None)
+            self.assert_(event.ttfb is not None)
+            self.assert_(event.duration >= event.ttfb)
+        save, get, head, missing, view = events
+        self.assert_(save.bytes_out > 0)
+        self.assert_(get.bytes_in > 0)
+        self.assert_(get.decode is not None)
+        self.assert_(head.transfer is None)
+        self.assert_(missing.error == 'ResourceNotFound')
+        self.assert_(view.bytes_in > 0)
+        self.assert_(histogram.stats()[('GET',
+            '/couchdbkit_test/{docid}')]['count'] == 2)
+
+        # without tracer nothing is measured
+        resp = self.Server['couchdbkit_test'].res.get('test')
+        self.assert_(resp.trace_event is None)
+        resp.body_string()
+        del self.Server['couchdbkit_test']
+
+    def testSaveMultipleDocsStream(self):
+        db = self.Server.create_db('couchdbkit_test')
+        docs = [{'number': i} for i in range(50)]
+        db.bulk_save(docs, stream=True)
+        self.assert_(len(db) == 50)
+        for doc in docs:
+            self.assert_('_rev' in doc)
+        self.assert_(db.get(docs[42]['_id'])['number'] == 42)
+        del self.Server['couchdbkit_test']
+
     def testDeleteMultipleDocs(self):
         db = self.Server.create_db('couchdbkit_test')
         docs = [
@@ -565,6 +1092,60 @@ class ClientDatabaseTestCase(unittest.TestCase):
         del self.Server['couchdbkit_test']
 
 
+class AsyncClientTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.Server = AsyncServer(max_workers=5)
+
+    def tearDown(self):
+        try:
+            self.Server.delete_db('couchdbkit_test').result()
+        except:
+            pass
+        self.Server.close()
+
+    def testDocuments(self):
+        db = self.Server.create_db('couchdbkit_test').result()
+        self.assert_(isinstance(db, AsyncDatabase))
+        docs = [{'_id': 'test%s' % i, 'number': i} for i in range(20)]
+        futures = [db.save_doc(doc) for doc in docs]
+        for future in futures:
+            self.assert_(future.result()['ok'])
+
+        futures = [db.open_doc(doc['_id']) for doc in docs]
+        self.assert_([f.result()['number'] for f in futures] == range(20))
+
+        future = db.open_doc('missing')
+        self.assertRaises(ResourceNotFound, future.result)
+        future = db.save_doc({'_id': 'test1'})
+        self.assertRaises(ResourceConflict, future.result)
+
+        db.bulk_save([{'_id': 'new1'}, {'_id': 'new2'}]).result()
+        self.assert_(db.info().result()['doc_count'] == 22)
+
+    def testViewAndChanges(self):
+        db = self.Server.create_db('couchdbkit_test').result()
+        changes = []
+        feed = db.changes(changes.append, timeout=100)
+        db.bulk_save([{'_id': 'test%s' % i} for i in range(10)]).result()
+
+        rows = []
+        count = db.view('_all_docs').each(rows.append).result()
+        self.assert_(count == 10)
+        self.assert_(rows[0]['id'] == 'test0')
+        self.assert_(len(db.all_docs(limit=3).all().result()) == 3)
+        rows = []
+        db.view('_all_docs').each(rows.append, page_size=3).result()
+        self.assert_(len(rows) == 10)
+
+        for i in range(50):
+            if len(changes) == 10:
+                break
+            time.sleep(0.05)
+        feed.stop()
+        self.assert_(len(changes) == 10)
+        self.assert_(feed.future.result() == 10)
+
 class ClientViewTestCase(unittest.TestCase):
     def setUp(self):
         self.couchdb = CouchdbResource()
@@ -773,6 +1354,208 @@ class ClientViewTestCase(unittest.TestCase):
 
         del self.Server['couchdbkit_test']
 
+    def testViewStream(self):
+        db = self.Server.create_db('couchdbkit_test')
+        docs = [{'_id': 'test%s' % i, 'number': i} for i in range(10)]
+        db.bulk_save(docs)
+
+        results = db.view('_all_docs', include_docs=True)
+        rows = list(results.iterator(stream=True))
+        self.assert_(len(rows) == 10)
+        self.assert_(rows[0]['doc']['number'] == 0)
+        self.assert_(results.total_rows == 10)
+        self.assert_(results.offset == 0)
+        self.assert_(results._result_cache is None)
+
+        results = db.view('_all_docs', wrapper=lambda row: row['id'])
+        self.assert_(list(results.iterator(stream=True)) == 
+                [doc['_id'] for doc in docs])
+        del self.Server['couchdbkit_test']
+
+    def testViewStreamKeys(self):
+        db = self.Server.create_db('couchdbkit_test')
+        docs = [{'_id': 'test%s' % i, 'number': i} for i in range(10)]
+        db.bulk_save(docs)
+
+        keys = ['test%s' % i for i in range(0, 10, 2)]
+        results = db.view('_all_docs', keys=keys, _stream_keys=True)
+        self.assert_([row['id'] for row in results] == keys)
+        del self.Server['couchdbkit_test']
+
+    def testViewCache(self):
+        db = self.Server.create_db('couchdbkit_test')
+        db.bulk_save([{'_id': 'test%s' % i} for i in range(5)])
+
+        for i, cache in enumerate([ViewCache(),
+                ViewCache(validate="update_seq")]):
+            db.view_cache = cache
+            self.assert_(len(db.view('_all_docs', limit=2)) == 2)
+            self.assert_(len(db.view('_all_docs', limit=2)) == 2)
+            self.assert_(len(db.view('_all_docs', limit=3)) == 3)
+            stats = cache.stats()
+            self.assert_(stats['hits'] == 1)
+            self.assert_(stats['misses'] == 2)
+            self.assert_(stats['bytes_saved'] > 0)
+            db.save_doc({'_id': 'new%s' % i})
+            self.assert_(db.view('_all_docs', limit=2).total_rows == 6 + i)
+            self.assert_(cache.stats()['misses'] == 3)
+
+        cache = db.view_cache = ViewCache()
+        cache.attach(Consumer(db))
+        self.assert_(db.view('_all_docs').total_rows == 7)
+        db.save_doc({'_id': 'new2'})
+        # not invalidated until the change is received
+        self.assert_(db.view('_all_docs').total_rows == 7)
+        cache.on_change({'seq': 8, 'id': 'new2'})
+        self.assert_(db.view('_all_docs').total_rows == 8)
+        self.assert_(cache.stats()['hits'] == 1)
+        del self.Server['couchdbkit_test']
+
+    def testViewProfiler(self):
+        events = []
+        server = Server(tracer=Tracer(events.append))
+        db = server.create_db('couchdbkit_test')
+        db.bulk_save([{'_id': 'test%s' % i} for i in range(5)])
+        profiler = ViewProfiler(top_n=2)
+        db = Database(db.uri, server=server, view_profiler=profiler)
+        del events[:]
+
+        wrapper = lambda row: row['id']
+        self.assert_(len(db.view('_all_docs', limit=3)) == 3)
+        self.assert_(len(list(db.view('_all_docs', wrapper=wrapper,
+            include_docs=True).iterator(stream=True))) == 5)
+        self.assert_(len(list(db.view('_all_docs', wrapper=wrapper,
+            startkey='test1').paged(page_size=2))) == 4)
+
+        stats = profiler.stats()['/couchdbkit_test/_all_docs']
+        self.assert_(stats['count'] == 4)
+        # pages are fetched with an extra row
+        self.assert_(stats['rows'] == 3 + 5 + 3 + 2)
+        self.assert_(stats['bytes'] > 0)
+        self.assert_(stats['wrap_time'] > 0)
+        self.assert_(stats['p99'] == stats['max'])
+        slowest = profiler.slowest()
+        self.assert_(len(slowest) == 2)
+        self.assert_(slowest[0].duration >= slowest[1].duration)
+        stream = [c for c in profiler._views['/couchdbkit_test/_all_docs'
+            ].samples if c.params['include_docs']][0]
+        self.assert_(stream.rows == 5)
+        self.assert_(stream.bytes > 0)
+
+        # events are still sent to the tracer of the database
+        self.assert_(len(events) == 4)
+        self.assert_(events[0].bytes_in > 0)
+
+        # revalidations of the view cache are recorded
+        db.view_cache = ViewCache()
+        db.view('_all_docs').all()
+        db.view('_all_docs').all()
+        samples = profiler._views['/couchdbkit_test/_all_docs'].samples
+        self.assert_(len(samples) == 6)
+        self.assert_(samples[-1].status == 304)
+        self.assert_(samples[-1].rows == 5)
+        del self.Server['couchdbkit_test']
+
+    def testViewSingleFlight(self):
+        server = Server(single_flight=True)
+        db = server.create_db('couchdbkit_test')
+        db.bulk_save([{'_id': 'test%s' % i} for i in range(5)])
+        group = server.res.single_flight
+        # create_db and bulk_save went through the group too
+        before = group.stats()
+
+        # requests sent wait until the other threads joined them
+        gate = threading.Event()
+        call = db.res._call
+        def slow_call(*args, **kwargs):
+            gate.wait()
+            return call(*args, **kwargs)
+        db.res._call = slow_call
+
+        results = []
+        def fetch():
+            results.append(db.view('_all_docs').all())
+        def get():
+            try:
+                db.get('missing')
+            except ResourceNotFound, e:
+                results.append(e)
+
+        collapsed = 0
+        for target in (fetch, get):
+            gate.clear()
+            threads = [threading.Thread(target=target) for i in range(5)]
+            for t in threads:
+                t.start()
+            collapsed += 4
+            deadline = time.time() + 10
+            while group.stats()['collapsed'] - before['collapsed'] < \
+                    collapsed and \
+                    time.time() < deadline:
+                time.sleep(0.01)
+            gate.set()
+            for t in threads:
+                t.join()
+        self.assert_(len(results) == 10)
+        for rows in results[:5]:
+            self.assert_(len(rows) == 5)
+        self.assert_(results[0] is not results[1])
+        for error in results[5:]:
+            self.assert_(isinstance(error, ResourceNotFound))
+        stats = group.stats()
+        self.assert_(stats['calls'] - before['calls'] == 2)
+        self.assert_(stats['collapsed'] - before['collapsed'] == 8)
+        self.assert_(stats['in_flight'] == 0)
+        del self.Server['couchdbkit_test']
+
+    def testViewPaged(self):
+        db = self.Server.create_db('couchdbkit_test')
+        docs = [{'_id': 'test%02d' % i, 'k': i // 4} for i in range(21)]
+        db.bulk_save(docs)
+        design_doc = {
+            '_id': '_design/test',
+            'language': 'javascript',
+            'views': {
+                'by_k': {
+                    "map": """function(doc) { if (doc.k !== undefined) { emit(doc.k, null);
+}}"""
+                }
+            }
+        }
+        db.save_doc(design_doc)
+
+        ids = [row['id'] for row in db.view('test/by_k').paged(page_size=3)]
+        self.assert_(ids == [doc['_id'] for doc in docs])
+
+        results = db.view('test/by_k', descending=True).paged(page_size=5)
+        ids = [row['id'] for row in results]
+        self.assert_(ids == [doc['_id'] for doc in reversed(docs)])
+
+        results = db.view('test/by_k', startkey=1, endkey=3,
+                inclusive_end=False).paged(page_size=2)
+        self.assert_([row['key'] for row in results] == [1] * 4 + [2] * 4)
+
+        results = db.view('test/by_k', key=2, limit=3).paged(page_size=2)
+        self.assert_([row['id'] for row in results] == 
+                ['test08', 'test09', 'test10'])
+
+        self.assert_(len(list(db)) == 22)
+        del self.Server['couchdbkit_test']
+
+    def testViewPagedPrefetch(self):
+        db = self.Server.create_db('couchdbkit_test')
+        docs = [{'_id': 'test%02d' % i} for i in range(20)]
+        db.bulk_save(docs)
+
+        results = db.view('_all_docs').paged(page_size=3, prefetch=2)
+        self.assert_([row['id'] for row in results] == 
+                [doc['_id'] for doc in docs])
+
+        results = db.view('_all_docs').paged(page_size=3, prefetch=2)
+        self.assert_(results.next()['id'] == 'test00')
+        results.close()
+        del self.Server['couchdbkit_test']
+
         
 
 if __name__ == '__main__':
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+#
+"""
+Checks of the green mode against a stand-in CouchDB served by gevent in
+the same process. The standard library is patched, so it's run in its own
+process by test_green.py. Exit status is 0 if all checks pass.
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+import sys
+import time
+
+import anyjson
+import gevent
+from gevent.pywsgi import WSGIServer
+
+from couchdbkit import Server, Consumer
+from couchdbkit.green import GreenPool
+
+NB_GREENLETS = 1000
+DELAY = 0.05
+
+def standin(environ, start_response):
+    path = environ['PATH_INFO'].strip('/').split('/')
+    if path[-1] == '_changes':
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        endless = 'endless' in environ['QUERY_STRING']
+        def feed():
+            seq = 0
+            while seq < 3 or endless:
+                seq += 1
+                gevent.sleep(DELAY)
+                yield anyjson.serialize({"seq": seq, "id": "doc%s" % seq,
+                    "changes": [{"rev": "1-a"}]}) + "\n"
+                # heartbeat
+                yield "\n"
+            yield anyjson.serialize({"last_seq": seq}) + "\n"
+        return feed()
+
+    # document get, slow enough to have all greenlets waiting together
+    gevent.sleep(DELAY)
+    body = anyjson.serialize({"_id": path[-1], "_rev": "1-a"})
+    start_response('200 OK', [('Content-Type', 'application/json'),
+        ('Content-Length', str(len(body)))])
+    return [body]
+
+def check_concurrent_gets(db, pool, netloc):
+    docs = {}
+    def get(i):
+        docs[i] = db.open_doc("doc%s" % i)
+    start = time.time()
+    gevent.joinall([gevent.spawn(get, i) for i in range(NB_GREENLETS)],
+            raise_error=True)
+    duration = time.time() - start
+
+    assert len(docs) == NB_GREENLETS
+    assert docs[42]['_id'] == "doc42"
+    # sequential gets would take NB_GREENLETS * DELAY seconds
+    assert duration < NB_GREENLETS * DELAY / 5, duration
+    assert pool.size(netloc) == pool.keepalive, pool.size(netloc)
+
+    # idle connections are reused
+    db.open_doc("doc0")
+    assert pool.size(netloc) == pool.keepalive
+
+def check_consumer(db):
+    ticks = []
+    def ticker():
+        while True:
+            ticks.append(1)
+            gevent.sleep(DELAY / 5)
+    t = gevent.spawn(ticker)
+
+    lines = []
+    consumer = Consumer(db)
+    consumer.register_callback(lines.append)
+    last = consumer.wait()
+    assert [line['seq'] for line in lines[:3]] == [1, 2, 3], lines
+    assert last == {"last_seq": 3}, last
+    # the hub wasn't blocked while reading the feed
+    assert len(ticks) > 5, len(ticks)
+
+    # a consumer is stopped by killing its greenlet
+    del lines[:]
+    g = gevent.spawn(consumer.wait, endless=True)
+    while len(lines) < 2:
+        gevent.sleep(DELAY)
+    g.kill()
+    assert g.dead
+    assert consumer.resp.closed
+    t.kill()
+
+def main():
+    server = WSGIServer(('127.0.0.1', 0), standin, log=None)
+    server.start()
+    netloc = ('127.0.0.1', server.server_port)
+    pool = GreenPool("gevent", keepalive=20)
+    try:
+        s = Server("http://127.0.0.1:%s" % server.server_port,
+                pool_instance=pool)
+        db = s['greendb']
+        check_concurrent_gets(db, pool, netloc)
+        check_consumer(db)
+    finally:
+        pool.close()
+        server.stop()
+
+if __name__ == '__main__':
+    main()
+    sys.exit(0)
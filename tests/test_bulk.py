@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+#
+
+import unittest
+
+from restkit.errors import RequestFailed
+
+from couchdbkit.bulk import BulkItem, BulkResult, request_failed
+
+def make_item(docid, row):
+    item = BulkItem({'_id': docid})
+    item.update(row)
+    return item
+
+class BulkResultTestCase(unittest.TestCase):
+
+    def testAdd(self):
+        result = BulkResult()
+        result.add(make_item('a', {'id': 'a', 'rev': '1-a'}))
+        result.add(make_item('b', {'id': 'b', 'error': 'conflict',
+            'reason': 'Document update conflict.'}))
+        self.assert_(result.saved == 1)
+        self.assert_(not result)
+        self.assert_([item.ok for item in result] == [True, False])
+        self.assert_(result.errors == [{'id': 'b', 'error': 'conflict',
+            'reason': 'Document update conflict.'}])
+        self.assert_(result.failed_docs == [{'_id': 'b'}])
+
+        result = BulkResult(keep_items=False)
+        result.add(make_item('a', {'id': 'a', 'rev': '1-a'}))
+        self.assert_(result)
+        self.assert_(len(result) == 0)
+        self.assert_(result.saved == 1)
+
+    def testPopRetries(self):
+        result = BulkResult()
+        for docid, error in [('a', 'conflict'), ('b', 'forbidden'),
+                ('c', 'unknown_error'), ('d', 'request_failed')]:
+            result.add(make_item(docid, {'id': docid, 'error': error}))
+        self.assert_([item.id for item in result.pop_retries()] ==
+                ['c', 'd'])
+        self.assert_([item.id for item in result.failed] == ['a', 'b'])
+        self.assert_([item.id for item in result.pop_retries(True)] ==
+                ['a'])
+        self.assert_(result.retried == 3)
+
+        item = result.items[0]
+        item.update({'id': 'a', 'rev': '2-a'})
+        self.assert_(item.ok)
+        self.assert_(item.attempts == 2)
+        self.assert_(item.to_dict() == {'id': 'a', 'rev': '2-a'})
+
+    def testRequestFailed(self):
+        row = request_failed(RequestFailed("connection refused"))
+        self.assert_(row['error'] == 'request_failed')
+        self.assert_(request_failed(RequestFailed("unavailable",
+            http_code=503)) is not None)
+        self.assert_(request_failed(RequestFailed("bad request",
+            http_code=400)) is None)
+        self.assert_(request_failed(ValueError()) is None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license. 
+# See the NOTICE for more information.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from couchdbkit.cache import LRUCache, DocCache, DiskBackend, RevCache, \
+ViewCache
+from couchdbkit.codec import get_codec
+
+class LRUCacheTestCase(unittest.TestCase):
+
+    def testEvictBySize(self):
+        cache = LRUCache(10)
+        cache.set('a', 1, size=4)
+        cache.set('b', 2, size=4)
+        self.assert_(cache.get('a') == 1)
+        cache.set('c', 3, size=4)
+        # b is the least recently used
+        self.assert_('b' not in cache)
+        self.assert_(cache.keys() == ['c', 'a'])
+        self.assert_(cache.size == 8)
+        self.assert_(cache.evictions == 1)
+
+        cache.set('d', 4, size=11)
+        self.assert_('d' not in cache)
+        cache.set('a', 5, size=2)
+        self.assert_(cache.size == 6)
+        self.assert_(cache.pop('a') == 5)
+        self.assert_(cache.size == 4)
+
+    def testEvictByCount(self):
+        cache = LRUCache(100, max_items=2)
+        for key in 'abc':
+            cache.set(key, key)
+        self.assert_(cache.keys() == ['c', 'b'])
+        cache.clear()
+        self.assert_(len(cache) == 0)
+        self.assert_(cache.size == 0)
+        self.assert_(cache.get('c') is None)
+
+    def testDocCache(self):
+        cache = DocCache(max_size=100)
+        cache.set_entry('doc', '"1-a"', '{"_id":"doc"}')
+        cache.set_entry('noetag', None, '{}')
+        self.assert_(cache.get_entry('doc') == ('"1-a"', '{"_id":"doc"}'))
+        self.assert_(cache.get_entry('noetag') is None)
+        cache.hit('{"_id":"doc"}')
+        cache.miss()
+        stats = cache.stats()
+        self.assert_(stats['hits'] == 1)
+        self.assert_(stats['misses'] == 1)
+        self.assert_(stats['bytes_saved'] == 13)
+        self.assert_(stats['size'] == 13)
+
+    def testRevCache(self):
+        cache = RevCache(max_items=2)
+        cache.set_rev('a', '1-a')
+        self.assert_(cache.get_rev('a') == '1-a')
+        self.assert_(cache.get_rev('b') is None)
+        cache.update_docs([{'_id': 'b', '_rev': '2-b'},
+            {'_id': 'a', '_rev': '2-a', '_deleted': True}])
+        self.assert_(cache.keys() == ['b'])
+
+        cache.on_change({'seq': 3, 'id': 'c', 'changes': [{'rev': '1-c'}]})
+        cache.on_change({'results': [{'seq': 4, 'id': 'b', 'deleted': True,
+            'changes': [{'rev': '3-b'}]}], 'last_seq': 4})
+        cache.on_change({'last_seq': 4})
+        self.assert_(cache.keys() == ['c'])
+        self.assert_(cache.stats()['hits'] == 1)
+        self.assert_(cache.stats()['misses'] == 1)
+
+class DiskBackendTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def testBackend(self):
+        backend = DiskBackend(self.path)
+        backend.set('a', ('"etag"', '{"rows":[]}'), size=11)
+        self.assert_(backend.get('a') == ('"etag"', '{"rows":[]}'))
+        self.assert_(DiskBackend(self.path).get('a') ==
+                ('"etag"', '{"rows":[]}'))
+        self.assert_(backend.get('b') is None)
+        self.assert_(backend.pop('a') == ('"etag"', '{"rows":[]}'))
+        self.assert_(backend.get('a') is None)
+        backend.set('b', 1)
+        backend.clear()
+        self.assert_(backend.get('b') is None)
+
+    def testEvict(self):
+        backend = DiskBackend(self.path, max_size=1000, max_items=2)
+        backend.set('a', ('"a"', '{"rows":[]}'))
+        backend.set('b', ('"b"', '{"rows":[]}'))
+        os.utime(backend._fname('a'), (1, 1))
+        os.utime(backend._fname('b'), (2, 2))
+        # a becomes the most recently used
+        self.assert_(backend.get('a') == ('"a"', '{"rows":[]}'))
+        backend.set('c', ('"c"', '{"rows":[]}'))
+        self.assert_(backend.get('b') is None)
+        self.assert_(backend.get('a') is not None)
+        self.assert_(backend.get('c') is not None)
+        self.assert_(backend.items == 2)
+        self.assert_(backend.evictions == 1)
+
+        backend.set('big', ('"big"', 'x' * 1000))
+        self.assert_(backend.get('big') is None)
+        self.assert_(DiskBackend(self.path).size == backend.size)
+
+    def testUnpickled(self):
+        backend = DiskBackend(self.path)
+        backend.set('a', ('"etag"', '{"rows":[]}'))
+        f = open(backend._fname('a'), 'wb')
+        f.write("cos\nsystem\n(S'true'\ntR.")
+        f.close()
+        self.assert_(backend.get('a') is None)
+
+class FakeView(object):
+
+    class _db(object):
+        uri = "http://127.0.0.1:5984/couchdbkit_test"
+        class res(object):
+            codec = get_codec('json')
+
+    view_path = "_design/test/_view/all"
+
+class ViewCacheTestCase(unittest.TestCase):
+
+    def testCacheKey(self):
+        cache = ViewCache()
+        key = cache.cache_key(FakeView(), {'startkey': u'caf\xe9',
+            'startkey_docid': u'caf\xe9', 'limit': 11, '_headers': {}})
+        self.assert_(isinstance(key, str))
+        self.assert_(key.endswith("?limit=11&startkey=%22caf%5Cu00e9%22"
+            "&startkey_docid=caf%C3%A9"))
+        self.assert_(cache.cache_key(FakeView(), {'limit': 11}) !=
+                cache.cache_key(FakeView(), {'limit': 12}))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license. 
+# See the NOTICE for more information.
+#
+
+import json
+import math
+import unittest
+
+from couchdbkit import codec
+from couchdbkit.resource import CouchdbResource, encode_params
+
+class CodecTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        codec.set_default_codec(None)
+
+    def testAvailableCodecs(self):
+        names = codec.available_codecs()
+        self.assert_('json' in names)
+        self.assert_(codec.default_codec().name == names[0])
+
+    def testEncodeDecode(self):
+        c = codec.load_codec('json')
+        data = c.encode({"a": u"é"})
+        self.assert_(isinstance(data, str))
+        self.assert_(c.decode(data) == {"a": u"é"})
+
+    def testFloats(self):
+        c = codec.default_codec()
+        self.assert_(c.name in ('simplejson', 'json'))
+        for value in (math.pi, 0.1234567890123456, 1e-300, 2.0 ** 60):
+            self.assert_(c.decode(c.encode({"f": value}))["f"] == value)
+
+    def testRegisterCodec(self):
+        calls = []
+        def dumps(obj):
+            calls.append(obj)
+            return json.dumps(obj)
+        codec.register_codec('test', lambda: (dumps, json.loads))
+        codec.set_default_codec('test')
+        self.assert_(codec.encode([1]) == '[1]')
+        self.assert_(encode_params({'key': 'a'}) == {'key': '"a"'})
+        self.assert_(calls == [[1], 'a'])
+
+    def testUnknownCodec(self):
+        self.assertRaises(ValueError, codec.get_codec, 'unknown')
+
+    def testResourceCodec(self):
+        res = CouchdbResource(codec='json')
+        self.assert_(res.codec.name == 'json')
+        self.assert_(res('db').codec.name == 'json')
+        self.assert_(res.clone().codec.name == 'json')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+#
+
+from StringIO import StringIO
+import unittest
+import zlib
+
+from couchdbkit.compression import gzip_compress, get_decoder, decompress, \
+DecompressingReader
+
+DATA = "".join(['{"id": "doc%s", "key": %s, "value": null}\n' % (i, i)
+    for i in range(2000)])
+
+def raw_deflate(data):
+    c = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+class DecoderTestCase(unittest.TestCase):
+
+    def testGzip(self):
+        body = gzip_compress(DATA)
+        self.assert_(len(body) < len(DATA) / 5)
+        self.assert_(decompress(body, "gzip") == DATA)
+        self.assert_(decompress(body, "x-gzip") == DATA)
+
+    def testDeflate(self):
+        self.assert_(decompress(zlib.compress(DATA), "deflate") == DATA)
+        # without zlib header
+        self.assert_(decompress(raw_deflate(DATA), "deflate") == DATA)
+
+    def testIdentity(self):
+        self.assert_(get_decoder(None) is None)
+        self.assert_(get_decoder("identity") is None)
+        self.assert_(decompress(DATA, None) == DATA)
+
+    def testIncremental(self):
+        body = zlib.compress(DATA)
+        decoder = get_decoder("deflate")
+        # the header is split between two pieces
+        chunks = [decoder.decompress(body[i:i + 1]) for i in range(3)]
+        chunks.append(decoder.decompress(body[3:]))
+        chunks.append(decoder.flush())
+        self.assert_("".join(chunks) == DATA)
+
+class DecompressingReaderTestCase(unittest.TestCase):
+
+    def _reader(self):
+        return DecompressingReader(StringIO(gzip_compress(DATA)),
+                get_decoder("gzip"))
+
+    def testRead(self):
+        reader = self._reader()
+        chunks = []
+        while True:
+            data = reader.read(1000)
+            if not data:
+                break
+            self.assert_(len(data) <= 1000)
+            chunks.append(data)
+        self.assert_("".join(chunks) == DATA)
+        self.assert_(self._reader().read() == DATA)
+
+    def testLines(self):
+        lines = list(self._reader())
+        self.assert_(len(lines) == 2000)
+        self.assert_("".join(lines) == DATA)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license. 
+# See the NOTICE for more information.
+#
+
+import threading
+import time
+import unittest
+
+from couchdbkit.executor import ThreadPoolExecutor, TimeoutError
+
+class ThreadPoolExecutorTestCase(unittest.TestCase):
+
+    def testSubmit(self):
+        executor = ThreadPoolExecutor(max_workers=2)
+        future = executor.submit(lambda a, b=0: a + b, 1, b=2)
+        self.assert_(future.result() == 3)
+        self.assert_(future.done())
+        self.assert_(future.exception() is None)
+
+        future = executor.submit(int, "a")
+        self.assertRaises(ValueError, future.result)
+        self.assert_(isinstance(future.exception(), ValueError))
+        executor.shutdown()
+        self.assertRaises(RuntimeError, executor.submit, int, "1")
+
+    def testConcurrency(self):
+        running = []
+        max_running = []
+        lock = threading.Lock()
+        def work(i):
+            lock.acquire()
+            running.append(i)
+            max_running.append(len(running))
+            lock.release()
+            time.sleep(0.05)
+            lock.acquire()
+            running.remove(i)
+            lock.release()
+            return i * 2
+
+        executor = ThreadPoolExecutor(max_workers=3)
+        self.assert_(list(executor.map(work, range(10))) ==
+                [i * 2 for i in range(10)])
+        self.assert_(max(max_running) == 3)
+        self.assert_(len(executor._threads) == 3)
+        executor.shutdown()
+
+    def testTimeoutAndCallbacks(self):
+        event = threading.Event()
+        done = []
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(event.wait)
+        future.add_done_callback(done.append)
+        self.assertRaises(TimeoutError, future.result, 0.05)
+        self.assert_(done == [])
+        event.set()
+        future.result()
+        self.assert_(done == [future])
+        future.add_done_callback(done.append)
+        self.assert_(done == [future, future])
+        executor.shutdown()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+#
+__author__ = 'benoitc@e-engura.com (Benoît Chesneau)'
+
+import os
+import subprocess
+import sys
+import unittest
+
+from nose.plugins.skip import SkipTest
+
+from couchdbkit.green import GreenPool, green_lib
+
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+class FakeConn(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+class GreenPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        if gevent is None:
+            raise SkipTest("gevent isn't installed")
+        self.pool = GreenPool("gevent", keepalive=2, timeout=300)
+
+    def tearDown(self):
+        if gevent is not None:
+            self.pool.close()
+
+    def testUnknownMode(self):
+        self.assertRaises(ValueError, green_lib, "tornado")
+
+    def testReuse(self):
+        conns = [FakeConn() for i in range(3)]
+        self.assert_(self.pool.get("host") is None)
+        for conn in conns:
+            self.pool.put("host", conn)
+        # only keepalive connections are kept
+        self.assert_(conns[2].closed)
+        self.assert_(self.pool.size("host") == 2)
+        # the last connection released is reused first
+        self.assert_(self.pool.get("host") is conns[1])
+        self.assert_(self.pool.get("host") is conns[0])
+        self.assert_(self.pool.get("host") is None)
+
+    def testExpire(self):
+        conn = FakeConn()
+        self.pool.put("host", conn)
+        self.pool.reap()
+        self.assert_(not conn.closed)
+        self.pool.timeout = -1
+        self.pool.put("host", FakeConn())
+        self.assert_(self.pool.get("host") is conn)
+        self.pool.reap()
+        self.assert_(self.pool.size("host") == 0)
+
+    def testClose(self):
+        conn = FakeConn()
+        self.pool.put("host", conn)
+        self.pool.close()
+        self.assert_(conn.closed)
+        conn = FakeConn()
+        self.pool.put("host", conn)
+        self.assert_(conn.closed)
+
+    def testStandin(self):
+        # the standard library is patched, run in another process
+        here = os.path.dirname(os.path.abspath(__file__))
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.pathsep.join([os.path.dirname(here),
+            env.get('PYTHONPATH', '')])
+        p = subprocess.Popen([sys.executable,
+            os.path.join(here, 'green_standin.py')], env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = p.communicate()[0]
+        self.assert_(p.returncode == 0, output)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+#
+
+import gc
+import os
+import socket
+import threading
+import time
+import unittest
+
+from couchdbkit.pool import ConnectionPool, PooledConnection, PoolTimeout
+
+class Listener(object):
+    """ accept connections and keep them open """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(50)
+        self.netloc = self.sock.getsockname()
+        self.accepted = []
+        t = threading.Thread(target=self.run)
+        t.setDaemon(True)
+        t.start()
+
+    def run(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.error:
+                return
+            self.accepted.append(conn)
+
+    def close(self):
+        for conn in self.accepted:
+            conn.close()
+        self.sock.close()
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = Listener()
+        self.netloc = self.listener.netloc
+
+    def tearDown(self):
+        self.listener.close()
+
+    def testReuse(self):
+        pool = ConnectionPool(keepalive=2)
+        conns = [pool.acquire(self.netloc) for i in range(3)]
+        self.assert_(isinstance(conns[0], PooledConnection))
+        self.assert_(isinstance(conns[0], socket.socket))
+        self.assert_(pool.stats()['active'] == 3)
+        for conn in conns:
+            pool.put(self.netloc, conn)
+
+        stats = pool.stats()
+        self.assert_(stats['created'] == 3)
+        self.assert_(stats['active'] == 0)
+        self.assert_(stats['idle'] == 2)
+        self.assert_(stats['discarded'] == 1)
+
+        # the last connection released is reused first
+        self.assert_(pool.acquire(self.netloc) is conns[1])
+        self.assert_(pool.stats()['reused'] == 1)
+
+    def testClose(self):
+        pool = ConnectionPool()
+        conn = pool.acquire(self.netloc)
+        conn.close()
+        stats = pool.stats()
+        self.assert_(stats['active'] == 0)
+        self.assert_(stats['discarded'] == 1)
+        # closing it twice doesn't count
+        conn.close()
+        self.assert_(pool.stats()['discarded'] == 1)
+
+    def testLost(self):
+        pool = ConnectionPool()
+        conn = pool.acquire(self.netloc)
+        del conn
+        gc.collect()
+        self.assert_(pool.stats()['active'] == 0)
+
+    def testExpire(self):
+        pool = ConnectionPool(timeout=0)
+        conn = pool.acquire(self.netloc)
+        pool.put(self.netloc, conn)
+        time.sleep(0.01)
+        conn2 = pool.acquire(self.netloc)
+        self.assert_(conn2 is not conn)
+        self.assert_(pool.stats()['discarded'] == 1)
+
+    def testClosedByServer(self):
+        pool = ConnectionPool()
+        conn = pool.acquire(self.netloc)
+        pool.put(self.netloc, conn)
+        time.sleep(0.05)
+        for accepted in self.listener.accepted:
+            accepted.close()
+        time.sleep(0.05)
+        self.assert_(pool.acquire(self.netloc) is not conn)
+        self.assert_(pool.stats()['reused'] == 0)
+
+    def testLimit(self):
+        pool = ConnectionPool(max_connections=2)
+        conns = [pool.acquire(self.netloc) for i in range(2)]
+        acquired = []
+        def acquire():
+            acquired.append(pool.acquire(self.netloc))
+        t = threading.Thread(target=acquire)
+        t.start()
+        time.sleep(0.1)
+        self.assert_(acquired == [])
+        pool.put(self.netloc, conns[0])
+        t.join()
+        self.assert_(acquired == [conns[0]])
+        stats = pool.stats()
+        self.assert_(stats['waits'] == 1)
+        self.assert_(stats['wait_time'] >= 0.1)
+        self.assert_(stats['created'] == 2)
+
+    def testWaitTimeout(self):
+        pool = ConnectionPool(max_connections=1, wait_timeout=0.05)
+        conn = pool.acquire(self.netloc)
+        self.assertRaises(PoolTimeout, pool.acquire, self.netloc)
+        self.assert_(pool.stats()['timeouts'] == 1)
+
+    def testPrewarm(self):
+        pool = ConnectionPool(keepalive=3)
+        self.assert_(pool.prewarm(self.netloc, 5) == 3)
+        self.assert_(pool.prewarm(self.netloc, 5) == 0)
+        stats = pool.stats()
+        self.assert_(stats['idle'] == 3)
+        self.assert_(stats['created'] == 3)
+        conn = pool.acquire(self.netloc)
+        self.assert_(pool.stats()['reused'] == 1)
+
+    def testFork(self):
+        pool = ConnectionPool()
+        pool.put(self.netloc, pool.acquire(self.netloc))
+        pid = os.fork()
+        if pid == 0:
+            # the child doesn't reuse connections of the parent
+            ok = False
+            try:
+                stats = pool.stats()
+                conn = pool.acquire(self.netloc)
+                ok = stats['idle'] == 0 and stats['created'] == 0 and \
+                        pool.stats()['reused'] == 0
+            finally:
+                os._exit(not ok)
+        status = os.waitpid(pid, 0)[1]
+        self.assert_(status == 0)
+        # the parent still can
+        pool.acquire(self.netloc)
+        self.assert_(pool.stats()['reused'] == 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+#
+
+import unittest
+
+from couchdbkit.profiler import normalize_params, ViewCall, ViewProfiler
+from couchdbkit.resource import ResourceNotFound, BufferedResponse
+
+def make_call(duration, path="/db/_design/d/_view/v"):
+    call = ViewCall(path, normalize_params({}))
+    call.server_time = duration / 2.0
+    call.read_time = duration / 2.0
+    return call
+
+class FakeDatabase(object):
+    dbname = "db"
+    view_profiler = None
+
+class FakeResponse(object):
+
+    status = "200 OK"
+    status_int = 200
+    version = (1, 1)
+    headerslist = []
+    headers = {}
+    final_url = "http://127.0.0.1:5984/db/_design/d/_view/v"
+    codec = None
+
+class FakeView(object):
+    view_path = "_design/d/_view/v"
+
+    def __init__(self, response=None, error=None):
+        self._db = FakeDatabase()
+        self.response = response
+        self.error = error
+
+    def _request(self, **params):
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+class NormalizeParamsTestCase(unittest.TestCase):
+
+    def testShape(self):
+        params = normalize_params({'startkey': ['a', 1], 'endkey': ['a', {}],
+            'limit': 10, 'group_level': 1, 'include_docs': True})
+        self.assert_(params == {'key': False, 'keys': None, 'range': True,
+            'limit': 10, 'group_level': 1, 'include_docs': True})
+        self.assert_(normalize_params({'key': 'a'}) ==
+                normalize_params({'key': 'b'}))
+        self.assert_(normalize_params({'keys': ['a', 'b']})['keys'] == 2)
+        self.assert_(normalize_params({'keys': iter(['a'])})['keys'] is True)
+
+class ViewProfilerTestCase(unittest.TestCase):
+
+    def testStats(self):
+        profiler = ViewProfiler(top_n=3, max_samples=100)
+        for i in range(1, 101):
+            call = make_call(i / 100.0)
+            call.rows = 2
+            call.bytes = 10
+            profiler._finish(call)
+        profiler._finish(make_call(5.0, path="/db/_temp_view"))
+
+        stats = profiler.stats()
+        self.assert_(len(stats) == 2)
+        entry = stats['/db/_design/d/_view/v']
+        self.assert_(entry['count'] == 100)
+        self.assert_(entry['samples'] == 100)
+        self.assert_(entry['p50'] == 0.5)
+        self.assert_(entry['p95'] == 0.95)
+        self.assert_(entry['p99'] == 0.99)
+        self.assert_(entry['min'] == 0.01)
+        self.assert_(entry['max'] == 1.0)
+        self.assert_(entry['rows'] == 200)
+        self.assert_(entry['bytes'] == 1000)
+
+        self.assert_([c.duration for c in profiler.slowest()] ==
+                [5.0, 1.0, 0.99])
+
+        # only the last samples are kept
+        profiler._finish(make_call(3.0))
+        entry = profiler.stats()['/db/_design/d/_view/v']
+        self.assert_(entry['count'] == 101)
+        self.assert_(entry['samples'] == 100)
+        self.assert_(entry['min'] == 0.02)
+
+        profiler.clear()
+        self.assert_(profiler.stats() == {})
+        self.assert_(profiler.slowest() == [])
+
+    def testError(self):
+        profiler = ViewProfiler()
+        view = FakeView(error=ResourceNotFound("missing", http_code=404))
+        self.assertRaises(ResourceNotFound, profiler.exec_view, view,
+                {'key': 'a'})
+        call = profiler.pop_call()
+        self.assert_(call.error == 'ResourceNotFound')
+        self.assert_(call.status == 404)
+        self.assert_(call.params['key'])
+        self.assert_(profiler.pop_call() is None)
+        self.assert_(profiler.stats()['/db/_design/d/_view/v']['errors'] == 1)
+
+    def testBufferedResponse(self):
+        profiler = ViewProfiler()
+        resp = BufferedResponse(FakeResponse(), '{"rows": []}')
+        view = FakeView(response=resp)
+        self.assert_(profiler.exec_view(view, {}) is resp)
+        call = resp.view_call
+        self.assert_(call.bytes == 12)
+        self.assert_(call.duration is not None)
+        self.assert_(profiler.slowest() == [call])
+
+if __name__ == '__main__':
+    unittest.main()
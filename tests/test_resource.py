@@ -5,10 +5,13 @@
 #
 __author__ = 'benoitc@e-engura.com (Benoît Chesneau)'
 
+from StringIO import StringIO
 import unittest
 
 from restkit.errors import RequestFailed, RequestError
-from couchdbkit.resource import CouchdbResource
+from couchdbkit.codec import decode
+from couchdbkit.compression import decompress
+from couchdbkit.resource import CouchdbResource, iter_rows, JSONStream
 
 
 class ServerTestCase(unittest.TestCase):
@@ -48,6 +51,89 @@ class ServerTestCase(unittest.TestCase):
         bad = CouchdbResource('http://localhost:10000')
         self.assertRaises(RequestFailed, bad.get)
         
+class IterRowsTestCase(unittest.TestCase):
+
+    def testIterRows(self):
+        body = StringIO('{"total_rows":3,"offset":1,"rows":[\r\n'
+            '{"id":"a","key":"a","value":{"s":"}{]["}},\r\n'
+            '{"id":"b","key":["b", "\\"rows\\""],"value":null},\r\n'
+            '{"id":"c","key":"c","value":[1,2,{"a":[]}]}\r\n'
+            ']}')
+        infos = []
+        rows = list(iter_rows(body, infos.append, chunk_size=3))
+        self.assert_(infos == [{"total_rows": 3, "offset": 1}])
+        self.assert_(len(rows) == 3)
+        self.assert_(rows[0]['value'] == {"s": "}{]["})
+        self.assert_(rows[1]['key'] == ["b", '"rows"'])
+        self.assert_(rows[2]['value'] == [1, 2, {"a": []}])
+
+    def testIterRowsTrailer(self):
+        body = StringIO('{"rows":[{"key":null,"value":4}],"update_seq":12}')
+        infos = []
+        rows = list(iter_rows(body, infos.append))
+        self.assert_(rows == [{"key": None, "value": 4}])
+        self.assert_(infos == [{}, {"update_seq": 12}])
+
+    def testIterRowsEmpty(self):
+        body = StringIO('{"total_rows":0,"offset":0,"rows":[]}')
+        infos = []
+        self.assert_(list(iter_rows(body, infos.append)) == [])
+        self.assert_(infos == [{"total_rows": 0, "offset": 0}])
+
+class JSONStreamTestCase(unittest.TestCase):
+
+    def testRead(self):
+        encoded = []
+        def docs():
+            for i in range(100):
+                encoded.append(i)
+                yield {"_id": "doc%s" % i, "s": u"\xe9\"]"}
+
+        stream = JSONStream({"docs": docs(), "all_or_nothing": True})
+        chunks = [stream.read(10)]
+        # only what is needed for the first chunk has been encoded
+        self.assert_(len(encoded) == 1)
+        self.assert_(len(chunks[0]) == 10)
+        while True:
+            data = stream.read(64)
+            if not data:
+                break
+            self.assert_(len(data) <= 64)
+            chunks.append(data)
+        body = decode("".join(chunks))
+        self.assert_(body['all_or_nothing'] == True)
+        self.assert_(len(body['docs']) == 100)
+        self.assert_(body['docs'][99] == {"_id": "doc99", "s": u"\xe9\"]"})
+
+    def testReadValues(self):
+        self.assert_(decode(JSONStream([]).read()) == [])
+        self.assert_(decode(JSONStream("a").read()) == "a")
+        body = JSONStream({"keys": (k for k in [1, [2], {"a": [3]}])})
+        self.assert_(decode(body.read()) == {"keys": [1, [2], {"a": [3]}]})
+
+    def testReadAll(self):
+        docs = [{"_id": "doc%s" % i, "value": "x" * 100} for i in range(1000)]
+        stream = JSONStream({"docs": iter(docs)})
+        first = stream.read(10)
+        rest = stream.read()
+        self.assert_(len(rest) > 100000)
+        self.assert_(decode(first + rest) == {"docs": docs})
+        self.assert_(stream.bytes_read == len(first) + len(rest))
+        self.assert_(stream.read(-1) == "")
+
+    def testReadCompressed(self):
+        docs = [{"_id": "doc%s" % i} for i in range(1000)]
+        stream = JSONStream({"docs": iter(docs)}, compress=6)
+        chunks = []
+        while True:
+            data = stream.read(512)
+            if not data:
+                break
+            chunks.append(data)
+        body = "".join(chunks)
+        self.assert_(stream.bytes_read == len(body))
+        self.assert_(decode(decompress(body, "gzip")) == {"docs": docs})
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+#
+
+import unittest
+
+from restkit.errors import RequestFailed, ResourceError
+
+from couchdbkit import Server
+from couchdbkit.pool import PoolTimeout
+from couchdbkit.retry import RetryPolicy, CircuitBreaker, CircuitOpen
+
+class Failing(object):
+    """ callable failing `count` times with `error` """
+
+    def __init__(self, count, error=None):
+        self.count = count
+        self.error = error or RequestFailed("connection refused")
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.count:
+            raise self.error
+        return "ok"
+
+class RetryPolicyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.waits = []
+        self.policy = RetryPolicy(max_retries=3, backoff=0.1, jitter=False,
+                failure_threshold=None, sleep=self.waits.append)
+
+    def testRetry(self):
+        func = Failing(2)
+        self.assert_(self.policy.call("http://a:5984/db", func) == "ok")
+        self.assert_(func.calls == 3)
+        self.assert_(self.waits == [0.1, 0.2])
+        stats = self.policy.stats()
+        self.assert_(stats['calls'] == 1)
+        self.assert_(stats['retries'] == 2)
+        self.assert_(stats['failures'] == 2)
+        self.assert_(stats['gave_up'] == 0)
+
+    def testGiveUp(self):
+        func = Failing(10, RequestFailed("unavailable", http_code=503))
+        self.assertRaises(RequestFailed, self.policy.call, "http://a", func)
+        self.assert_(func.calls == 4)
+        self.assert_(self.policy.stats()['gave_up'] == 1)
+
+    def testNotRetried(self):
+        # not a failure of the host
+        for error in (RequestFailed("bad request", http_code=400),
+                ResourceError("not found", http_code=404),
+                PoolTimeout("no free connection")):
+            func = Failing(1, error)
+            self.assertRaises(error.__class__, self.policy.call, "http://a",
+                    func)
+            self.assert_(func.calls == 1)
+
+        func = Failing(1)
+        self.assertRaises(RequestFailed, self.policy.call, "http://a", func,
+                retry=False)
+        self.assert_(func.calls == 1)
+        self.assert_(self.waits == [])
+
+    def testBackoff(self):
+        policy = RetryPolicy(backoff=1, max_backoff=5, jitter=False)
+        self.assert_([policy.backoff_time(i) for i in range(5)] ==
+                [1, 2, 4, 5, 5])
+        policy.jitter = True
+        for i in range(20):
+            self.assert_(0 <= policy.backoff_time(3) <= 5)
+
+    def testDeadline(self):
+        self.policy.deadline = 0.25
+        func = Failing(10)
+        self.assertRaises(RequestFailed, self.policy.call, "http://a", func)
+        # the third wait of 0.4s would end after the deadline
+        self.assert_(func.calls == 3)
+        self.assert_(self.waits == [0.1, 0.2])
+
+    def testCanRetry(self):
+        policy = self.policy
+        self.assert_(policy.can_retry('GET'))
+        self.assert_(policy.can_retry('PUT', '/db/doc', {}))
+        self.assert_(not policy.can_retry('POST', '/db', {'a': 1}))
+        self.assert_(not policy.can_retry('COPY', '/db/doc'))
+        self.assert_(policy.can_retry('POST', '/_bulk_docs',
+            {'docs': [{'_id': 'a'}, {'_id': 'b', '_rev': '1-a'}]}))
+        self.assert_(not policy.can_retry('POST', '/_bulk_docs',
+            {'docs': [{'_id': 'a'}, {'title': 'no id'}]}))
+        self.assert_(not policy.can_retry('POST', '/_bulk_docs', None))
+        self.assert_(not policy.can_retry('POST', '/_bulk_docs',
+            {'docs': [{'_id': 'a'}], 'all_or_nothing': True}))
+
+class CircuitBreakerTestCase(unittest.TestCase):
+
+    def testStates(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        self.assert_(breaker.allow(0))
+        breaker.failure(0)
+        self.assert_(breaker.state == 'closed')
+        breaker.failure(1)
+        self.assert_(breaker.state == 'open')
+        self.assert_(not breaker.allow(5))
+        # one trial after the timeout
+        self.assert_(breaker.allow(11))
+        self.assert_(breaker.state == 'half_open')
+        self.assert_(not breaker.allow(12))
+        breaker.failure(12)
+        self.assert_(breaker.state == 'open')
+        self.assert_(breaker.allow(22))
+        breaker.success()
+        self.assert_(breaker.state == 'closed')
+        self.assert_(breaker.trips == 1)
+
+    def testFailFast(self):
+        policy = RetryPolicy(max_retries=0, failure_threshold=2,
+                reset_timeout=60)
+        for i in range(2):
+            self.assertRaises(RequestFailed, policy.call, "http://a:5984/db",
+                    Failing(1))
+        func = Failing(0)
+        self.assertRaises(CircuitOpen, policy.call, "http://a:5984/other",
+                func)
+        self.assert_(func.calls == 0)
+        # circuits are by host
+        self.assert_(policy.call("http://b:5984/db", func) == "ok")
+        stats = policy.stats()
+        self.assert_(stats['rejected'] == 1)
+        self.assert_(stats['trips'] == 1)
+        self.assert_(stats['circuits'] == {'http://a:5984': 'open'})
+        policy.reset("http://a:5984")
+        self.assert_(policy.circuit_state("http://a:5984") == 'closed')
+
+class ServerRetryTestCase(unittest.TestCase):
+
+    def testUnreachable(self):
+        waits = []
+        policy = RetryPolicy(max_retries=2, failure_threshold=3,
+                sleep=waits.append)
+        server = Server("http://127.0.0.1:1", retry_policy=policy)
+        db = server['couchdbkit_test']
+        self.assert_(db.res.retry_policy is policy)
+        self.assertRaises(RequestFailed, db.res.get, 'doc')
+        self.assert_(len(waits) == 2)
+        self.assertRaises(CircuitOpen, db.res.get, 'doc')
+        self.assert_(policy.stats()['failures'] == 3)
+
+    def testEncodedBulkDocs(self):
+        waits = []
+        policy = RetryPolicy(max_retries=2, failure_threshold=None,
+                sleep=waits.append)
+        server = Server("http://127.0.0.1:1", retry_policy=policy)
+        db = server['couchdbkit_test']
+        # batches of bulk_save are encoded before they are posted
+        self.assertRaises(RequestFailed, db._post_bulk_docs,
+                [{'_id': 'a'}], ['{"_id":"a"}'])
+        self.assert_(len(waits) == 2)
+        self.assertRaises(RequestFailed, db._post_bulk_docs,
+                [{'title': 'no id'}], ['{"title":"no id"}'])
+        self.assertRaises(RequestFailed, db._post_bulk_docs,
+                [{'_id': 'a'}], ['{"_id":"a"}'], all_or_nothing=True)
+        self.assert_(len(waits) == 2)
@@ -209,6 +209,22 @@ class DocumentTestCase(unittest.TestCase):
 
         self.server.delete_db('couchdbkit_test')
 
+    def testGetMany(self):
+        db = self.server.create_db('couchdbkit_test')
+        class Test(Document):
+            string = StringProperty(default="test")
+        Test._db = db
+
+        docs = [Test(string="test%s" % i) for i in range(5)]
+        Test.bulk_save(docs)
+        ids = [doc._id for doc in reversed(docs)]
+        docs2 = Test.get_many(ids, chunk_size=2)
+        self.assert_(isinstance(docs2[0], Test))
+        self.assert_([doc.string for doc in docs2] ==
+                ["test4", "test3", "test2", "test1", "test0"])
+
+        self.server.delete_db('couchdbkit_test')
+
     def testLoadDynamicProperties(self):
         db = self.server.create_db('couchdbkit_test')
         class Test(Document):
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license. 
+# See the NOTICE for more information.
+#
+
+import threading
+import time
+import unittest
+
+from couchdbkit.singleflight import SingleFlight
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def _run(self, group, func, count=5):
+        results = []
+        def call():
+            try:
+                results.append(group.do('key', func))
+            except ValueError, e:
+                results.append(e)
+        threads = [threading.Thread(target=call) for i in range(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def testCollapse(self):
+        calls = []
+        def func():
+            calls.append(1)
+            time.sleep(0.2)
+            return len(calls)
+
+        group = SingleFlight()
+        self.assert_(self._run(group, func) == [1] * 5)
+        self.assert_(len(calls) == 1)
+        self.assert_(group.stats() == {'calls': 1, 'collapsed': 4,
+            'in_flight': 0})
+
+        # the call is done, next ones aren't collapsed
+        self.assert_(group.do('key', func) == 2)
+
+    def testError(self):
+        def func():
+            time.sleep(0.2)
+            raise ValueError("error")
+
+        group = SingleFlight()
+        results = self._run(group, func, count=3)
+        self.assert_(len(results) == 3)
+        for error in results:
+            self.assert_(isinstance(error, ValueError))
+        self.assert_(group.stats()['in_flight'] == 0)
+
+if __name__ == '__main__':
+    unittest.main()
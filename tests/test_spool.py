@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from restkit.errors import RequestFailed
+
+from couchdbkit.codec import get_codec
+from couchdbkit.spool import WriteSpool, encode_record, decode_record
+
+class FakeResource(object):
+
+    def __init__(self):
+        self.codec = get_codec('json')
+
+class FakeDatabase(object):
+    """ database answering `_bulk_docs` requests like CouchDB """
+
+    def __init__(self):
+        self.res = FakeResource()
+        self.docs = {}
+        self.requests = 0
+        self.fail = False
+        self.error = None
+
+    def _post_bulk_docs(self, docs, encoded, all_or_nothing=False):
+        self.requests += 1
+        if self.fail:
+            raise RequestFailed("connection refused")
+        if self.error is not None:
+            raise self.error
+        results = []
+        for doc in docs:
+            current = self.docs.get(doc['_id'])
+            if current is not None and current['_rev'] != doc.get('_rev'):
+                results.append({'id': doc['_id'], 'error': 'conflict',
+                    'reason': 'Document update conflict.'})
+                continue
+            gen = current and int(current['_rev'].split('-')[0]) or 0
+            doc['_rev'] = '%s-a' % (gen + 1)
+            self.docs[doc['_id']] = doc
+            results.append({'id': doc['_id'], 'rev': doc['_rev']})
+        return results
+
+    def _update_bulk_doc(self, doc, res):
+        doc.update({'_id': res['id'], '_rev': res['rev']})
+
+class WriteSpoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.db = FakeDatabase()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def spool(self, **params):
+        params.setdefault('replay_interval', None)
+        return WriteSpool(self.path, **params)
+
+    def testRecord(self):
+        line = encode_record('{"a": "b\\nc"}')
+        self.assert_(line.endswith("\n") and line.count("\n") == 1)
+        self.assert_(decode_record(line) == '{"a": "b\\nc"}')
+        self.assert_(decode_record(line[:-1]) is None)
+        self.assert_(decode_record(line.replace('b', 'x')) is None)
+        self.assert_(decode_record("garbage\n") is None)
+
+    def testAppendReplay(self):
+        spool = self.spool(batch_size=10)
+        docs = [{'n': i} for i in range(25)]
+        spool.append(docs)
+        self.assert_(len([doc for doc in docs if doc.get('_id')]) == 25)
+        self.assert_(spool.pending == 25)
+        self.assert_(spool.replay(self.db) == 25)
+        self.assert_(self.db.requests == 3)
+        self.assert_(len(self.db.docs) == 25)
+        stats = spool.stats()
+        self.assert_(stats['pending'] == 0)
+        self.assert_(stats['bytes'] == 0)
+        self.assert_(stats['segments'] == 0)
+        self.assert_(stats['replayed'] == 25)
+        self.assert_(stats['replay_rate'] > 0)
+
+        # appends after a replay start a new segment
+        spool.append([{'_id': 'next'}])
+        self.assert_(spool.replay(self.db) == 1)
+        self.assert_('next' in self.db.docs)
+
+    def testOutage(self):
+        spool = self.spool()
+        spool.append([{'_id': 'a'}, {'_id': 'b'}])
+        self.db.fail = True
+        self.assert_(spool.replay(self.db) == 0)
+        self.assert_(spool.pending == 2)
+        self.assert_(isinstance(spool.last_error, RequestFailed))
+        self.db.fail = False
+        self.assert_(spool.replay(self.db) == 2)
+        self.assert_(spool.pending == 0)
+
+    def testReopen(self):
+        spool = self.spool(segment_size=100, batch_size=3)
+        for i in range(10):
+            spool.append([{'_id': 'doc%s' % i, 'n': i}])
+        self.assert_(spool.stats()['segments'] > 1)
+        self.assert_(spool.replay(self.db, max_docs=4) == 4)
+        spool.close()
+
+        spool = self.spool()
+        self.assert_(spool.pending == 6)
+        self.assert_(spool.replay(self.db) == 6)
+        self.assert_(sorted(self.db.docs) == ['doc%s' % i for i in range(10)])
+        self.assert_(spool.stats()['conflicts'] == 0)
+        self.assert_(spool.stats()['segments'] == 0)
+
+    def testIdempotent(self):
+        errors = []
+        spool = self.spool(on_error=lambda doc, res: errors.append(res))
+        spool.append([{'_id': 'a', 'n': 1}, {'_id': 'b', 'n': 1}])
+        # the first try of the write reached the server
+        self.db._post_bulk_docs([{'_id': 'a', 'n': 1}], None)
+        self.assert_(spool.replay(self.db) == 2)
+        self.assert_(self.db.docs['a']['_rev'] == '1-a')
+        self.assert_([res['id'] for res in errors] == ['a'])
+        stats = spool.stats()
+        self.assert_(stats['replayed'] == 1)
+        self.assert_(stats['conflicts'] == 1)
+
+    def testQuarantine(self):
+        errors = []
+        spool = self.spool(batch_size=2,
+                on_error=lambda doc, res: errors.append(res))
+        spool.append([{'_id': 'a'}, {'_id': 'b'}, {'_id': 'c'}])
+        self.db.error = RequestFailed("too large", http_code=413)
+        self.assert_(spool.replay(self.db, max_docs=2) == 2)
+        self.db.error = None
+        self.assert_(spool.replay(self.db) == 1)
+        self.assert_(self.db.docs.keys() == ['c'])
+        self.assert_([res['error'] for res in errors] == ['quarantined'] * 2)
+        stats = spool.stats()
+        self.assert_(stats['pending'] == 0)
+        self.assert_(stats['quarantined'] == 2)
+        spool.close()
+
+        spool = self.spool()
+        self.assert_(spool.stats()['quarantined'] == 2)
+        self.assert_(spool.requeue_quarantined() == 2)
+        self.assert_(spool.pending == 2)
+        self.assert_(spool.replay(self.db) == 2)
+        self.assert_(sorted(self.db.docs) == ['a', 'b', 'c'])
+        self.assert_(spool.stats()['quarantined'] == 0)
+
+    def testLastWriteWins(self):
+        errors = []
+        spool = self.spool(on_error=lambda doc, res: errors.append(res))
+        spool.append([{'_id': 'a', 'n': 1}])
+        spool.append([{'_id': 'a', 'n': 2}])
+        self.assert_(spool.replay(self.db) == 2)
+        self.assert_(self.db.requests == 1)
+        self.assert_(self.db.docs['a']['n'] == 2)
+        self.assert_(spool.stats()['superseded'] == 1)
+
+        # saves of a doc in different batches
+        spool = self.spool(batch_size=1,
+                on_error=lambda doc, res: errors.append(res))
+        spool.append([{'_id': 'b', 'n': 1}])
+        spool.append([{'_id': 'b', 'n': 2}])
+        self.assert_(spool.replay(self.db) == 2)
+        self.assert_(self.db.docs['b']['n'] == 2)
+        self.assert_(self.db.docs['b']['_rev'] == '2-a')
+        self.assert_(errors == [])
+
+    def testCorrupt(self):
+        spool = self.spool()
+        spool.append([{'_id': 'a'}])
+        spool.close()
+        fname = os.path.join(self.path, os.listdir(self.path)[0])
+        f = open(fname, 'ab')
+        f.write("00000000 {}\n")
+        f.write(encode_record('{"_id": "torn"}')[:-3])
+        f.close()
+
+        spool = self.spool()
+        self.assert_(spool.pending == 1)
+        self.assert_(spool.replay(self.db) == 1)
+        self.assert_(spool.stats()['corrupt'] == 1)
+        self.assert_(self.db.docs.keys() == ['a'])
+
+    def testFsync(self):
+        self.assertRaises(ValueError, self.spool, fsync='sometimes')
+        spool = self.spool(fsync='never')
+        spool.append([{'_id': 'a'}])
+        spool.close()
+        self.assert_(spool.stats()['fsyncs'] == 0)
+        spool = self.spool(fsync='always')
+        spool.append([{'_id': 'b'}])
+        self.assert_(spool.stats()['fsyncs'] == 1)
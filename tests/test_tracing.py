@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license.
+# See the NOTICE for more information.
+#
+
+import logging
+import unittest
+
+from couchdbkit.tracing import path_template, RequestEvent, Tracer, \
+LatencyHistogram, SlowRequestLogger
+
+def make_event(duration, method="GET", path="/db/doc", status=200):
+    event = RequestEvent(method, path)
+    event.status = status
+    event.duration = duration
+    return event
+
+class PathTemplateTestCase(unittest.TestCase):
+
+    def testServer(self):
+        self.assert_(path_template('/') == '/')
+        self.assert_(path_template('/_uuids') == '/_uuids')
+        self.assert_(path_template('/db/') == '/db')
+
+    def testDocuments(self):
+        self.assert_(path_template('/db/doc') == '/db/{docid}')
+        self.assert_(path_template('/db/a%2Fb/file.txt') ==
+                '/db/{docid}/{attachment}')
+        self.assert_(path_template('/db/_local/doc') == '/db/_local/{docid}')
+
+    def testDatabase(self):
+        self.assert_(path_template('/db/_all_docs') == '/db/_all_docs')
+        self.assert_(path_template('/db/_bulk_docs') == '/db/_bulk_docs')
+
+    def testDesign(self):
+        self.assert_(path_template('/db/_design/d') == '/db/_design/d')
+        self.assert_(path_template('/db/_design/d/_view/v') ==
+                '/db/_design/d/_view/v')
+        self.assert_(path_template('/db/_design/d/_list/l/v') ==
+                '/db/_design/d/_list/l/v')
+        self.assert_(path_template('/db/_design/d/_show/s/doc') ==
+                '/db/_design/d/_show/s/{docid}')
+        self.assert_(path_template('/db/_design/d/file.js') ==
+                '/db/_design/d/{attachment}')
+
+class TracerTestCase(unittest.TestCase):
+
+    def testEmit(self):
+        events = []
+        def fail(event):
+            raise ValueError()
+        tracer = Tracer(fail, events.append)
+        event = RequestEvent("GET", "/db/doc")
+        tracer.emit(event)
+        self.assert_(events == [event])
+        self.assert_(event.duration >= 0)
+        self.assertRaises(TypeError, tracer.add_observer, None)
+
+class LatencyHistogramTestCase(unittest.TestCase):
+
+    def testStats(self):
+        histogram = LatencyHistogram(buckets=(0.01, 0.1, 1.0))
+        for i in range(90):
+            histogram(make_event(0.005))
+        for i in range(9):
+            histogram(make_event(0.05))
+        histogram(make_event(5.0, status=404))
+        histogram(make_event(0.05, method="PUT"))
+
+        stats = histogram.stats()
+        self.assert_(len(stats) == 2)
+        entry = stats[('GET', '/db/{docid}')]
+        self.assert_(entry['count'] == 100)
+        self.assert_(entry['errors'] == 1)
+        self.assert_(entry['min'] == 0.005)
+        self.assert_(entry['max'] == 5.0)
+        self.assert_(entry['p50'] == 0.01)
+        self.assert_(entry['p95'] == 0.1)
+        self.assert_(entry['p99'] == 0.1)
+        self.assert_(entry['buckets'] == [(0.01, 90), (0.1, 9), (1.0, 0),
+            (None, 1)])
+        self.assert_(stats[('PUT', '/db/{docid}')]['p50'] == 0.05)
+
+        histogram.clear()
+        self.assert_(histogram.stats() == {})
+
+class SlowRequestLoggerTestCase(unittest.TestCase):
+
+    def testLog(self):
+        records = []
+        class Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record.getMessage())
+        logger = logging.getLogger("couchdbkit.test.slow")
+        logger.addHandler(Handler())
+        observer = SlowRequestLogger(0.5, logger=logger)
+        observer(make_event(0.1))
+        slow = make_event(1.0)
+        slow.ttfb = 0.9
+        observer(slow)
+        self.assert_(len(records) == 1)
+        self.assert_("GET /db/{docid} 200 1.000s ttfb=0.900s" in records[0])
+
+if __name__ == '__main__':
+    unittest.main()
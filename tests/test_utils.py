@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license. 
+# See the NOTICE for more information.
+#
+
+import threading
+import time
+import unittest
+
+from couchdbkit.utils import read_ahead, imap_ordered
+
+class ReadAheadTestCase(unittest.TestCase):
+
+    def testReadAhead(self):
+        self.assert_(list(read_ahead(iter(range(10)), depth=3)) == range(10))
+
+    def testReadAheadBounded(self):
+        produced = []
+        def gen():
+            for i in range(100):
+                produced.append(i)
+                yield i
+        it = read_ahead(gen(), depth=2)
+        self.assert_(it.next() == 0)
+        time.sleep(0.2)
+        # 2 items buffered + 1 waiting to be queued
+        self.assert_(len(produced) <= 4)
+        it.close()
+
+    def testReadAheadStop(self):
+        closed = threading.Event()
+        def gen():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+            finally:
+                closed.set()
+        it = read_ahead(gen(), depth=2)
+        self.assert_(it.next() == 0)
+        it.close()
+        closed.wait(2)
+        self.assert_(closed.isSet())
+
+    def testReadAheadError(self):
+        def gen():
+            yield 1
+            raise KeyError("test")
+        it = read_ahead(gen())
+        self.assert_(it.next() == 1)
+        self.assertRaises(KeyError, it.next)
+
+class ImapOrderedTestCase(unittest.TestCase):
+
+    def testImapOrdered(self):
+        def func(i):
+            time.sleep(0.01 * (i % 3))
+            return i * 2
+        results = list(imap_ordered(func, range(20), concurrency=4))
+        self.assert_(results == [(i, i * 2) for i in range(20)])
+
+    def testImapOrderedConcurrency(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+        def func(i):
+            lock.acquire()
+            running.append(i)
+            peak.append(len(running))
+            lock.release()
+            time.sleep(0.02)
+            lock.acquire()
+            running.remove(i)
+            lock.release()
+        list(imap_ordered(func, range(12), concurrency=3))
+        self.assert_(max(peak) == 3)
+
+    def testImapOrderedError(self):
+        def func(i):
+            if i == 3:
+                raise KeyError(i)
+            return i
+        results = imap_ordered(func, range(10), concurrency=2)
+        self.assertRaises(KeyError, list, results)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -
+#
+# This file is part of couchdbkit released under the MIT license. 
+# See the NOTICE for more information.
+#
+
+import re
+import unittest
+
+from couchdbkit.uuids import get_uuid_generator, SequentialUUIDs, \
+UTCIdUUIDs
+
+re_hex = re.compile('^[0-9a-f]{32}$')
+
+class UUIDsTestCase(unittest.TestCase):
+
+    def testAlgorithms(self):
+        for algorithm in ("random", "sequential", "utc_random", "utc_id"):
+            gen = get_uuid_generator(algorithm)
+            uuids = [gen.next() for i in range(1000)]
+            self.assert_(len(set(uuids)) == 1000)
+            for uuid in uuids:
+                self.assert_(re_hex.match(uuid) is not None)
+
+    def testSequential(self):
+        gen = SequentialUUIDs()
+        uuids = [gen.next() for i in range(100)]
+        self.assert_(uuids == sorted(uuids))
+        self.assert_(len(set([uuid[:26] for uuid in uuids])) == 1)
+
+    def testSequentialOverflow(self):
+        gen = SequentialUUIDs()
+        prefix = gen.next()[:26]
+        gen._seq = 0xffefff
+        self.assert_(gen.next()[:26] != prefix)
+
+    def testUTC(self):
+        gen = get_uuid_generator("utc_random")
+        uuids = [gen.next() for i in range(100)]
+        prefixes = [uuid[:14] for uuid in uuids]
+        self.assert_(prefixes == sorted(prefixes))
+        gen = UTCIdUUIDs("0" * 18)
+        self.assert_(gen.next().endswith("0" * 18))
+
+    def testUnknownAlgorithm(self):
+        self.assertRaises(ValueError, get_uuid_generator, "unknown")
+
+if __name__ == '__main__':
+    unittest.main()